@@ -0,0 +1,2 @@
+# Бенчмарки производительности бота.
+# Запуск: python -m benchmarks.<имя_модуля>
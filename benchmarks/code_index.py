@@ -0,0 +1,156 @@
+"""
+Подсказки похожих кодов на каталогах разного размера.
+
+Для каждого размера каталога строится CodeIndex из синтетических кодов
+(цифровые разной длины и буквенно-цифровые), затем замеряется время подсказки
+для кодов с одной опечаткой (пропуск, лишний или замененный символ,
+перестановка соседних) и для случайных несуществующих кодов, доля опечаток,
+для которых исходный код оказался среди подсказок, и память индекса.
+Для сравнения - память словаря удалений (symmetric delete, как в SymSpell)
+и время линейного перебора каталога с расстоянием Дамерау-Левенштейна.
+
+Запуск: python -m benchmarks.code_index --sizes 100000,1000000
+"""
+import argparse
+import gc
+import random
+import string
+import time
+import tracemalloc
+from typing import Dict, List
+
+from database.code_index import CodeIndex, normalize_code
+from benchmarks.dispatcher.__main__ import percentiles
+
+
+def make_codes(count: int, rng: random.Random) -> List[str]:
+    """Уникальные коды: в основном цифровые из 4-7 цифр, каждый десятый - буква и цифры"""
+    codes = set()
+    while len(codes) < count:
+        if rng.random() < 0.1:
+            code = rng.choice(string.ascii_uppercase) + str(rng.randrange(100, 100000))
+        else:
+            code = str(rng.randrange(10 ** rng.randint(3, 6), 10 ** 7))
+        codes.add(code)
+    return list(codes)
+
+
+def typo(code: str, rng: random.Random) -> str:
+    """Одна случайная опечатка"""
+    position = rng.randrange(len(code))
+    kind = rng.choice(("delete", "insert", "replace", "transpose"))
+    digit = rng.choice(string.digits)
+    if kind == "delete" and len(code) > 2:
+        return code[:position] + code[position + 1:]
+    if kind == "insert":
+        return code[:position] + digit + code[position:]
+    if kind == "transpose" and position < len(code) - 1 and code[position] != code[position + 1]:
+        return code[:position] + code[position + 1] + code[position] + code[position + 2:]
+    replacement = rng.choice([symbol for symbol in string.digits if symbol != code[position]])
+    return code[:position] + replacement + code[position + 1:]
+
+
+def damerau_levenshtein(a: str, b: str) -> int:
+    """Расстояние Дамерау-Левенштейна (ограниченное, с перестановкой соседних символов)"""
+    previous2: List[int] = []
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def symmetric_delete_memory(codes: List[str]) -> int:
+    """Память словаря удалений на расстояние 1 (вариант с удаленным символом -> ключи)"""
+    gc.collect()
+    tracemalloc.start()
+    deletes: Dict[str, object] = {}
+    for code in codes:
+        key = normalize_code(code)
+        for variant in {key[:i] + key[i + 1:] for i in range(len(key))}:
+            existing = deletes.get(variant)
+            if existing is None:
+                deletes[variant] = key
+            elif isinstance(existing, list):
+                existing.append(key)
+            else:
+                deletes[variant] = [existing, key]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del deletes
+    return size
+
+
+def run(size: int, queries: int, linear_queries: int, rng: random.Random) -> None:
+    codes = make_codes(size, rng)
+    catalogue = set(codes)
+
+    started = time.perf_counter()
+    CodeIndex().load(codes)
+    build = time.perf_counter() - started
+
+    # Память замеряется отдельным построением: tracemalloc замедляет выделение памяти
+    gc.collect()
+    tracemalloc.start()
+    index = CodeIndex()
+    index.load(codes)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    samples = rng.sample(codes, queries)
+    typos = [(code, typo(code, rng)) for code in samples]
+    typos = [(code, wrong) for code, wrong in typos if wrong not in catalogue]
+    typo_latency, found, counts = [], 0, []
+    for code, wrong in typos:
+        started = time.perf_counter()
+        suggestions = index.suggest(wrong)
+        typo_latency.append(time.perf_counter() - started)
+        found += any(candidate == code for candidate, _ in suggestions)
+        counts.append(len(suggestions))
+
+    misses = []
+    while len(misses) < queries:
+        code = str(rng.randrange(10 ** 8, 10 ** 9))
+        if code not in catalogue:
+            misses.append(code)
+    miss_latency = []
+    for code in misses:
+        started = time.perf_counter()
+        index.suggest(code)
+        miss_latency.append(time.perf_counter() - started)
+
+    linear = []
+    for _, wrong in typos[:linear_queries]:
+        started = time.perf_counter()
+        [code for code in codes if abs(len(code) - len(wrong)) <= 1 and damerau_levenshtein(code, wrong) <= 1]
+        linear.append(time.perf_counter() - started)
+
+    typo_stats, miss_stats = percentiles(typo_latency), percentiles(miss_latency)
+    print(f"каталог {size} кодов: построение {build:.2f} с, память индекса {memory / 2 ** 20:.1f} МБ "
+          f"({memory / size:.0f} байт на код), словарь удалений {symmetric_delete_memory(codes) / 2 ** 20:.1f} МБ")
+    print(f"    опечатка:     p50 {typo_stats['p50_ms'] * 1000:6.1f} мкс  p99 {typo_stats['p99_ms'] * 1000:6.1f} мкс  "
+          f"исходный код среди подсказок: {found / len(typos):.1%}, подсказок в среднем {sum(counts) / len(counts):.1f}")
+    print(f"    нет похожих:  p50 {miss_stats['p50_ms'] * 1000:6.1f} мкс  p99 {miss_stats['p99_ms'] * 1000:6.1f} мкс")
+    if linear:
+        print(f"    линейный перебор каталога: {sum(linear) / len(linear) * 1000:.0f} мс на запрос")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100000,1000000", help="размеры каталога через запятую")
+    parser.add_argument("--queries", type=int, default=20000, help="запросов каждого вида")
+    parser.add_argument("--linear-queries", type=int, default=5, help="запросов для линейного перебора (0 - без него)")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    for size in (int(size) for size in args.sizes.split(",")):
+        run(size, args.queries, args.linear_queries, rng)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Задержка поиска фильма по коду под конкурентной нагрузкой.
+
+Сравнивает старую схему (синхронное соединение на каждый вызов прямо в цикле
+событий) с пулом соединений ConnectionPool. Запросы идут в пул напрямую, мимо
+кэша фильмов и отложенной записи счетчиков DatabaseManager, поэтому замеряется
+именно пул. Нагрузка открытая: запросы приходят с фиксированной частотой,
+задержка считается от момента поступления запроса, поэтому блокировка цикла
+событий одним запросом учитывается во всех остальных.
+
+Запуск: python -m benchmarks.db_pool --rate 2000 --duration 5
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from contextlib import closing
+from typing import Awaitable, Callable, List
+
+from database import DatabaseManager
+from database.pool import ConnectionPool
+
+
+class LegacyDatabase:
+    """Поведение DatabaseManager до перехода на пул: connect/close на каждый вызов"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+
+    def get_movie_by_code(self, code: str):
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        row = conn.execute("SELECT * FROM movies WHERE code = ?", (code,)).fetchone()
+        conn.close()
+        return dict(row) if row else None
+
+    def increment_click_count(self, user_id: int) -> int:
+        conn = sqlite3.connect(self.db_path)
+        row = conn.execute(
+            "UPDATE users SET click_count = click_count + 1 WHERE user_id = ? RETURNING click_count",
+            (user_id,)
+        ).fetchone()
+        conn.commit()
+        conn.close()
+        return row[0] if row else 0
+
+
+def seed(db_path: str, movies: int, users: int, wal: bool) -> None:
+    """Создание базы заданного размера"""
+    DatabaseManager(db_path).pool.close()
+    with closing(sqlite3.connect(db_path)) as conn:
+        if not wal:
+            conn.execute("PRAGMA journal_mode = DELETE")
+        conn.executemany(
+            "INSERT INTO movies (code, title) VALUES (?, ?)",
+            ((str(100000 + i), f"Фильм {i}") for i in range(movies))
+        )
+        conn.executemany(
+            "INSERT INTO users (user_id, first_name) VALUES (?, ?)",
+            ((1000000 + i, f"user{i}") for i in range(users))
+        )
+        conn.commit()
+
+
+async def run_load(lookup: Callable[[str], Awaitable], write: Callable[[int], Awaitable],
+                   movies: int, users: int, rate: float, duration: float,
+                   write_ratio: float) -> List[float]:
+    """Открытая нагрузка: возвращает задержки поиска в секундах"""
+    loop = asyncio.get_running_loop()
+    rnd = random.Random(42)
+    latencies: List[float] = []
+
+    async def request(scheduled: float, is_write: bool) -> None:
+        if is_write:
+            await write(1000000 + rnd.randrange(users))
+            return
+        await lookup(str(100000 + rnd.randrange(movies)))
+        latencies.append(loop.time() - scheduled)
+
+    tasks = []
+    start = loop.time()
+    for i in range(int(rate * duration)):
+        scheduled = start + i / rate
+        delay = scheduled - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(request(scheduled, rnd.random() < write_ratio)))
+    await asyncio.gather(*tasks)
+    return latencies
+
+
+def report(name: str, latencies: List[float], elapsed: float) -> None:
+    latencies = sorted(latencies)
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    print(
+        f"{name:<10} запросов: {len(latencies):>7}  "
+        f"p50: {p50:8.2f} мс  p99: {p99:8.2f} мс  "
+        f"среднее: {statistics.mean(latencies) * 1000:8.2f} мс  "
+        f"время: {elapsed:6.2f} с"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--movies", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--rate", type=float, default=2000, help="запросов в секунду")
+    parser.add_argument("--duration", type=float, default=5, help="длительность, секунд")
+    parser.add_argument("--write-ratio", type=float, default=0.1, help="доля запросов на запись")
+    parser.add_argument("--readers", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, "legacy.db")
+        pooled_path = os.path.join(tmp, "pooled.db")
+        seed(legacy_path, args.movies, args.users, wal=False)
+        seed(pooled_path, args.movies, args.users, wal=True)
+
+        legacy = LegacyDatabase(legacy_path)
+
+        async def legacy_lookup(code: str):
+            return legacy.get_movie_by_code(code)
+
+        async def legacy_write(user_id: int):
+            return legacy.increment_click_count(user_id)
+
+        started = time.perf_counter()
+        latencies = await run_load(legacy_lookup, legacy_write, args.movies, args.users,
+                                   args.rate, args.duration, args.write_ratio)
+        report("до", latencies, time.perf_counter() - started)
+
+        pool = ConnectionPool(pooled_path, readers=args.readers)
+
+        # Те же запросы, что и у LegacyDatabase
+        async def pooled_lookup(code: str):
+            row = await pool.fetchone("SELECT * FROM movies WHERE code = ?", (code,))
+            return dict(row) if row else None
+
+        async def pooled_write(user_id: int):
+            row = await pool.execute_fetchone(
+                "UPDATE users SET click_count = click_count + 1 WHERE user_id = ? RETURNING click_count",
+                (user_id,)
+            )
+            return row[0] if row else 0
+
+        started = time.perf_counter()
+        latencies = await run_load(pooled_lookup, pooled_write, args.movies, args.users,
+                                   args.rate, args.duration, args.write_ratio)
+        report("после", latencies, time.perf_counter() - started)
+        pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,110 @@
+"""
+Пиковое потребление памяти при обходе всех пользователей и фильмов.
+
+Сравнивает get_all_users/get_all_movies (вся таблица списком словарей) с
+потоковыми iter_users/iter_movies (keyset-пагинация и выбор нужных столбцов).
+Каждый вариант запускается в отдельном процессе, прирост пикового RSS
+считается относительно состояния после открытия базы.
+
+Запуск: python -m benchmarks.db_streaming --users 300000 --movies 100000
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import closing
+
+from database import DatabaseManager
+
+
+def seed(db_path: str, users: int, movies: int) -> None:
+    """Создание базы заданного размера"""
+    DatabaseManager(db_path).pool.close()
+    with closing(sqlite3.connect(db_path)) as conn:
+        conn.executemany(
+            "INSERT INTO users (user_id, username, first_name, last_name) VALUES (?, ?, ?, ?)",
+            ((1000000 + i, f"user{i}", f"Имя {i}", f"Фамилия {i}") for i in range(users))
+        )
+        conn.executemany(
+            "INSERT INTO movies (code, title) VALUES (?, ?)",
+            ((str(100000 + i), f"Фильм номер {i}") for i in range(movies))
+        )
+        conn.commit()
+
+
+def peak_rss_kb() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+async def child(db_path: str, mode: str, table: str) -> None:
+    """Один замер в отдельном процессе"""
+    db = DatabaseManager(db_path)
+    await db.count_users()
+    baseline = peak_rss_kb()
+    started = time.perf_counter()
+
+    total = 0
+    if table == "users":
+        if mode == "list":
+            for user in await db.get_all_users():
+                total += user["user_id"]
+        else:
+            async for user in db.iter_users(columns=("user_id",)):
+                total += user["user_id"]
+    else:
+        if mode == "list":
+            for movie in await db.get_all_movies():
+                total += len(movie["title"])
+        else:
+            async for movie in db.iter_movies(columns=("title",)):
+                total += len(movie["title"])
+
+    elapsed = time.perf_counter() - started
+    await db.close()
+    print(json.dumps({"peak_kb": peak_rss_kb() - baseline, "elapsed": elapsed, "checksum": total}))
+
+
+def run_child(db_path: str, mode: str, table: str) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.db_streaming", "--child", mode, "--table", table, "--db", db_path],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=300000)
+    parser.add_argument("--movies", type=int, default=100000)
+    parser.add_argument("--child", choices=("list", "stream"), help=argparse.SUPPRESS)
+    parser.add_argument("--table", choices=("users", "movies"), help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        asyncio.run(child(args.db, args.child, args.table))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "stream.db")
+        seed(db_path, args.users, args.movies)
+
+        for table, size in (("users", args.users), ("movies", args.movies)):
+            listed = run_child(db_path, "list", table)
+            streamed = run_child(db_path, "stream", table)
+            assert listed["checksum"] == streamed["checksum"]
+            print(
+                f"{table:<7} строк: {size:>8}  "
+                f"список: +{listed['peak_kb'] / 1024:7.1f} МБ за {listed['elapsed']:5.2f} с  "
+                f"поток: +{streamed['peak_kb'] / 1024:7.1f} МБ за {streamed['elapsed']:5.2f} с"
+            )
+
+
+if __name__ == "__main__":
+    main()
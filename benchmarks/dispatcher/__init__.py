@@ -0,0 +1,11 @@
+"""
+Пропускная способность бота целиком: настоящий Dispatcher из bot.py со всеми
+роутерами и middleware, базы реалистичного размера и Bot API, который
+отвечает прямо в процессе (session.FakeSession).
+
+Запуск: python -m benchmarks.dispatcher --users 1000000 --movies 100000 --updates 50000
+Сравнение результатов: python -m benchmarks.dispatcher --compare before.json after.json
+Очередь апдейтов с приоритетами под перегрузкой (без очереди и с ней):
+  python -m benchmarks.dispatcher --scenarios overload --concurrency 512 --api-latency 30 --scheduler-concurrency 0
+  python -m benchmarks.dispatcher --scenarios overload --concurrency 512 --api-latency 30
+"""
@@ -0,0 +1,300 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from array import array
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, List
+
+from benchmarks.dispatcher import __doc__ as DESCRIPTION
+from benchmarks.dispatcher.seed import FIRST_CODE, FIRST_USER_ID, seed
+from benchmarks.dispatcher.updates import Scenarios
+
+# Администраторы бота в бенчмарке (передаются через ADMIN_IDS)
+ADMIN_IDS = [900_000_000 + i for i in range(100)]
+
+
+def percentiles(values: Iterable[float]) -> Dict[str, float]:
+    ordered = sorted(values)
+    if not ordered:
+        return {"count": 0}
+    pick = lambda q: ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1000
+    return {
+        "count": len(ordered),
+        "p50_ms": round(pick(0.5), 3),
+        "p95_ms": round(pick(0.95), 3),
+        "p99_ms": round(pick(0.99), 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def memory_mb() -> Dict[str, float]:
+    """Текущая память процесса (RssAnon, Linux) и пиковый RSS"""
+    anon = 0
+    if os.path.exists("/proc/self/status"):
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("RssAnon"):
+                    anon = int(line.split()[1])
+    return {"anon_mb": round(anon / 1024, 1),
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+
+
+async def child(args) -> Dict[str, Any]:
+    """Один сценарий в отдельном процессе: база и ADMIN_IDS заданы через окружение"""
+    # Импорт здесь: config читает DB_PATH и ADMIN_IDS из окружения при импорте
+    from aiogram import BaseMiddleware, Bot
+    from aiogram.dispatcher.event.bases import UNHANDLED
+    from aiogram.types import Update
+
+    from bot import create_dispatcher
+    from config import CHANNELS, DB_PATH
+    from database import DatabaseManager
+    from benchmarks.dispatcher.session import FakeSession, TOKEN
+
+    started = time.perf_counter()
+    db = DatabaseManager(DB_PATH)
+    db_open = time.perf_counter() - started
+    dp = create_dispatcher(db)
+    session = FakeSession(latency=args.api_latency / 1000)
+    bot = Bot(TOKEN, session=session)
+
+    # Время каждого обработчика
+    handler_latency: Dict[str, array] = defaultdict(lambda: array("d"))
+
+    class HandlerTimer(BaseMiddleware):
+        async def __call__(self, handler, event, data):
+            started = time.perf_counter()
+            try:
+                return await handler(event, data)
+            finally:
+                handler_latency[data["handler"].callback.__name__].append(time.perf_counter() - started)
+
+    for name, observer in dp.observers.items():
+        if name not in ("update", "error"):
+            observer.middleware(HandlerTimer())
+
+    # Число запросов к базе по видам
+    queries: Dict[str, Dict[str, int]] = {"read": defaultdict(int), "write": defaultdict(int)}
+    db.pool.observer = lambda kind, query, wait, duration, failed: queries[kind].__setitem__(
+        query, queries[kind][query] + 1)
+
+    started = time.perf_counter()
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    startup = time.perf_counter() - started
+    after_startup = memory_mb()
+    for counts in queries.values():
+        counts.clear()
+    session.calls.clear()
+
+    scenarios = Scenarios(args.users, args.movies, FIRST_USER_ID, FIRST_CODE, ADMIN_IDS,
+                          CHANNELS[0]["id"] if CHANNELS else 0)
+    sessions = scenarios.sessions(args.scenario, args.updates)
+    update_latency = array("d")
+    # Задержка апдейтов по видам сессий: в смешанной нагрузке видно, кого обслуживают первым
+    kind_latency: Dict[str, array] = defaultdict(lambda: array("d"))
+    unhandled = 0
+
+    async def worker() -> None:
+        nonlocal unhandled
+        for raw_updates in sessions:
+            kind = kind_latency[Scenarios.kind(raw_updates)]
+            for raw in raw_updates:
+                update = Update.model_validate(raw, context={"bot": bot})
+                begun = time.perf_counter()
+                if await dp.feed_update(bot, update) is UNHANDLED:
+                    unhandled += 1
+                latency = time.perf_counter() - begun
+                update_latency.append(latency)
+                kind.append(latency)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    peak = memory_mb()
+
+    # Отложенные записи (счетчики, состояния FSM) попадают в базу при остановке
+    await dp.emit_shutdown(bot=bot, dispatcher=dp)
+
+    updates = len(update_latency)
+    writes = sum(queries["write"].values())
+    return {
+        "scenario": args.scenario,
+        "updates": updates,
+        "unhandled": unhandled,
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_sec": round(updates / elapsed, 1),
+        "db_open_s": round(db_open, 4),
+        "startup_s": round(startup, 3),
+        "update_latency": percentiles(update_latency),
+        "update_latency_by_kind": {name: percentiles(values) for name, values in sorted(kind_latency.items())},
+        "handlers": {name: percentiles(values) for name, values in sorted(handler_latency.items())},
+        "db": {
+            "reads": sum(queries["read"].values()),
+            "writes": writes,
+            "writes_per_1k_updates": round(writes * 1000 / updates, 2) if updates else 0,
+            "by_query": {kind: dict(sorted(counts.items())) for kind, counts in queries.items()},
+        },
+        "api_calls": dict(sorted(session.calls.items())),
+        "memory": {"after_startup": after_startup, "after_load": peak},
+    }
+
+
+def run_child(args, scenario: str, db_path: str) -> Dict[str, Any]:
+    env = dict(os.environ, DB_PATH=db_path, ADMIN_IDS=",".join(map(str, ADMIN_IDS)))
+    if args.scheduler_concurrency is not None:
+        env["SCHEDULER_CONCURRENCY"] = str(args.scheduler_concurrency)
+    command = [
+        sys.executable, "-m", "benchmarks.dispatcher", "--child", scenario,
+        "--users", str(args.users), "--movies", str(args.movies), "--updates", str(args.updates),
+        "--concurrency", str(args.concurrency), "--api-latency", str(args.api_latency),
+    ]
+    process = subprocess.run(command, env=env, capture_output=True, text=True)
+    if process.returncode:
+        sys.stderr.write(process.stderr)
+        raise SystemExit(f"Сценарий {scenario} завершился с ошибкой")
+    return json.loads(process.stdout)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def report(result: Dict[str, Any]) -> None:
+    latency = result["update_latency"]
+    print(
+        f"{result['scenario']:<7} {result['updates_per_sec']:8.0f} апд/с  "
+        f"p50: {latency['p50_ms']:7.2f} мс  p99: {latency['p99_ms']:7.2f} мс  "
+        f"записей в базу на 1000 апдейтов: {result['db']['writes_per_1k_updates']:7.1f}  "
+        f"память: {result['memory']['after_load']['anon_mb']:6.1f} МБ  "
+        f"запуск: {result['startup_s']:.2f} с (база {result.get('db_open_s', 0) * 1000:.1f} мс)"
+    )
+    for name, stats in result["handlers"].items():
+        print(f"    {name:<24} {stats['count']:>8}  p50: {stats['p50_ms']:7.2f} мс  p99: {stats['p99_ms']:7.2f} мс")
+    by_kind = result.get("update_latency_by_kind", {})
+    if len(by_kind) > 1:
+        for name, stats in by_kind.items():
+            print(f"    апдейты {name:<15} {stats['count']:>8}  p50: {stats['p50_ms']:7.2f} мс  "
+                  f"p99: {stats['p99_ms']:7.2f} мс")
+    if result["unhandled"]:
+        print(f"    без обработчика: {result['unhandled']}")
+
+
+def compare(before_path: str, after_path: str) -> None:
+    """Сравнение двух сохраненных результатов по общим сценариям"""
+    with open(before_path) as file:
+        before = json.load(file)
+    with open(after_path) as file:
+        after = json.load(file)
+    print(f"до: {before['meta'].get('commit') or before_path}  после: {after['meta'].get('commit') or after_path}")
+
+    def line(title: str, old: float, new: float, unit: str) -> None:
+        change = (new - old) / old * 100 if old else 0.0
+        print(f"    {title:<36} {old:10.2f} -> {new:10.2f} {unit:<6} ({change:+.1f}%)")
+
+    for scenario, new in after["results"].items():
+        old = before["results"].get(scenario)
+        if old is None:
+            continue
+        print(scenario)
+        line("апдейтов в секунду", old["updates_per_sec"], new["updates_per_sec"], "")
+        line("p50 апдейта", old["update_latency"]["p50_ms"], new["update_latency"]["p50_ms"], "мс")
+        line("p99 апдейта", old["update_latency"]["p99_ms"], new["update_latency"]["p99_ms"], "мс")
+        line("записей в базу на 1000 апдейтов", old["db"]["writes_per_1k_updates"],
+             new["db"]["writes_per_1k_updates"], "")
+        line("память после нагрузки", old["memory"]["after_load"]["anon_mb"],
+             new["memory"]["after_load"]["anon_mb"], "МБ")
+        line("запуск", old["startup_s"], new["startup_s"], "с")
+        if "db_open_s" in old and "db_open_s" in new:
+            line("открытие базы", old["db_open_s"] * 1000, new["db_open_s"] * 1000, "мс")
+        for name, stats in new["handlers"].items():
+            if name in old["handlers"] and stats["count"] and old["handlers"][name]["count"]:
+                line(f"p99 {name}", old["handlers"][name]["p99_ms"], stats["p99_ms"], "мс")
+        old_kinds = old.get("update_latency_by_kind", {})
+        for name, stats in new.get("update_latency_by_kind", {}).items():
+            if len(old_kinds) > 1 and name in old_kinds:
+                line(f"p99 апдейтов {name}", old_kinds[name]["p99_ms"], stats["p99_ms"], "мс")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=DESCRIPTION, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--movies", type=int, default=100000)
+    parser.add_argument("--updates", type=int, default=50000, help="апдейтов на сценарий")
+    parser.add_argument("--concurrency", type=int, default=64, help="апдейтов, обрабатываемых одновременно")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка ответа Bot API, мс")
+    parser.add_argument("--scheduler-concurrency", type=int,
+                        help="SCHEDULER_CONCURRENCY бота (0 - без очереди с приоритетами); очередь "
+                             "с приоритетами заполняется, только если --concurrency больше этого значения")
+    parser.add_argument("--scenarios", default=",".join(Scenarios.NAMES),
+                        help=f"через запятую из: {', '.join(Scenarios.NAMES)}")
+    parser.add_argument("--workdir", help="каталог для заполненной базы (чтобы не создавать ее заново)")
+    parser.add_argument("--output", help="файл результатов (по умолчанию benchmark-results/dispatcher-<время>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="сравнить два файла результатов")
+    parser.add_argument("--child", choices=Scenarios.NAMES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    if args.child:
+        args.scenario = args.child
+        print(json.dumps(asyncio.run(child(args))))
+        return
+
+    scenarios: List[str] = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    workdir = args.workdir or tempfile.mkdtemp(prefix="moviebot-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    seed_path = os.path.join(workdir, f"seed-{args.users}-{args.movies}.db")
+    started = time.perf_counter()
+    seed(seed_path, args.users, args.movies)
+    print(f"база: {args.users} пользователей, {args.movies} фильмов ({time.perf_counter() - started:.1f} с)")
+
+    results: Dict[str, Any] = {}
+    try:
+        for scenario in scenarios:
+            # Каждый сценарий работает с копией исходной базы
+            db_path = os.path.join(workdir, f"run-{scenario}.db")
+            shutil.copyfile(seed_path, db_path)
+            results[scenario] = run_child(args, scenario, db_path)
+            report(results[scenario])
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(db_path + suffix):
+                    os.remove(db_path + suffix)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or os.path.join(
+        "benchmark-results", f"dispatcher-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as file:
+        json.dump({
+            "meta": {
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "args": {key: value for key, value in vars(args).items() if key not in ("compare", "child")},
+            },
+            "results": results,
+        }, file, ensure_ascii=False, indent=2)
+    print(f"результаты сохранены в {output}")
+
+
+if __name__ == "__main__":
+    main()
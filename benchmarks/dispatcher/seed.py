@@ -0,0 +1,32 @@
+import os
+import sqlite3
+from contextlib import closing
+
+from database import DatabaseManager
+
+FIRST_USER_ID = 1_000_000_000
+FIRST_CODE = 100000
+
+
+def seed(db_path: str, users: int, movies: int) -> None:
+    """Создание базы с users пользователями и movies фильмами (если ее еще нет)"""
+    if os.path.exists(db_path):
+        return
+
+    tmp_path = db_path + ".tmp"
+    DatabaseManager(tmp_path).pool.close()
+    with closing(sqlite3.connect(tmp_path)) as conn:
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.executemany(
+            "INSERT INTO users (user_id, username, first_name, last_name, click_count) VALUES (?, ?, ?, ?, ?)",
+            ((FIRST_USER_ID + i, f"user{FIRST_USER_ID + i}", f"Имя {FIRST_USER_ID + i}", None, i % 3)
+             for i in range(users))
+        )
+        conn.executemany(
+            "INSERT INTO movies (code, title, usage_count) VALUES (?, ?, ?)",
+            ((str(FIRST_CODE + i), f"Фильм номер {i}", (i * 7919) % 1000) for i in range(movies))
+        )
+        conn.commit()
+        # Файл базы без журнала WAL, чтобы его можно было просто скопировать
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    os.replace(tmp_path, db_path)
@@ -0,0 +1,72 @@
+import asyncio
+import json
+import time
+from collections import Counter
+from typing import Any, AsyncGenerator, Dict, Mapping, Optional
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+
+BOT_ID = 123456
+TOKEN = f"{BOT_ID}:BENCHMARK-TOKEN"
+
+# Методы, результатом которых является сообщение
+MESSAGE_METHODS = {"sendMessage", "sendVideo", "sendDocument", "sendPhoto", "editMessageText",
+                   "editMessageReplyMarkup"}
+
+
+class FakeSession(BaseSession):
+    """
+    Сессия aiogram, которая отвечает на запросы к Bot API прямо в процессе,
+    без сети. Ответ проходит обычный разбор check_response, поэтому затраты
+    aiogram на десериализацию учитываются. latency имитирует задержку сети.
+    """
+
+    def __init__(self, latency: float = 0.0, member_status: str = "member"):
+        super().__init__()
+        self.latency = latency
+        self.member_status = member_status
+        self.calls: Counter = Counter()
+        self._next_message_id = 0
+
+    def _result(self, name: str, params: Dict[str, Any]) -> Any:
+        if name in MESSAGE_METHODS:
+            self._next_message_id += 1
+            chat_id = params.get("chat_id") or 0
+            return {
+                "message_id": self._next_message_id,
+                "date": int(time.time()),
+                "chat": {"id": int(chat_id) if str(chat_id).lstrip("-").isdigit() else 0, "type": "private"},
+                "text": params.get("text") or "",
+            }
+        if name == "copyMessage":
+            self._next_message_id += 1
+            return {"message_id": self._next_message_id}
+        if name == "getChatMember":
+            user = {"id": params["user_id"], "is_bot": False, "first_name": "user"}
+            return {"status": self.member_status, "user": user}
+        if name == "getMe":
+            return {"id": BOT_ID, "is_bot": True, "first_name": "Benchmark", "username": "benchmark_bot"}
+        return True
+
+    async def make_request(self, bot: Bot, method: TelegramMethod[TelegramType],
+                           timeout: Optional[int] = None) -> TelegramType:
+        name = method.__api_method__
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        params = method.model_dump(exclude_none=True)
+        content = json.dumps({"ok": True, "result": self._result(name, params)})
+        response = self.check_response(bot=bot, method=method, status_code=200, content=content)
+        return response.result
+
+    async def stream_content(self, url: str, headers: Optional[Mapping[str, Any]] = None,
+                             timeout: int = 30, chunk_size: int = 65536,
+                             raise_for_status: bool = True) -> AsyncGenerator[bytes, None]:
+        yield b""
+
+    async def close(self) -> None:
+        pass
@@ -0,0 +1,147 @@
+"""
+Синтетические апдейты и сценарии нагрузки.
+
+Сценарий - это бесконечный поток сессий. Сессия - последовательность апдейтов
+одного пользователя, которые обрабатываются по порядку (например, «Ввести код»
+и затем сам код); разные сессии обрабатываются параллельно.
+"""
+import itertools
+import random
+import time
+from typing import Any, Callable, Dict, Iterator, List
+
+# Апдейт в виде JSON, как его присылает Telegram
+RawUpdate = Dict[str, Any]
+Session = List[RawUpdate]
+
+_update_ids = itertools.count(1)
+
+
+def _user(user_id: int) -> Dict[str, Any]:
+    return {"id": user_id, "is_bot": False, "first_name": f"Имя {user_id}", "username": f"user{user_id}"}
+
+
+def message(user_id: int, text: str) -> RawUpdate:
+    """Текстовое сообщение (команды размечаются как bot_command)"""
+    update_id = next(_update_ids)
+    data: Dict[str, Any] = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": _user(user_id),
+        "text": text,
+    }
+    if text.startswith("/"):
+        data["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": data}
+
+
+def chat_join_request(user_id: int, channel_id: int) -> RawUpdate:
+    """Заявка на вступление в канал"""
+    update_id = next(_update_ids)
+    return {
+        "update_id": update_id,
+        "chat_join_request": {
+            "chat": {"id": channel_id, "type": "channel", "title": "Канал"},
+            "from": _user(user_id),
+            "user_chat_id": user_id,
+            "date": int(time.time()),
+        },
+    }
+
+
+class Scenarios:
+    """
+    Генераторы сессий для базы, заполненной seed.seed(): пользователи
+    first_user_id.., коды фильмов first_code.. . Доля miss_ratio запросов
+    приходится на несуществующие коды, доля new_ratio сессий /start - на
+    новых пользователей.
+    """
+
+    def __init__(self, users: int, movies: int, first_user_id: int, first_code: int,
+                 admin_ids: List[int], channel_id: int, miss_ratio: float = 0.2,
+                 new_ratio: float = 0.5, seed: int = 1):
+        self.users = users
+        self.movies = movies
+        self.first_user_id = first_user_id
+        self.first_code = first_code
+        self.admin_ids = admin_ids
+        self.channel_id = channel_id
+        self.miss_ratio = miss_ratio
+        self.new_ratio = new_ratio
+        self.random = random.Random(seed)
+        # Каждая сессия достается новому пользователю, чтобы не срабатывал антифлуд
+        self._known = itertools.count()
+        self._new = itertools.count(first_user_id + users)
+        self._admins = itertools.count()
+
+    def _known_user(self) -> int:
+        return self.first_user_id + next(self._known) % self.users
+
+    def _code(self) -> str:
+        if self.random.random() < self.miss_ratio:
+            return str(self.first_code + self.movies + self.random.randrange(self.movies))
+        return str(self.first_code + self.random.randrange(self.movies))
+
+    def start(self) -> Session:
+        """/start от нового или уже известного пользователя"""
+        new = self.random.random() < self.new_ratio
+        return [message(next(self._new) if new else self._known_user(), "/start")]
+
+    def lookup(self) -> Session:
+        """«Ввести код» и затем код фильма"""
+        user_id = self._known_user()
+        return [message(user_id, "Ввести код"), message(user_id, self._code())]
+
+    def join(self) -> Session:
+        """Заявка в канал с автоматическим одобрением"""
+        return [chat_join_request(self._known_user(), self.channel_id)]
+
+    def admin(self) -> Session:
+        """Вход в админ-панель, первая страница каталога и выход"""
+        # По кругу, чтобы сессии одного администратора не шли одновременно
+        admin_id = self.admin_ids[next(self._admins) % len(self.admin_ids)]
+        return [message(admin_id, "/admin"), message(admin_id, "Список фильмов"),
+                message(admin_id, "Выйти из админ-панели")]
+
+    # Доли сценариев в смешанной нагрузке
+    MIX = (("start", 0.2), ("lookup", 0.6), ("join", 0.15), ("admin", 0.05))
+
+    def mixed(self) -> Session:
+        """Смесь сценариев в пропорциях MIX"""
+        name = self.random.choices([name for name, _ in self.MIX], [weight for _, weight in self.MIX])[0]
+        return getattr(self, name)()
+
+    # Перегрузка: поток /start и заявок, среди которого ищут фильмы и работают администраторы
+    OVERLOAD_MIX = (("start", 0.45), ("lookup", 0.2), ("join", 0.3), ("admin", 0.05))
+
+    def overload(self) -> Session:
+        """Смесь сценариев в пропорциях OVERLOAD_MIX (запускать с большим --concurrency)"""
+        name = self.random.choices([name for name, _ in self.OVERLOAD_MIX],
+                                   [weight for _, weight in self.OVERLOAD_MIX])[0]
+        return getattr(self, name)()
+
+    NAMES = ("start", "lookup", "join", "admin", "mixed", "overload")
+
+    @staticmethod
+    def kind(session: Session) -> str:
+        """Сценарий, к которому относится сессия (для задержки по видам в смешанной нагрузке)"""
+        first = session[0]
+        if "chat_join_request" in first:
+            return "join"
+        text = first["message"]["text"]
+        if text == "/start":
+            return "start"
+        if text == "/admin":
+            return "admin"
+        return "lookup"
+
+    def sessions(self, name: str, updates: int) -> Iterator[Session]:
+        """Сессии сценария name, пока не наберется updates апдейтов"""
+        factory: Callable[[], Session] = getattr(self, name)
+        produced = 0
+        while produced < updates:
+            session = factory()
+            produced += len(session)
+            yield session
+
@@ -0,0 +1,243 @@
+"""
+Локальный HTTP-сервер, имитирующий Telegram Bot API.
+
+Отвечает на любые методы и работает источником синтетических апдейтов:
+отдает их через getUpdates (polling) или сам отправляет POST-запросами на
+вебхук бота, как это делает Telegram. Время ответов бота (sendMessage и т.п.)
+запоминается, чтобы считать задержку от отправки апдейта до ответа.
+
+Запускается отдельным процессом, чтобы генерация нагрузки не отнимала
+процессорное время у бота:
+    python -m benchmarks.fake_api --port 8081
+Управление: POST /control/load?count=&rate=&webhook= запускает нагрузку,
+GET /control/stats возвращает результаты.
+"""
+import argparse
+import asyncio
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+BOT_ID = 123456
+TOKEN = f"{BOT_ID}:BENCHMARK-TOKEN"
+FIRST_USER_ID = 10_000_000
+
+# Методы, результатом которых является сообщение
+MESSAGE_METHODS = {"sendMessage", "sendVideo", "sendDocument", "editMessageText"}
+
+
+def make_update(update_id: int, user_id: int, text: str) -> Dict[str, Any]:
+    """Синтетический апдейт с текстовым сообщением"""
+    user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+    message: Dict[str, Any] = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private", "first_name": user["first_name"]},
+        "from": user,
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+    return {"update_id": update_id, "message": message}
+
+
+class FakeTelegramAPI:
+    def __init__(self, host: str = "127.0.0.1", port: int = 8081):
+        self.host = host
+        self.port = port
+        self.updates: List[Dict[str, Any]] = []
+        self._has_updates = asyncio.Event()
+        self._next_message_id = 1
+        # chat_id -> время отправки апдейта и время первого ответа бота
+        self.sent_at: Dict[int, float] = {}
+        self.replied_at: Dict[int, float] = {}
+        self.rejected = 0
+        self.calls: Dict[str, int] = {}
+        self._runner: Optional[web.AppRunner] = None
+        self._load: Optional[asyncio.Task] = None
+
+    async def _get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+
+        self.updates = [update for update in self.updates if update["update_id"] >= offset]
+        if not self.updates and timeout:
+            self._has_updates.clear()
+            try:
+                await asyncio.wait_for(self._has_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:limit]
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+        if method == "getUpdates":
+            result: Any = await self._get_updates(params)
+        elif method == "getMe":
+            result = {"id": BOT_ID, "is_bot": True, "first_name": "Benchmark", "username": "benchmark_bot"}
+        elif method in MESSAGE_METHODS or method == "copyMessage":
+            chat_id = int(params.get("chat_id", 0))
+            self.replied_at.setdefault(chat_id, time.perf_counter())
+            self._next_message_id += 1
+            result = {
+                "message_id": self._next_message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": params.get("text", ""),
+            }
+            if method == "copyMessage":
+                result = {"message_id": self._next_message_id}
+        elif method == "getChatMember":
+            user_id = int(params.get("user_id", 0))
+            result = {"status": "member", "user": {"id": user_id, "is_bot": False, "first_name": "user"}}
+        else:
+            result = True
+
+        return web.json_response({"ok": True, "result": result})
+
+    async def generate(self, count: int, rate: float, text: str, webhook: str = "",
+                       users: int = 0) -> None:
+        """Отправка count апдейтов с частотой rate (0 - без пауз)"""
+        client = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=100)) if webhook else None
+        pending = []
+
+        async def post(update: Dict[str, Any]) -> None:
+            # Как и Telegram, повторяем доставку, если вебхук ответил ошибкой
+            while True:
+                async with client.post(webhook, json=update) as response:
+                    if response.status == 200:
+                        return
+                self.rejected += 1
+                await asyncio.sleep(0.05)
+
+        started = time.perf_counter()
+        for i in range(count):
+            if rate:
+                delay = started + i / rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            user_id = FIRST_USER_ID + (i % users if users else i)
+            update = make_update(i + 1, user_id, text)
+            self.sent_at.setdefault(user_id, time.perf_counter())
+            if webhook:
+                pending.append(asyncio.create_task(post(update)))
+            else:
+                self.updates.append(update)
+                self._has_updates.set()
+
+        if client:
+            await asyncio.gather(*pending)
+            await client.close()
+
+    async def control_load(self, request: web.Request) -> web.Response:
+        query = request.query
+        self._load = asyncio.create_task(self.generate(
+            int(query["count"]), float(query.get("rate", 0)), query.get("text", "привет"),
+            query.get("webhook", ""), int(query.get("users", 0))
+        ))
+        return web.json_response({"ok": True})
+
+    async def control_stats(self, request: web.Request) -> web.Response:
+        latencies = sorted(
+            self.replied_at[chat] - sent for chat, sent in self.sent_at.items() if chat in self.replied_at
+        )
+        stats: Dict[str, Any] = {"replied": len(latencies), "rejected": self.rejected, "calls": self.calls}
+        if latencies:
+            elapsed = max(self.replied_at.values()) - min(self.sent_at.values())
+            stats.update(
+                throughput=len(latencies) / elapsed if elapsed else 0.0,
+                p50=latencies[len(latencies) // 2],
+                p99=latencies[int(len(latencies) * 0.99)],
+            )
+        return web.json_response(stats)
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_post("/control/load", self.control_load)
+        app.router.add_get("/control/stats", self.control_stats)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+
+
+class FakeTelegramProcess:
+    """Управление сервером FakeTelegramAPI, запущенным в отдельном процессе"""
+
+    def __init__(self, port: int = 8081):
+        self.port = port
+        self.base_url = f"http://127.0.0.1:{port}"
+        self._process: Optional[subprocess.Popen] = None
+
+    def session(self) -> AiohttpSession:
+        """Сессия aiogram, которая ходит в фиктивный API вместо api.telegram.org"""
+        return AiohttpSession(api=TelegramAPIServer.from_base(self.base_url))
+
+    async def __aenter__(self) -> "FakeTelegramProcess":
+        self._process = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.fake_api", "--port", str(self.port)]
+        )
+        # Ждем, пока сервер начнет принимать соединения
+        async with aiohttp.ClientSession() as client:
+            for _ in range(100):
+                try:
+                    async with client.get(f"{self.base_url}/control/stats"):
+                        return self
+                except aiohttp.ClientConnectionError:
+                    await asyncio.sleep(0.1)
+        raise RuntimeError("Фиктивный Telegram API не запустился")
+
+    async def __aexit__(self, *exc: Any) -> None:
+        self._process.terminate()
+        self._process.wait()
+
+    async def load(self, count: int, rate: float, text: str = "привет", webhook: str = "",
+                   users: int = 0) -> None:
+        async with aiohttp.ClientSession() as client:
+            params = {"count": count, "rate": rate, "text": text, "webhook": webhook, "users": users}
+            async with client.post(f"{self.base_url}/control/load", params=params):
+                pass
+
+    async def stats(self) -> Dict[str, Any]:
+        async with aiohttp.ClientSession() as client:
+            async with client.get(f"{self.base_url}/control/stats") as response:
+                return await response.json()
+
+    async def wait_replies(self, count: int, timeout: float = 300) -> Dict[str, Any]:
+        """Ожидание ответов бота на count апдейтов, возвращает статистику"""
+        deadline = time.monotonic() + timeout
+        while True:
+            stats = await self.stats()
+            if stats["replied"] >= count or time.monotonic() > deadline:
+                return stats
+            await asyncio.sleep(0.2)
+
+
+async def serve(port: int) -> None:
+    api = FakeTelegramAPI(port=port)
+    await api.start()
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8081)
+    try:
+        asyncio.run(serve(parser.parse_args().port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,179 @@
+"""
+Память и задержка хранилищ FSM при большом числе пользователей.
+
+Сравнивает MemoryStorage с SQLiteStorage. Каждый пользователь присылает два
+апдейта, как в реальном сценарии: нажимает «Ввести код» (чтение состояния
+и переход в waiting_for_code) и затем присылает код (чтение состояния и, для
+половины пользователей, сброс состояния). Апдейты обрабатываются пачками
+параллельно, задержка считается на один апдейт. Каждый вариант запускается
+в отдельном процессе, прирост пикового RSS считается относительно состояния
+до начала нагрузки. Для SQLiteStorage также проверяется, что состояния
+сохраняются после перезапуска.
+
+Запуск: python -m benchmarks.fsm_storage --users 1000000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from array import array
+from typing import Dict
+
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from database import DatabaseManager, SQLiteStorage
+
+BOT_ID = 123456
+FIRST_USER_ID = 10_000_000
+
+
+# Копия UserStates из handlers/user.py (импорт обработчиков открывает рабочую базу)
+class UserStates(StatesGroup):
+    waiting_for_code = State()
+
+
+def make_key(user_id: int) -> StorageKey:
+    return StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id)
+
+
+def peak_rss_kb() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def rss_kb() -> Dict[str, int]:
+    """
+    Текущий RSS по видам (Linux): RssAnon - память процесса, RssFile - страницы
+    файлов, в том числе отображенной в память (mmap) базы данных
+    """
+    result = {}
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith(("RssAnon", "RssFile")):
+                name, value, _ = line.split()
+                result[name.rstrip(":")] = int(value)
+    return result
+
+
+async def enter_code_button(storage: BaseStorage, key: StorageKey) -> None:
+    """Апдейт «Ввести код»: FSM читает состояние, обработчик его меняет"""
+    await storage.get_state(key)
+    await storage.set_state(key, UserStates.waiting_for_code)
+
+
+async def send_code(storage: BaseStorage, key: StorageKey, clear: bool) -> None:
+    """Апдейт с кодом фильма: после ответа состояние сбрасывается"""
+    await storage.get_state(key)
+    if clear:
+        await storage.set_state(key, None)
+        await storage.set_data(key, {})
+
+
+async def timed(latencies: array, update) -> None:
+    started = time.perf_counter()
+    await update
+    latencies.append(time.perf_counter() - started)
+
+
+async def run_phase(storage: BaseStorage, users: int, concurrency: int, latencies: array,
+                    second: bool) -> None:
+    for start in range(0, users, concurrency):
+        updates = []
+        for user_id in range(FIRST_USER_ID + start, FIRST_USER_ID + min(start + concurrency, users)):
+            key = make_key(user_id)
+            update = send_code(storage, key, user_id % 2 == 0) if second else enter_code_button(storage, key)
+            updates.append(timed(latencies, update))
+        await asyncio.gather(*updates)
+
+
+async def child(mode: str, db_path: str, users: int, concurrency: int, hot_size: int) -> None:
+    """Один замер в отдельном процессе"""
+    db = DatabaseManager(db_path)
+    if mode == "memory":
+        storage: BaseStorage = MemoryStorage()
+    else:
+        storage = SQLiteStorage(db.pool, hot_size=hot_size)
+        await storage.start()
+    baseline = peak_rss_kb()
+    baseline_anon = rss_kb()["RssAnon"]
+
+    # array вместо списка, чтобы сами замеры почти не занимали памяти
+    latencies = array("d")
+    started = time.perf_counter()
+    await run_phase(storage, users, concurrency, latencies, second=False)
+    await run_phase(storage, users, concurrency, latencies, second=True)
+    elapsed = time.perf_counter() - started
+    peak_kb = peak_rss_kb() - baseline
+    anon_kb = rss_kb()["RssAnon"] - baseline_anon
+
+    restored = None
+    if mode == "sqlite":
+        await storage.close()
+        # Новое хранилище на той же базе: состояния должны сохраниться
+        restarted = SQLiteStorage(db.pool, hot_size=hot_size)
+        sample = random.sample(range(FIRST_USER_ID, FIRST_USER_ID + users), min(users, 1000))
+        restored = 0
+        for user_id in sample:
+            expected = None if user_id % 2 == 0 else UserStates.waiting_for_code.state
+            restored += await restarted.get_state(make_key(user_id)) == expected
+        restored = restored / len(sample)
+    await db.close()
+
+    latencies = sorted(latencies)
+    print(json.dumps({
+        "peak_kb": peak_kb,
+        "anon_kb": anon_kb,
+        "elapsed": elapsed,
+        "updates": len(latencies),
+        "p50": latencies[len(latencies) // 2],
+        "p99": latencies[int(len(latencies) * 0.99)],
+        "restored": restored,
+    }))
+
+
+def run_child(mode: str, db_path: str, args) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.fsm_storage", "--child", mode, "--db", db_path,
+         "--users", str(args.users), "--concurrency", str(args.concurrency), "--hot-size", str(args.hot_size)],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--concurrency", type=int, default=100, help="апдейтов, обрабатываемых одновременно")
+    parser.add_argument("--hot-size", type=int, default=10000, help="записей в памяти у SQLiteStorage")
+    parser.add_argument("--child", choices=("memory", "sqlite"), help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        asyncio.run(child(args.child, args.db, args.users, args.concurrency, args.hot_size))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ("memory", "sqlite"):
+            result = run_child(mode, os.path.join(tmp, f"{mode}.db"), args)
+            line = (
+                f"{mode:<7} пользователей: {args.users:>8}  "
+                f"пик RSS: +{result['peak_kb'] / 1024:6.1f} МБ  "
+                f"из них память процесса: +{result['anon_kb'] / 1024:6.1f} МБ  "
+                f"{result['updates'] / result['elapsed']:8.0f} апд/с  "
+                f"p50: {result['p50'] * 1000:6.2f} мс  p99: {result['p99'] * 1000:6.2f} мс"
+            )
+            if result["restored"] is not None:
+                line += f"  сохранилось после перезапуска: {result['restored']:.0%}"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
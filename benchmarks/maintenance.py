@@ -0,0 +1,148 @@
+"""
+Задержка поиска фильма во время резервного копирования базы под нагрузкой.
+
+База заполняется пользователями и фильмами (как в benchmarks.dispatcher),
+затем на нее подается открытая нагрузка: поиски по коду через пул соединений
+и доля записей. Во время нагрузки база копируется одним из способов:
+  нет           - без копии (задержка для сравнения)
+  файл          - копирование файла базы (так делают вручную; без WAL копия
+                  может быть несогласованной)
+  backup        - backup API SQLite за один шаг
+  обслуживание  - DatabaseMaintenance: копия шагами с паузами по нагрузке,
+                  проверка и сжатие
+Для каждого способа печатаются задержки поиска за время копии и длительность
+копии; нагрузка идет, пока копия не закончится (но не меньше --duration секунд).
+
+Запуск: python -m benchmarks.maintenance --users 1000000 --movies 100000 --rate 1000
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from contextlib import closing
+from typing import Awaitable, Callable, List, Optional
+
+from benchmarks.dispatcher.__main__ import percentiles
+from benchmarks.dispatcher.seed import FIRST_CODE, FIRST_USER_ID, seed
+from database import DatabaseManager
+from utils.maintenance import DatabaseMaintenance
+
+MODES = ("нет", "файл", "backup", "обслуживание")
+
+
+def backup_once(db_path: str, target_path: str) -> None:
+    with closing(sqlite3.connect(db_path)) as source, closing(sqlite3.connect(target_path)) as target:
+        source.backup(target)
+
+
+async def run_load(db: DatabaseManager, users: int, movies: int, rate: float, write_ratio: float,
+                   copy: Callable[[], Awaitable[None]], duration: float) -> tuple:
+    """Открытая нагрузка во время copy(): задержки поиска в секундах и длительность копии"""
+    loop = asyncio.get_running_loop()
+    rnd = random.Random(42)
+    latencies: List[float] = []
+    copy_time: List[float] = []
+
+    async def request(scheduled: float) -> None:
+        if rnd.random() < write_ratio:
+            await db.pool.execute("UPDATE users SET click_count = click_count + 1 WHERE user_id = ?",
+                                  (FIRST_USER_ID + rnd.randrange(users),))
+            return
+        await db.pool.fetchone("SELECT * FROM movies WHERE code = ?", (str(FIRST_CODE + rnd.randrange(movies)),))
+        latencies.append(loop.time() - scheduled)
+
+    async def timed_copy() -> None:
+        started = time.perf_counter()
+        await copy()
+        copy_time.append(time.perf_counter() - started)
+
+    copier = asyncio.create_task(timed_copy())
+    tasks = []
+    start = loop.time()
+    i = 0
+    while not copier.done() or loop.time() - start < duration:
+        scheduled = start + i / rate
+        delay = scheduled - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(request(scheduled)))
+        i += 1
+    await asyncio.gather(*tasks)
+    await copier
+    return latencies, copy_time[0]
+
+
+async def run_mode(mode: str, db_path: str, workdir: str, args: argparse.Namespace) -> None:
+    db = DatabaseManager(db_path)
+    target = os.path.join(workdir, "copy.db")
+    maintenance: Optional[DatabaseMaintenance] = None
+    loop = asyncio.get_running_loop()
+
+    if mode == "нет":
+        async def copy() -> None:
+            pass
+    elif mode == "файл":
+        async def copy() -> None:
+            await loop.run_in_executor(None, shutil.copyfile, db_path, target)
+    elif mode == "backup":
+        async def copy() -> None:
+            await loop.run_in_executor(None, backup_once, db_path, target)
+    else:
+        maintenance = DatabaseMaintenance(db, os.path.join(workdir, "backups"), quiet_rate=args.quiet_rate,
+                                          first_delay=3600, checkpoint_interval=3600)
+        await maintenance.start()
+
+        async def copy() -> None:
+            maintenance.request_backup()
+            backups = maintenance.backups + maintenance.backup_failures
+            while maintenance.backups + maintenance.backup_failures == backups:
+                await asyncio.sleep(0.05)
+
+    latencies, elapsed = await run_load(db, args.users, args.movies, args.rate, args.write_ratio, copy,
+                                        args.duration)
+    stats = percentiles(latencies)
+    line = (f"{mode:<13} поисков: {len(latencies):>7}  p50: {stats['p50_ms']:7.2f} мс  "
+            f"p99: {stats['p99_ms']:7.2f} мс  max: {max(latencies) * 1000:7.1f} мс  копия: {elapsed:6.1f} с")
+    if maintenance is not None:
+        info = maintenance.stats()
+        line += (f"  ({info['last_backup_size'] / 2 ** 20:.0f} МБ сжато, "
+                 f"пробный запрос {info['probe_idle'] * 1000:.2f} -> {info['probe_busy'] * 1000:.2f} мс)")
+        await maintenance.stop()
+    print(line)
+    await db.close()
+    for path in (target, target + "-wal", target + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--movies", type=int, default=100000)
+    parser.add_argument("--rate", type=float, default=1000, help="запросов в секунду")
+    parser.add_argument("--write-ratio", type=float, default=0.05, help="доля запросов на запись")
+    parser.add_argument("--duration", type=float, default=5, help="наименьшая длительность нагрузки, секунд")
+    parser.add_argument("--quiet-rate", type=float, default=50,
+                        help="нагрузка, ниже которой обслуживание копирует без замедления")
+    parser.add_argument("--modes", default=",".join(MODES), help="способы копирования через запятую")
+    parser.add_argument("--workdir", help="каталог для базы (по умолчанию временный)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = args.workdir or tmp
+        os.makedirs(workdir, exist_ok=True)
+        db_path = os.path.join(workdir, f"bench-{args.users}-{args.movies}.db")
+        seed(db_path, args.users, args.movies)
+        print(f"база: {os.path.getsize(db_path) / 2 ** 20:.0f} МБ, нагрузка {args.rate:.0f} запросов в секунду")
+        for mode in args.modes.split(","):
+            await run_mode(mode, db_path, workdir, args)
+            if os.path.isdir(os.path.join(workdir, "backups")):
+                shutil.rmtree(os.path.join(workdir, "backups"))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,103 @@
+"""
+Пропускная способность и задержка в режимах polling и webhook.
+
+Бот работает с фиктивным Telegram Bot API (benchmarks/fake_api.py), запущенным
+в отдельном процессе. В режиме polling синтетические апдейты отдаются боту
+через getUpdates, в режиме webhook фиктивный API сам отправляет их POST-запросами
+на локальный сервер вебхука (WebhookServer). Задержка считается от отправки
+апдейта до получения ответа бота (sendMessage).
+
+Запуск: python -m benchmarks.webhook_load --updates 5000 --rate 1000
+"""
+import argparse
+import asyncio
+from typing import Any, Dict
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher, Router
+from aiogram.types import Message
+
+from benchmarks.fake_api import FakeTelegramProcess, TOKEN
+from utils.webhook import WebhookServer
+
+
+def make_dispatcher(handler_delay: float) -> Dispatcher:
+    router = Router()
+
+    @router.message()
+    async def reply(message: Message):
+        # Имитация работы обработчика (запросы к базе данных и т.п.)
+        await asyncio.sleep(handler_delay)
+        await message.answer("ok")
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    return dp
+
+
+async def run_polling(args) -> Dict[str, Any]:
+    async with FakeTelegramProcess(args.api_port) as api:
+        bot = Bot(TOKEN, session=api.session())
+        dp = make_dispatcher(args.delay)
+        polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, polling_timeout=1))
+
+        await api.load(args.updates, args.rate)
+        stats = await api.wait_replies(args.updates)
+
+        await dp.stop_polling()
+        await polling
+        return stats
+
+
+async def run_webhook(args) -> Dict[str, Any]:
+    async with FakeTelegramProcess(args.api_port) as api:
+        bot = Bot(TOKEN, session=api.session())
+        dp = make_dispatcher(args.delay)
+
+        server = WebhookServer(dp, bot, "/webhook", workers=args.workers, queue_size=args.queue_size)
+        app = web.Application()
+        server.setup(app)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", args.webhook_port).start()
+
+        await api.load(args.updates, args.rate, webhook=f"http://127.0.0.1:{args.webhook_port}/webhook")
+        stats = await api.wait_replies(args.updates)
+
+        await runner.cleanup()
+        await bot.session.close()
+        return stats
+
+
+def report(name: str, stats: Dict[str, Any]) -> None:
+    if not stats["replied"]:
+        print(f"{name:<8} ответов нет")
+        return
+    print(
+        f"{name:<8} ответов: {stats['replied']:>6}  "
+        f"пропускная способность: {stats['throughput']:8.0f} апд/с  "
+        f"p50: {stats['p50'] * 1000:8.2f} мс  p99: {stats['p99'] * 1000:8.2f} мс  "
+        f"повторных доставок (503): {stats['rejected']}"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--rate", type=float, default=1000, help="апдейтов в секунду, 0 - без ограничения")
+    parser.add_argument("--delay", type=float, default=0.005, help="время работы обработчика, секунд")
+    parser.add_argument("--workers", type=int, default=32, help="обработчиков вебхука")
+    parser.add_argument("--queue-size", type=int, default=1000, help="очередь вебхука")
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--webhook-port", type=int, default=8082)
+    parser.add_argument("--mode", choices=("polling", "webhook", "both"), default="both")
+    args = parser.parse_args()
+
+    if args.mode in ("polling", "both"):
+        report("polling", await run_polling(args))
+    if args.mode in ("webhook", "both"):
+        report("webhook", await run_webhook(args))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,118 @@
+"""
+Масштабирование по числу процессов-обработчиков (WORKERS).
+
+Процесс бенчмарка играет роль приемщика: разбирает синтетические апдейты
+(как после getUpdates) и распределяет их через WorkerPool по процессам,
+в которых работает настоящий диспетчер бота с фиктивной сессией Bot API
+и общей базой SQLite. Замеряется время от первого апдейта до обработки
+последнего.
+
+    python -m benchmarks.workers --workers 1,2,4 --scenario mixed
+
+На машине с одним ядром ускорения не будет: процессы делят одно ядро,
+и бенчмарк показывает только накладные расходы передачи апдейтов.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+from functools import partial
+from typing import Any, Dict, List
+
+from benchmarks.dispatcher.__main__ import ADMIN_IDS, git_commit
+from benchmarks.dispatcher.seed import FIRST_CODE, FIRST_USER_ID, seed
+from benchmarks.dispatcher.session import TOKEN, FakeSession
+from benchmarks.dispatcher.updates import Scenarios
+
+CHANNEL_ID = -1001234567890
+
+
+async def run(workers: int, db_path: str, args) -> Dict[str, Any]:
+    # Процессы-обработчики читают настройки из окружения при запуске
+    os.environ.update(DB_PATH=db_path, BOT_TOKEN=TOKEN, ADMIN_IDS=",".join(map(str, ADMIN_IDS)),
+                      METRICS_PORT="0", WORKER_CONCURRENCY=str(args.concurrency))
+
+    from aiogram import Bot, Dispatcher
+    from aiogram.types import Update
+
+    from bot import run_worker
+    from utils.workers import WorkerPool
+
+    pool = WorkerPool(run_worker, workers, queue_size=args.queue_size,
+                      args=(partial(FakeSession, latency=args.api_latency / 1000),))
+    ingress = Dispatcher(disable_fsm=True)
+    ingress.update.outer_middleware(pool.forward)
+    bot = Bot(TOKEN, session=FakeSession())
+
+    scenarios = Scenarios(args.users, args.movies, FIRST_USER_ID, FIRST_CODE, ADMIN_IDS, CHANNEL_ID)
+    raw_updates = [raw for session in scenarios.sessions(args.scenario, args.updates) for raw in session]
+
+    started = time.perf_counter()
+    await pool.start()
+    await pool.wait_ready()
+    startup = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for raw in raw_updates:
+        await ingress.feed_update(bot, Update.model_validate(raw, context={"bot": bot}))
+    forwarded = time.perf_counter() - started
+    while pool.stats()["processed"] < len(raw_updates):
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+
+    stats = pool.stats()
+    started = time.perf_counter()
+    await pool.stop()
+    return {
+        "workers": workers,
+        "updates": len(raw_updates),
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_sec": round(len(raw_updates) / elapsed, 1),
+        "ingress_us_per_update": round(forwarded / len(raw_updates) * 1e6, 1),
+        "startup_s": round(startup, 3),
+        "stop_s": round(time.perf_counter() - started, 3),
+        "by_worker": stats["forwarded_by_worker"],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4", help="числа процессов через запятую")
+    parser.add_argument("--scenario", default="mixed", choices=Scenarios.NAMES)
+    parser.add_argument("--users", type=int, default=200000)
+    parser.add_argument("--movies", type=int, default=20000)
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=32, help="параллельных апдейтов в процессе")
+    parser.add_argument("--queue-size", type=int, default=1000)
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка ответа Bot API, мс")
+    parser.add_argument("--output", help="файл результатов в JSON")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="moviebot-workers-")
+    results: List[Dict[str, Any]] = []
+    try:
+        seed_path = os.path.join(workdir, "seed.db")
+        seed(seed_path, args.users, args.movies)
+        for workers in (int(value) for value in args.workers.split(",")):
+            db_path = os.path.join(workdir, f"run-{workers}.db")
+            shutil.copyfile(seed_path, db_path)
+            result = asyncio.run(run(workers, db_path, args))
+            result["speedup"] = round(result["updates_per_sec"] / results[0]["updates_per_sec"], 2) if results else 1.0
+            results.append(result)
+            print(f"процессов: {workers}  {result['updates_per_sec']:8.0f} апд/с  "
+                  f"ускорение: {result['speedup']:.2f}  приемщик: {result['ingress_us_per_update']:.0f} мкс/апд  "
+                  f"запуск: {result['startup_s']:.2f} с  остановка: {result['stop_s']:.2f} с")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"meta": {"commit": git_commit(), "cpus": os.cpu_count(), "args": vars(args)},
+                       "results": results}, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
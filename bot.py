@@ -1,11 +1,38 @@
 import asyncio
 import logging
+from typing import Any, Callable, Optional
+
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.session.base import BaseSession
 from aiogram.types import BotCommand
 
-from config import BOT_TOKEN, ADMIN_IDS
+from config import (BOT_TOKEN, ADMIN_IDS, DB_PATH, CHANNELS, BROADCAST_RATE, BROADCAST_WORKERS,
+                    JOIN_APPROVE_RATE, JOIN_APPROVE_WORKERS,
+                    BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT,
+                    WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, FSM_HOT_SIZE, FSM_IDLE_TTL,
+                    THROTTLE_LOOKUP_RATE, THROTTLE_LOOKUP_BURST, THROTTLE_ADMIN_RATE, THROTTLE_ADMIN_BURST,
+                    THROTTLE_RATE, THROTTLE_BURST, METRICS_HOST, METRICS_PORT,
+                    SCHEDULER_CONCURRENCY, SCHEDULER_ADMIN_LIMIT, SCHEDULER_LOOKUP_LIMIT,
+                    SCHEDULER_REGISTRATION_LIMIT, SCHEDULER_DEFAULT_LIMIT,
+                    WORKERS, WORKER_CONCURRENCY, WORKER_QUEUE_SIZE, CATALOGUE_POLL_INTERVAL, MEDIA_CHAT_ID,
+                    BACKUP_DIR, BACKUP_INTERVAL, BACKUP_KEEP, MAINTENANCE_QUIET_RATE)
+from database import DatabaseManager, SQLiteStorage, migrate
 from handlers import user_router, admin_router, channel_requests_router
+from handlers.user import UserStates
+from keyboards import SuggestCallback
+from middlewares import BotMetrics, RegistrationMiddleware, SchedulingMiddleware, ThrottlingMiddleware
+from middlewares.scheduling import PRIORITIES, REGISTRATION
+from middlewares.throttling import LOOKUP, ADMIN, DEFAULT
+from utils.broadcast import BroadcastManager
+from utils.catalogue import MovieCatalogue
+from utils.channel_manager import ChannelManager
+from utils.delivery import MovieDelivery
+from utils.join_queue import JoinApprover
+from utils.maintenance import DatabaseMaintenance
+from utils.metrics import MetricsRegistry, MetricsServer
+from utils.scheduler import PriorityScheduler
+from utils.webhook import run_webhook
+from utils.workers import Partition, WorkerPool, ignore_stop_signals, serve_queue
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -18,24 +45,219 @@ async def set_commands(bot: Bot):
     ]
     await bot.set_my_commands(commands)
 
-async def main():
-    # Инициализация бота и диспетчера
-    bot = Bot(token=BOT_TOKEN)
-    dp = Dispatcher(storage=MemoryStorage())
+def create_dispatcher(db: DatabaseManager, partition: Optional[Partition] = None) -> Dispatcher:
+    """
+    Диспетчер со всеми роутерами, middleware и фоновыми задачами бота.
+    partition - доля пользователей процесса-обработчика, если процессов несколько
+    """
+    owns = partition.owns if partition is not None else None
+    # Состояния FSM хранятся в базе данных и переживают перезапуск
+    storage = SQLiteStorage(db.pool, hot_size=FSM_HOT_SIZE, idle_ttl=FSM_IDLE_TTL)
+    dp = Dispatcher(storage=storage)
+    
+    # Один менеджер базы данных на весь бот: обработчики получают его как аргумент db
+    dp["db"] = db
+    
+    # Антифлуд до фильтров и обработчиков; состояние FSM к этому моменту уже прочитано
+    throttling = ThrottlingMiddleware(
+        ADMIN_IDS,
+        limits={
+            LOOKUP: (THROTTLE_LOOKUP_RATE, THROTTLE_LOOKUP_BURST),
+            ADMIN: (THROTTLE_ADMIN_RATE, THROTTLE_ADMIN_BURST),
+            DEFAULT: (THROTTLE_RATE, THROTTLE_BURST),
+        },
+        lookup_states=(UserStates.waiting_for_code,),
+        lookup_texts=("Ввести код",),
+        lookup_callbacks=("check_requests", SuggestCallback.__prefix__),
+    )
+    dp.message.outer_middleware(throttling)
+    dp.callback_query.outer_middleware(throttling)
+    dp["throttling"] = throttling
+    
+    # Регистрация пользователей: запись в базу только для новых и изменивших профиль
+    registration = RegistrationMiddleware(db, owns=owns)
+    dp.message.outer_middleware(registration)
+    dp.callback_query.outer_middleware(registration)
+    dp["registration"] = registration
+    
+    # Очередь с приоритетами после антифлуда и регистрации: при перегрузке
+    # администраторы и поиск фильмов обрабатываются раньше остальных апдейтов
+    if SCHEDULER_CONCURRENCY:
+        scheduler = PriorityScheduler(
+            SCHEDULER_CONCURRENCY,
+            limits={
+                ADMIN: SCHEDULER_ADMIN_LIMIT,
+                LOOKUP: SCHEDULER_LOOKUP_LIMIT,
+                REGISTRATION: SCHEDULER_REGISTRATION_LIMIT,
+                DEFAULT: SCHEDULER_DEFAULT_LIMIT,
+            },
+            priorities=PRIORITIES,
+        )
+        scheduling = SchedulingMiddleware(scheduler, throttling.classify)
+        dp.message.outer_middleware(scheduling)
+        dp.callback_query.outer_middleware(scheduling)
+        dp.chat_join_request.outer_middleware(scheduling)
+        dp["scheduler"] = scheduler
     
     # Регистрация роутеров
     dp.include_router(user_router)
     dp.include_router(admin_router)
     dp.include_router(channel_requests_router)
     
+    # Фоновые рассылки, проверка подписки, каталог, отправка фильмов и очередь заявок доступны
+    # обработчикам как аргументы broadcasts, channel_manager, catalogue, delivery и join_approver
+    broadcasts = BroadcastManager(db, rate=BROADCAST_RATE, workers=BROADCAST_WORKERS, owns=owns)
+    dp["broadcasts"] = broadcasts
+    # Каналы читаются из базы; в режиме нескольких процессов изменения
+    # из других процессов проверяются с тем же интервалом, что и каталог
+    channel_manager = ChannelManager(db, CHANNELS, poll_interval=db.catalogue_poll_interval)
+    dp["channel_manager"] = channel_manager
+    dp["catalogue"] = MovieCatalogue(db)
+    # Устаревшие file_id обновляются пересылкой исходного сообщения в служебный чат
+    dp["delivery"] = MovieDelivery(db, MEDIA_CHAT_ID or (ADMIN_IDS[0] if ADMIN_IDS else None))
+    # Заявки в каналы одобряются в фоне под своим лимитом запросов
+    join_approver = JoinApprover(db, rate=JOIN_APPROVE_RATE, workers=JOIN_APPROVE_WORKERS)
+    dp["join_approver"] = join_approver
+    # Резервные копии и обслуживание файла базы в тихие периоды; база общая,
+    # поэтому в режиме нескольких процессов обслуживание идет только в первом
+    maintenance = None
+    if partition is None or partition.index == 0:
+        maintenance = DatabaseMaintenance(db, BACKUP_DIR, backup_interval=BACKUP_INTERVAL, keep=BACKUP_KEEP,
+                                          quiet_rate=MAINTENANCE_QUIET_RATE)
+        dp["maintenance"] = maintenance
+    
+    # Прогрев кэшей, продолжение прерванных рассылок и очереди заявок при запуске,
+    # их остановка и закрытие соединений с базой данных при остановке.
+    # Хранилище FSM диспетчер закрывает первым, так что его изменения
+    # записываются до закрытия базы
+    dp.startup.register(db.start)
+    dp.startup.register(storage.start)
+    dp.startup.register(registration.start)
+    dp.startup.register(channel_manager.start)
+    dp.startup.register(broadcasts.resume)
+    dp.startup.register(join_approver.start)
+    dp.shutdown.register(broadcasts.stop)
+    dp.shutdown.register(join_approver.stop)
+    if maintenance is not None:
+        dp.startup.register(maintenance.start)
+        dp.shutdown.register(maintenance.stop)
+    dp.shutdown.register(channel_manager.stop)
+    dp.shutdown.register(db.close)
+    return dp
+
+def setup_metrics(dp: Dispatcher, bot: Bot, db: DatabaseManager, port: int = METRICS_PORT) -> None:
+    """
+    Метрики: время обработчиков, запросов к базе и к Telegram Bot API.
+    Если порт не задан, функция не вызывается и замеры ничего не стоят
+    """
+    registry = MetricsRegistry()
+    metrics = BotMetrics(registry)
+    metrics.install(dp, bot, db.pool)
+    metrics.add_stats("moviebot_movie_cache", "Кэш фильмов", db.movie_cache.stats)
+    metrics.add_stats("moviebot_fsm_storage", "Хранилище состояний FSM", dp.storage.stats)
+    metrics.add_stats("moviebot_throttling", "Антифлуд", dp["throttling"].stats)
+    metrics.add_stats("moviebot_registration", "Регистрация пользователей", dp["registration"].stats)
+    metrics.add_stats("moviebot_delivery", "Отправка видео фильмов", dp["delivery"].stats)
+    metrics.add_stats("moviebot_code_filter", "Фильтр кодов фильмов", db.code_filter.stats)
+    metrics.add_stats("moviebot_code_index", "Индекс подсказок похожих кодов", db.code_index.stats)
+    metrics.add_stats("moviebot_join_queue", "Очередь одобрения заявок в каналы", dp["join_approver"].stats)
+    scheduler = dp.get("scheduler")
+    if scheduler is not None:
+        metrics.add_stats("moviebot_scheduler", "Очередь апдейтов с приоритетами", scheduler.stats)
+        queue_time = registry.histogram(
+            "moviebot_scheduler_wait_seconds", "Ожидание апдейта в очереди с приоритетами", ("class",)
+        )
+        scheduler.observer = lambda name, wait: queue_time.observe(wait, name)
+    maintenance = dp.get("maintenance")
+    if maintenance is not None:
+        metrics.add_stats("moviebot_maintenance", "Резервные копии и обслуживание базы", maintenance.stats)
+        probe_time = registry.histogram(
+            "moviebot_maintenance_probe_seconds", "Задержка пробного запроса без обслуживания и во время него",
+            ("state",)
+        )
+        maintenance.observer = lambda state, latency: probe_time.observe(latency, state)
+    metrics.add_stats("moviebot_counters", "Отложенная запись счетчиков", lambda: {
+        "pending": db.counters.pending,
+        "flushes": db.counters.flushes,
+        "flushed_rows": db.counters.flushed_rows,
+    })
+    metrics_server = MetricsServer(registry, METRICS_HOST, port)
+    dp.startup.register(metrics_server.start)
+    dp.shutdown.register(metrics_server.stop)
+
+def run_worker(index: int, workers: int, queue: Any, processed: Any, ready: Any,
+               session_factory: Optional[Callable[[], BaseSession]] = None) -> None:
+    """Точка входа процесса-обработчика (см. WorkerPool)"""
+    ignore_stop_signals()
+    asyncio.run(serve_worker(index, workers, queue, processed, ready, session_factory))
+
+async def serve_worker(index: int, workers: int, queue: Any, processed: Any, ready: Any,
+                       session_factory: Optional[Callable[[], BaseSession]] = None) -> None:
+    """Процесс-обработчик: свой диспетчер для своей доли пользователей и общая база данных"""
+    bot = Bot(token=BOT_TOKEN, session=session_factory() if session_factory else None)
+    # Каталог могут менять администраторы из других процессов
+    db = DatabaseManager(DB_PATH, catalogue_poll_interval=CATALOGUE_POLL_INTERVAL)
+    dp = create_dispatcher(db, Partition(index, workers))
+    
+    # Метрики процесса-обработчика на METRICS_PORT + 1 + index
+    if METRICS_PORT:
+        setup_metrics(dp, bot, db, port=METRICS_PORT + 1 + index)
+    
+    await serve_queue(dp, bot, queue, processed, ready, concurrency=WORKER_CONCURRENCY)
+
+def create_ingress(workers: int) -> Dispatcher:
+    """
+    Диспетчер процесса-приемщика: апдейты не обрабатываются,
+    а передаются процессам-обработчикам по user_id
+    """
+    # Схема базы обновляется один раз, до запуска процессов-обработчиков
+    migrate(DB_PATH)
+    
+    pool = WorkerPool(run_worker, workers, queue_size=WORKER_QUEUE_SIZE)
+    dp = Dispatcher(disable_fsm=True)
+    dp.update.outer_middleware(pool.forward)
+    # Роутеры нужны только для списка типов апдейтов (allowed_updates),
+    # их обработчики вызываются в процессах-обработчиках
+    dp.include_routers(user_router, admin_router, channel_requests_router)
+    dp["workers"] = pool
+    dp.startup.register(pool.start)
+    dp.shutdown.register(pool.stop)
+    
+    if METRICS_PORT:
+        registry = MetricsRegistry()
+        BotMetrics(registry).add_stats("moviebot_workers", "Процессы-обработчики", pool.stats)
+        metrics_server = MetricsServer(registry, METRICS_HOST, METRICS_PORT)
+        dp.startup.register(metrics_server.start)
+        dp.shutdown.register(metrics_server.stop)
+    return dp
+
+async def main():
+    # Инициализация бота и диспетчера
+    bot = Bot(token=BOT_TOKEN)
+    if WORKERS > 1:
+        dp = create_ingress(WORKERS)
+    else:
+        db = DatabaseManager(DB_PATH)
+        dp = create_dispatcher(db)
+        if METRICS_PORT:
+            setup_metrics(dp, bot, db)
+    
     # Установка команд бота
     await set_commands(bot)
     
     # Вывод информации о запуске бота
     logging.info("Бот запущен")
     
-    # Запуск поллинга
-    await dp.start_polling(bot)
+    if BOT_MODE == "webhook":
+        # Запуск сервера вебхука
+        await run_webhook(
+            dp, bot, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT,
+            secret=WEBHOOK_SECRET, workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE
+        )
+    else:
+        # Запуск поллинга; приемщик передает апдейты по одному, чтобы
+        # заполненная очередь процесса-обработчика притормаживала получение
+        await dp.start_polling(bot, handle_as_tasks=WORKERS <= 1)
 
 if __name__ == "__main__":
     asyncio.run(main())
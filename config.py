@@ -21,4 +21,73 @@ CHANNELS = [
 ]
 
 # Путь к базе данных SQLite
-DB_PATH = "movie_bot.db"
+DB_PATH = os.getenv("DB_PATH", "movie_bot.db")
+
+# Рассылка: сообщений в секунду (лимит Telegram - около 30) и число параллельных отправителей
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "8"))
+
+# Одобрение заявок в каналы: одобрений в секунду (отдельно от рассылок) и число параллельных обработчиков
+JOIN_APPROVE_RATE = float(os.getenv("JOIN_APPROVE_RATE", "20"))
+JOIN_APPROVE_WORKERS = int(os.getenv("JOIN_APPROVE_WORKERS", "4"))
+
+# Режим получения апдейтов: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+
+# Настройки вебхука: публичный адрес, путь и секрет, локальный адрес сервера aiohttp,
+# число одновременно принятых апдейтов (вместе с ждущими в очереди приоритетов) и размер очереди апдейтов
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "256"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+
+# Состояния FSM: сколько записей держать в памяти и через сколько секунд
+# неактивности вытеснять запись (в базе данных она остается)
+FSM_HOT_SIZE = int(os.getenv("FSM_HOT_SIZE", "10000"))
+FSM_IDLE_TTL = float(os.getenv("FSM_IDLE_TTL", "600"))
+
+# Антифлуд: сообщений и нажатий в секунду на пользователя и запас подряд,
+# отдельно для поиска фильмов, для администраторов и для остальных действий
+THROTTLE_LOOKUP_RATE = float(os.getenv("THROTTLE_LOOKUP_RATE", "1"))
+THROTTLE_LOOKUP_BURST = float(os.getenv("THROTTLE_LOOKUP_BURST", "5"))
+THROTTLE_ADMIN_RATE = float(os.getenv("THROTTLE_ADMIN_RATE", "10"))
+THROTTLE_ADMIN_BURST = float(os.getenv("THROTTLE_ADMIN_BURST", "30"))
+THROTTLE_RATE = float(os.getenv("THROTTLE_RATE", "2"))
+THROTTLE_BURST = float(os.getenv("THROTTLE_BURST", "10"))
+
+# Очередь апдейтов с приоритетами: сколько обработчиков выполняется одновременно (0 - без очереди)
+# и сколько из них может занять каждый класс: администраторы, поиск фильмов,
+# /start и заявки в каналы, остальное. Лимиты ниже общего оставляют места важным классам
+SCHEDULER_CONCURRENCY = int(os.getenv("SCHEDULER_CONCURRENCY", "64"))
+SCHEDULER_ADMIN_LIMIT = int(os.getenv("SCHEDULER_ADMIN_LIMIT", "64"))
+SCHEDULER_LOOKUP_LIMIT = int(os.getenv("SCHEDULER_LOOKUP_LIMIT", "64"))
+SCHEDULER_REGISTRATION_LIMIT = int(os.getenv("SCHEDULER_REGISTRATION_LIMIT", "32"))
+SCHEDULER_DEFAULT_LIMIT = int(os.getenv("SCHEDULER_DEFAULT_LIMIT", "16"))
+
+# Метрики в формате Prometheus на http://METRICS_HOST:METRICS_PORT/metrics (0 - выключены)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Несколько процессов-обработчиков (WORKERS > 1): основной процесс принимает апдейты
+# и распределяет их по user_id. Принятых апдейтов в каждом процессе (вместе с ждущими
+# в очереди приоритетов), размер очереди процесса и как часто (в секундах) проверять изменения каталога из других процессов
+WORKERS = int(os.getenv("WORKERS", "1"))
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "256"))
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "1000"))
+CATALOGUE_POLL_INTERVAL = float(os.getenv("CATALOGUE_POLL_INTERVAL", "1"))
+
+# Служебный чат, куда бот на мгновение пересылает исходное сообщение фильма, чтобы
+# получить новый file_id взамен устаревшего (0 - чат первого администратора)
+MEDIA_CHAT_ID = int(os.getenv("MEDIA_CHAT_ID", "0"))
+
+# Обслуживание базы: каталог сжатых резервных копий (пусто - копии не делаются),
+# как часто (в секундах) делать копию и сколько последних копий хранить.
+# Копии, контрольные точки WAL, ANALYZE и возврат свободных страниц начинаются,
+# только когда запросов к базе в секунду меньше MAINTENANCE_QUIET_RATE
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_INTERVAL = float(os.getenv("BACKUP_INTERVAL", "86400"))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+MAINTENANCE_QUIET_RATE = float(os.getenv("MAINTENANCE_QUIET_RATE", "50"))
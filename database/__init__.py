@@ -1,3 +1,5 @@
 from .db_manager import DatabaseManager
+from .fsm_storage import SQLiteStorage
+from .migrations import SCHEMA_VERSION, migrate
 
-__all__ = ['DatabaseManager']
+__all__ = ['DatabaseManager', 'SQLiteStorage', 'SCHEMA_VERSION', 'migrate']
@@ -0,0 +1,370 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from .heavy_hitters import SpaceSaving
+from .pool import ConnectionPool
+
+logger = logging.getLogger(__name__)
+
+# Дневные показатели таблицы stats_daily, которые накапливаются приращениями
+DAILY_FIELDS = ("new_users", "lookups", "hits", "promo_shown", "join_requests", "join_approved")
+
+# Сколько дней хранится stats_active_users (нужна только для учета уникальных за день)
+ACTIVE_USERS_RETENTION_DAYS = 2
+
+# Сколько несуществующих кодов отслеживается в памяти процесса
+# и сколько самых частых из них хранится в базе за день
+MISSING_SKETCH_SIZE = 1000
+# Несуществующие коды длиннее этого не учитываются: в каталоге таких кодов не бывает
+# (MAX_CODE_LENGTH в utils/catalogue_io.py), а длинный ввод раздувал бы отчеты
+MISSING_CODE_LIMIT = 64
+MISSING_CODES_PER_DAY = 2000
+
+
+def day_of(timestamp: float) -> str:
+    """День в формате YYYY-MM-DD по UTC"""
+    return time.strftime("%Y-%m-%d", time.gmtime(timestamp))
+
+
+class Analytics:
+    """
+    Статистика бота в сводных таблицах по дням (UTC): активные и новые
+    пользователи, поиски по кодам с попаданиями и промахами, показы
+    сообщения с каналами, заявки в каналы и их одобрение.
+    События копятся в памяти и прибавляются к сводным таблицам одной
+    транзакцией по таймеру (как CounterBuffer), поэтому отчеты читают
+    несколько строк за нужные дни и не зависят от размера таблицы users.
+    Прибавление через ON CONFLICT ... value = value + excluded.value
+    корректно, даже если в базу пишут несколько процессов.
+    Несуществующие коды считаются в ограниченном скетче SpaceSaving,
+    в базу попадает только гарантированная часть их частоты.
+    """
+
+    def __init__(self, pool: ConnectionPool, flush_interval: float = 5.0, max_pending: int = 5000):
+        self._pool = pool
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        # day -> показатель -> приращение
+        self._daily: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        # (day, code) -> сколько раз нашли фильм по коду
+        self._codes: Dict[Tuple[str, str], int] = defaultdict(int)
+        # (day, channel_id) -> [заявки, одобренные]
+        self._channels: Dict[Tuple[str, int], List[int]] = defaultdict(lambda: [0, 0])
+        # day -> пользователи, впервые замеченные за день и еще не записанные
+        self._active: Dict[str, Set[int]] = defaultdict(set)
+        # Несуществующие коды за текущий день и их приращения, готовые к записи
+        self.missing = SpaceSaving(MISSING_SKETCH_SIZE)
+        self._missing_day = ""
+        self._missing: Dict[Tuple[str, str], int] = defaultdict(int)
+        # Пользователи, уже учтенные в этом процессе за текущий день
+        self._seen: Set[int] = set()
+        self._seen_day = ""
+        self._day = ""
+        self._day_end = 0.0
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._timer_task: Optional[asyncio.Task] = None
+        self.flushes = 0
+
+    @property
+    def pending(self) -> int:
+        return (len(self._daily) + len(self._codes) + len(self._channels) + len(self._missing)
+                + sum(map(len, self._active.values())))
+
+    def today(self) -> str:
+        """Текущий день по UTC (пересчитывается раз в сутки)"""
+        now = time.time()
+        if now >= self._day_end:
+            self._day = day_of(now)
+            self._day_end = (now // 86400 + 1) * 86400
+        return self._day
+
+    # События
+
+    def active(self, user_id: int) -> bool:
+        """Пользователь обратился к боту; True, если первый раз за день в этом процессе"""
+        day = self.today()
+        if day != self._seen_day:
+            self._seen = set()
+            self._seen_day = day
+        if user_id in self._seen:
+            return False
+        self._seen.add(user_id)
+        self._active[day].add(user_id)
+        self._check_threshold()
+        return True
+
+    def new_user(self) -> None:
+        """Новый пользователь"""
+        self._daily[self.today()]["new_users"] += 1
+
+    def lookup(self, code: str, found: bool) -> None:
+        """Поиск фильма по коду"""
+        day = self.today()
+        daily = self._daily[day]
+        daily["lookups"] += 1
+        if found:
+            daily["hits"] += 1
+            # Несуществующие коды не сохраняются, чтобы случайный ввод не раздувал таблицу
+            self._codes[(day, code)] += 1
+            self._check_threshold()
+        else:
+            if day != self._missing_day:
+                self._drain_missing()
+                self.missing.clear()
+                self._missing_day = day
+            if len(code) <= MISSING_CODE_LIMIT:
+                self.missing.add(code)
+
+    def promo_shown(self) -> None:
+        """Пользователю показано сообщение со ссылками на каналы"""
+        self._daily[self.today()]["promo_shown"] += 1
+
+    def join_request(self, channel_id: int, approved: bool = False) -> None:
+        """Заявка в канал (approved - заявка одобрена)"""
+        day = self.today()
+        field, index = ("join_approved", 1) if approved else ("join_requests", 0)
+        self._daily[day][field] += 1
+        self._channels[(day, channel_id)][index] += 1
+
+    def _drain_missing(self) -> None:
+        for code, delta in self.missing.drain():
+            self._missing[(self._missing_day, code)] += delta
+
+    # Запись в базу
+
+    def _check_threshold(self) -> None:
+        if self.pending >= self.max_pending and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.create_task(self.flush())
+
+    @staticmethod
+    def _write_batch(conn: sqlite3.Connection, daily: Dict[str, Dict[str, int]], active: Dict[str, Set[int]],
+                     codes: List[Tuple[str, str, int]], channels: List[Tuple[str, int, int, int]],
+                     missing: List[Tuple[str, str, int]], keep_from: str) -> None:
+        daily = {day: dict(values) for day, values in daily.items()}
+        # Уникальные за день: считаются только пользователи, которых еще нет в stats_active_users
+        # (после перезапуска процесса или если день уже учел другой процесс)
+        for day, user_ids in active.items():
+            before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO stats_active_users (day, user_id) VALUES (?, ?)",
+                             [(day, user_id) for user_id in user_ids])
+            added = conn.total_changes - before
+            if added:
+                daily.setdefault(day, {})["active_users"] = added
+
+        if daily:
+            fields = ("active_users", *DAILY_FIELDS)
+            conn.executemany(
+                f"""
+                INSERT INTO stats_daily (day, {', '.join(fields)})
+                VALUES (?, {', '.join('?' for _ in fields)})
+                ON CONFLICT(day) DO UPDATE SET
+                    {', '.join(f'{field} = {field} + excluded.{field}' for field in fields)}
+                """,
+                [(day, *(values.get(field, 0) for field in fields)) for day, values in daily.items()]
+            )
+        if codes:
+            conn.executemany(
+                """
+                INSERT INTO stats_code_daily (day, code, lookups) VALUES (?, ?, ?)
+                ON CONFLICT(day, code) DO UPDATE SET lookups = lookups + excluded.lookups
+                """,
+                codes
+            )
+        if channels:
+            conn.executemany(
+                """
+                INSERT INTO stats_channel_daily (day, channel_id, join_requests, join_approved)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(day, channel_id) DO UPDATE SET
+                    join_requests = join_requests + excluded.join_requests,
+                    join_approved = join_approved + excluded.join_approved
+                """,
+                channels
+            )
+        if missing:
+            conn.executemany(
+                """
+                INSERT INTO stats_missing_daily (day, code, lookups) VALUES (?, ?, ?)
+                ON CONFLICT(day, code) DO UPDATE SET lookups = lookups + excluded.lookups
+                """,
+                missing
+            )
+            # За день остаются только самые частые коды
+            for day in {row[0] for row in missing}:
+                conn.execute(
+                    """
+                    DELETE FROM stats_missing_daily WHERE day = ?1 AND code NOT IN (
+                        SELECT code FROM stats_missing_daily WHERE day = ?1 ORDER BY lookups DESC LIMIT ?2
+                    )
+                    """,
+                    (day, MISSING_CODES_PER_DAY)
+                )
+        if active:
+            conn.execute("DELETE FROM stats_active_users WHERE day < ?", (keep_from,))
+
+    async def flush(self) -> None:
+        """Прибавление накопленных событий к сводным таблицам одной транзакцией"""
+        async with self._flush_lock:
+            self._drain_missing()
+            if not self.pending:
+                return
+
+            daily, self._daily = self._daily, defaultdict(lambda: defaultdict(int))
+            codes, self._codes = self._codes, defaultdict(int)
+            channels, self._channels = self._channels, defaultdict(lambda: [0, 0])
+            active, self._active = self._active, defaultdict(set)
+            missing, self._missing = self._missing, defaultdict(int)
+            keep_from = day_of(time.time() - (ACTIVE_USERS_RETENTION_DAYS - 1) * 86400)
+            try:
+                await self._pool.write(
+                    self._write_batch, daily, active,
+                    [(day, code, count) for (day, code), count in codes.items()],
+                    [(day, channel_id, *counts) for (day, channel_id), counts in channels.items()],
+                    [(day, code, count) for (day, code), count in missing.items()],
+                    keep_from,
+                )
+            except Exception:
+                # Возвращаем события в буфер, чтобы записать их в следующий раз
+                for day, values in daily.items():
+                    for field, delta in values.items():
+                        self._daily[day][field] += delta
+                for key, count in codes.items():
+                    self._codes[key] += count
+                for key, counts in channels.items():
+                    self._channels[key][0] += counts[0]
+                    self._channels[key][1] += counts[1]
+                for day, user_ids in active.items():
+                    self._active[day] |= user_ids
+                for key, count in missing.items():
+                    self._missing[key] += count
+                raise
+            self.flushes += 1
+
+    async def _run_timer(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Ошибка записи статистики в базу данных")
+
+    def start(self) -> None:
+        """Запуск периодической записи"""
+        if self._timer_task is None:
+            self._timer_task = asyncio.create_task(self._run_timer())
+
+    async def stop(self) -> None:
+        """Остановка таймера и запись всего, что осталось в буфере"""
+        if self._timer_task is not None:
+            self._timer_task.cancel()
+            try:
+                await self._timer_task
+            except asyncio.CancelledError:
+                pass
+            self._timer_task = None
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self.flush()
+
+    # Отчеты (читают только сводные таблицы)
+
+    async def daily(self, days: int) -> List[Dict[str, Any]]:
+        """Показатели по дням за последние days дней, от старых к новым"""
+        rows = await self._pool.fetchall(
+            "SELECT * FROM stats_daily WHERE day >= ? ORDER BY day",
+            (day_of(time.time() - (days - 1) * 86400),)
+        )
+        return [dict(row) for row in rows]
+
+    @staticmethod
+    def _read_top_codes(conn: sqlite3.Connection, days: List[str], limit: int,
+                        candidates: int) -> List[Tuple[str, int]]:
+        # Кандидаты - лучшие коды каждого дня по индексу (day, lookups). У кода, который
+        # не попал в кандидаты, за каждый день не больше последнего кандидата этого дня,
+        # поэтому сумма этих значений - верхняя граница его итога
+        codes: Set[str] = set()
+        bound = 0
+        for day in days:
+            rows = conn.execute(
+                "SELECT code, lookups FROM stats_code_daily WHERE day = ? ORDER BY lookups DESC LIMIT ?",
+                (day, candidates)
+            ).fetchall()
+            codes.update(row[0] for row in rows)
+            if len(rows) == candidates:
+                bound += rows[-1][1]
+
+        # Точные итоги кандидатов - поиском по первичному ключу (day, code)
+        totals: Dict[str, int] = defaultdict(int)
+        codes_list = list(codes)
+        for start in range(0, len(codes_list), 500):
+            chunk = codes_list[start:start + 500]
+            rows = conn.execute(
+                f"SELECT code, lookups FROM stats_code_daily "
+                f"WHERE day IN ({', '.join('?' for _ in days)}) AND code IN ({', '.join('?' for _ in chunk)})",
+                (*days, *chunk)
+            )
+            for code, lookups in rows:
+                totals[code] += lookups
+        top = sorted(totals.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+        # Если граница не доказывает точность, считаем по всем строкам периода
+        if bound and (len(top) < limit or top[-1][1] < bound):
+            top = conn.execute(
+                "SELECT code, SUM(lookups) AS lookups FROM stats_code_daily WHERE day >= ? "
+                "GROUP BY code ORDER BY lookups DESC LIMIT ?",
+                (min(days), limit)
+            ).fetchall()
+            top = [tuple(row) for row in top]
+        return top
+
+    async def top_codes(self, days: int, limit: int = 10, candidates: int = 100) -> List[Dict[str, Any]]:
+        """
+        Самые популярные коды за последние days дней (code, title, lookups).
+        Точный результат без группировки всех строк периода: суммируются только
+        лучшие candidates кодов каждого дня (алгоритм с порогом)
+        """
+        now = time.time()
+        period = [day_of(now - offset * 86400) for offset in range(days)]
+        top = await self._pool.read(self._read_top_codes, period, limit, max(candidates, limit),
+                                    sql="stats top codes")
+        titles = {}
+        if top:
+            rows = await self._pool.fetchall(
+                f"SELECT code, title FROM movies WHERE code IN ({', '.join('?' for _ in top)})",
+                [code for code, _ in top]
+            )
+            titles = {row["code"]: row["title"] for row in rows}
+        return [{"code": code, "title": titles.get(code), "lookups": lookups} for code, lookups in top]
+
+    async def channel_joins(self, days: int) -> List[Dict[str, Any]]:
+        """Заявки и одобрения по каналам за последние days дней"""
+        rows = await self._pool.fetchall(
+            """
+            SELECT channel_id, SUM(join_requests) AS join_requests, SUM(join_approved) AS join_approved
+            FROM stats_channel_daily WHERE day >= ?
+            GROUP BY channel_id ORDER BY join_requests DESC
+            """,
+            (day_of(time.time() - (days - 1) * 86400),)
+        )
+        return [dict(row) for row in rows]
+
+    async def missing_codes(self, days: int, limit: int = 10, min_lookups: int = 2) -> List[Dict[str, Any]]:
+        """
+        Несуществующие коды, которые чаще всего искали за последние days дней
+        (code, lookups - не меньше этого числа раз). Коды, которые уже добавили
+        в каталог, и единичные опечатки (меньше min_lookups) не показываются
+        """
+        rows = await self._pool.fetchall(
+            """
+            SELECT code, SUM(lookups) AS lookups FROM stats_missing_daily
+            WHERE day >= ? AND code NOT IN (SELECT code FROM movies)
+            GROUP BY code HAVING lookups >= ? ORDER BY lookups DESC, code LIMIT ?
+            """,
+            (day_of(time.time() - (days - 1) * 86400), min_lookups, limit)
+        )
+        return [dict(row) for row in rows]
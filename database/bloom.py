@@ -0,0 +1,124 @@
+import math
+from typing import Any, Dict, Iterable, Optional
+
+
+class BloomFilter:
+    """
+    Компактное множество строк без ложноотрицательных ответов: если строки
+    нет в фильтре, ее точно не добавляли; если есть - скорее всего добавляли
+    (ложноположительных ответов около error_rate при заполнении до capacity).
+    Хэш - встроенный hash(), поэтому фильтр живет только в своем процессе.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        self.capacity = max(capacity, 1)
+        self.error_rate = error_rate
+        self.size = max(int(-self.capacity * math.log(error_rate) / math.log(2) ** 2), 64)
+        self.hashes = max(int(round(self.size / self.capacity * math.log(2))), 1)
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        value = hash(item) & 0xFFFFFFFFFFFFFFFF
+        first, second = value & 0xFFFFFFFF, (value >> 32) | 1
+        for index in range(self.hashes):
+            yield (first + index * second) % self.size
+
+    def add(self, item: str) -> bool:
+        """Добавление строки; False, если она (вероятно) уже была в фильтре"""
+        bits = self._bits
+        added = False
+        for position in self._positions(item):
+            mask = 1 << (position & 7)
+            if not bits[position >> 3] & mask:
+                bits[position >> 3] |= mask
+                added = True
+        # Повторное добавление не считается, чтобы count оставался оценкой числа разных строк
+        if added:
+            self.count += 1
+        return added
+
+    def __contains__(self, item: str) -> bool:
+        bits = self._bits
+        for position in self._positions(item):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._bits)
+
+
+class CodeFilter:
+    """
+    Фильтр Блума по кодам всех фильмов: поиск несуществующего кода
+    отвечает «не найдено» без запроса к базе.
+    Добавленные коды сразу попадают в фильтр. Удаленные остаются в нем и дают
+    лишь редкий лишний запрос к базе, поэтому фильтр перестраивается только
+    когда добавлений становится больше расчетной емкости. Пока фильтр не
+    загружен, он пропускает все коды к базе.
+    """
+
+    def __init__(self, error_rate: float = 0.01, headroom: float = 2.0):
+        self.error_rate = error_rate
+        self.headroom = headroom
+        self._filter: Optional[BloomFilter] = None
+        # Фильтр, который строится сейчас: добавления во время загрузки попадают и в него
+        self._building: Optional[BloomFilter] = None
+        # Наибольший movies.id в фильтре (для догрузки фильмов, добавленных другими процессами)
+        self.max_id = 0
+        self.rejected = 0
+        self.passed = 0
+        self.false_positives = 0
+        self.rebuilds = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._filter is not None
+
+    @property
+    def needs_rebuild(self) -> bool:
+        return self._filter is not None and self._filter.count > self._filter.capacity
+
+    def begin(self, expected: int) -> None:
+        """Начало построения фильтра на expected кодов"""
+        self._building = BloomFilter(int(max(expected, 1000) * self.headroom), self.error_rate)
+
+    def load(self, codes: Iterable[str]) -> None:
+        """Добавление порции кодов в строящийся фильтр"""
+        for code in codes:
+            self._building.add(code)
+
+    def finish(self, max_id: int) -> None:
+        """Замена фильтра построенным"""
+        self._filter, self._building = self._building, None
+        self.max_id = max(self.max_id, max_id)
+        self.rebuilds += 1
+
+    def add(self, code: str) -> None:
+        """Новый код фильма"""
+        for bloom in (self._filter, self._building):
+            if bloom is not None:
+                bloom.add(code)
+
+    def might_contain(self, code: str) -> bool:
+        """False - кода точно нет в каталоге"""
+        if self._filter is None or code in self._filter:
+            self.passed += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        """Заполнение фильтра и сколько запросов к базе он сэкономил"""
+        bloom = self._filter
+        return {
+            "codes": bloom.count if bloom else 0,
+            "capacity": bloom.capacity if bloom else 0,
+            "bytes": bloom.nbytes if bloom else 0,
+            "rejected": self.rejected,
+            "passed": self.passed,
+            "false_positives": self.false_positives,
+            "rebuilds": self.rebuilds,
+        }
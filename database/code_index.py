@@ -0,0 +1,148 @@
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Tuple, Union
+
+# Кириллические буквы, похожие на латинские, приводятся к латинским; разделители удаляются
+_NORMALIZE = str.maketrans("авекмнорстухі", "abekmhopctyxi", " -_.#№")
+
+
+def normalize_code(code: str) -> str:
+    """Ключ кода: без регистра, разделителей и с латинскими буквами вместо похожих кириллических"""
+    return code.casefold().translate(_NORMALIZE)
+
+
+class CodeIndex:
+    """
+    Индекс кодов фильмов для подсказок при опечатке. Коды хранятся по
+    нормализованному ключу (регистр, пробелы, дефисы и похожие буквы не
+    различаются). Для промаха перебираются все ключи на расстоянии
+    Дамерау-Левенштейна 1 (пропуск, лишний или замененный символ,
+    перестановка соседних) из символов, которые встречаются в кодах каталога,
+    и проверяются по словарю: на 6-значном цифровом коде это около 130
+    проверок, без отдельной структуры удалений в памяти.
+    Обновляется при добавлении и удалении фильмов.
+    """
+
+    def __init__(self, min_length: int = 2, max_length: int = 32):
+        # Коды короче min_length и длиннее max_length не подсказываются
+        self.min_length = min_length
+        self.max_length = max_length
+        # Ключ -> код (или список кодов с одинаковым ключом)
+        self._codes: Dict[str, Union[str, List[str]]] = {}
+        # Символ -> сколько раз встречается в ключах; из них строятся варианты опечаток
+        self._alphabet: Counter = Counter()
+        self._symbols = ""
+        self.count = 0
+        self.searches = 0
+        self.suggested = 0
+        self.accepted = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _count_symbols(self, key: str, delta: int) -> None:
+        symbols = len(self._alphabet)
+        if delta > 0:
+            self._alphabet.update(set(key))
+        else:
+            self._alphabet.subtract(set(key))
+            for symbol in set(key):
+                if self._alphabet[symbol] <= 0:
+                    del self._alphabet[symbol]
+        if len(self._alphabet) != symbols:
+            self._symbols = "".join(sorted(self._alphabet))
+
+    def add(self, code: str) -> None:
+        key = normalize_code(code)
+        if not key:
+            return
+        codes = self._codes.get(key)
+        if codes is None:
+            self._codes[key] = code
+            self._count_symbols(key, 1)
+        elif isinstance(codes, str):
+            if codes == code:
+                return
+            self._codes[key] = [codes, code]
+        elif code in codes:
+            return
+        else:
+            codes.append(code)
+        self.count += 1
+
+    def load(self, codes: Iterable[str]) -> None:
+        for code in codes:
+            self.add(code)
+
+    def remove(self, code: str) -> None:
+        key = normalize_code(code)
+        codes = self._codes.get(key)
+        if codes is None:
+            return
+        if isinstance(codes, str):
+            if codes != code:
+                return
+            del self._codes[key]
+            self._count_symbols(key, -1)
+        elif code in codes:
+            codes.remove(code)
+            if len(codes) == 1:
+                self._codes[key] = codes[0]
+        else:
+            return
+        self.count -= 1
+
+    def clear(self) -> None:
+        self._codes.clear()
+        self._alphabet.clear()
+        self._symbols = ""
+        self.count = 0
+
+    def _edits(self, key: str) -> set:
+        """Ключи каталога на расстоянии 1 от key"""
+        codes, symbols = self._codes, self._symbols
+        splits = [(key[:i], key[i:]) for i in range(len(key) + 1)]
+        found = {left + right[1:] for left, right in splits if right and left + right[1:] in codes}
+        found.update(left + right[1] + right[0] + right[2:] for left, right in splits
+                     if len(right) > 1 and left + right[1] + right[0] + right[2:] in codes)
+        for left, right in splits:
+            rest = right[1:]
+            for symbol in symbols:
+                if right and left + symbol + rest in codes:
+                    found.add(left + symbol + rest)
+                if left + symbol + right in codes:
+                    found.add(left + symbol + right)
+        found.discard(key)
+        return found
+
+    def suggest(self, code: str, limit: int = 20) -> List[Tuple[str, int]]:
+        """
+        Существующие коды, похожие на code: (код, расстояние). Сначала коды с тем же
+        ключом (расстояние 0: отличаются только регистром, разделителями или
+        похожими буквами), затем на расстоянии 1; не больше limit
+        """
+        key = normalize_code(code)
+        if not self.min_length <= len(key) <= self.max_length:
+            return []
+        self.searches += 1
+        result: List[Tuple[str, int]] = []
+        for distance, keys in ((0, (key,)), (1, sorted(self._edits(key)))):
+            for found in keys:
+                codes = self._codes.get(found)
+                if codes is None:
+                    continue
+                for candidate in ((codes,) if isinstance(codes, str) else codes):
+                    if candidate != code:
+                        result.append((candidate, distance))
+        if result:
+            self.suggested += 1
+        return result[:limit]
+
+    def stats(self) -> Dict[str, Any]:
+        """Размер индекса и сколько подсказок выбрали пользователи"""
+        return {
+            "codes": self.count,
+            "symbols": len(self._symbols),
+            "searches": self.searches,
+            "suggested": self.suggested,
+            "accepted": self.accepted,
+        }
@@ -0,0 +1,259 @@
+import asyncio
+import logging
+import sqlite3
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from .pool import ConnectionPool
+
+logger = logging.getLogger(__name__)
+
+
+class CounterBuffer:
+    """
+    Отложенная (write-behind) запись счетчиков usage_count и click_count,
+    данных новых пользователей и их активности (last_seen, lookups, status).
+    Приращения копятся в памяти и записываются одной транзакцией executemany
+    по таймеру или при достижении порога. Чтение через буфер всегда видит
+    последние значения, даже если они еще не записаны в базу.
+    """
+
+    def __init__(self, pool: ConnectionPool, flush_interval: float = 2.0, max_pending: int = 1000):
+        self._pool = pool
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        # code -> сколько добавить к usage_count
+        self._usage: Dict[str, int] = defaultdict(int)
+        # user_id -> актуальное значение click_count
+        self._clicks: Dict[int, int] = {}
+        # user_id -> (username, first_name, last_name) для вставки или обновления
+        self._users: Dict[int, Tuple[Optional[str], Optional[str], Optional[str]]] = {}
+        # user_id -> время первого за день обращения (last_seen)
+        self._seen: Dict[int, int] = {}
+        # user_id -> сколько добавить к lookups
+        self._lookups: Dict[int, int] = defaultdict(int)
+        # user_id -> (status, время): пользователь заблокировал бота или удален
+        self._statuses: Dict[int, Tuple[str, int]] = {}
+        # Данные, которые записываются прямо сейчас
+        self._flushing_clicks: Dict[int, int] = {}
+        self._flushing_users: Dict[int, tuple] = {}
+        self._flush_lock = asyncio.Lock()
+        # user_id -> (блокировка увеличения click_count, сколько задач ее ждут или держат)
+        self._click_locks: Dict[int, Tuple[asyncio.Lock, int]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._timer_task: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.flushed_users = 0
+
+    @property
+    def pending(self) -> int:
+        return (len(self._usage) + len(self._clicks) + len(self._users)
+                + len(self._seen) + len(self._lookups) + len(self._statuses))
+
+    # Пользователи
+
+    def add_user(self, user_id: int, username: Optional[str], first_name: Optional[str],
+                 last_name: Optional[str]) -> None:
+        """Добавление или обновление пользователя при следующей записи"""
+        self._users[user_id] = (username, first_name, last_name)
+        self._check_threshold()
+
+    def is_pending_user(self, user_id: int) -> bool:
+        """Пользователь ожидает записи в базу"""
+        return user_id in self._users or user_id in self._flushing_users
+
+    def add_seen(self, user_id: int, timestamp: int) -> None:
+        """Обновление last_seen; пользователь снова доступен для рассылок"""
+        self._seen[user_id] = timestamp
+        self._check_threshold()
+
+    def add_lookup(self, user_id: int) -> None:
+        """Пользователь нашел фильм по коду"""
+        self._lookups[user_id] += 1
+        self._check_threshold()
+
+    def set_status(self, user_id: int, status: str, timestamp: int) -> None:
+        """Пользователь заблокировал бота (blocked) или удален (deactivated)"""
+        self._statuses[user_id] = (status, timestamp)
+        self._check_threshold()
+
+    # Счетчик использования фильмов
+
+    def add_usage(self, code: str) -> None:
+        """Учет использования кода фильма"""
+        self._usage[code] += 1
+        self._check_threshold()
+
+    # Счетчик кликов пользователей
+
+    def pending_click_count(self, user_id: int) -> Optional[int]:
+        """Значение click_count из буфера (None, если в буфере его нет)"""
+        if user_id in self._clicks:
+            return self._clicks[user_id]
+        return self._flushing_clicks.get(user_id)
+
+    async def get_click_count(self, user_id: int) -> Optional[int]:
+        """Текущее значение click_count (None, если пользователя нет в базе)"""
+        value = self.pending_click_count(user_id)
+        if value is not None:
+            return value
+
+        row = await self._pool.fetchone("SELECT click_count FROM users WHERE user_id = ?", (user_id,))
+
+        # Пока шел запрос, значение могло измениться в буфере
+        value = self.pending_click_count(user_id)
+        if value is not None:
+            return value
+        if row is None:
+            # Новый пользователь, который еще не записан в базу
+            return 0 if self.is_pending_user(user_id) else None
+        return row[0] or 0
+
+    async def increment_click(self, user_id: int) -> int:
+        """
+        Увеличение click_count, возвращает новое значение. Увеличения одного
+        пользователя идут по очереди: иначе два нажатия, прочитавшие из базы одно
+        и то же значение (например, пока пакет записывался), дали бы одно увеличение
+        """
+        lock, users = self._click_locks.get(user_id, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self._click_locks[user_id] = (lock, users + 1)
+        try:
+            async with lock:
+                value = await self.get_click_count(user_id)
+                if value is None:
+                    return 0
+
+                self._clicks[user_id] = value + 1
+                self._check_threshold()
+                return value + 1
+        finally:
+            lock, users = self._click_locks[user_id]
+            if users > 1:
+                self._click_locks[user_id] = (lock, users - 1)
+            else:
+                del self._click_locks[user_id]
+
+    def reset_click(self, user_id: int) -> None:
+        """Сброс click_count"""
+        self._clicks[user_id] = 0
+        self._check_threshold()
+
+    # Запись в базу
+
+    def _check_threshold(self) -> None:
+        if self.pending >= self.max_pending and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.create_task(self.flush())
+
+    @staticmethod
+    def _write_batch(conn: sqlite3.Connection, users: List[tuple], usage: List[Tuple[int, str]],
+                     clicks: List[Tuple[int, int]], seen: List[Tuple[int, int]],
+                     lookups: List[Tuple[int, int]], statuses: List[Tuple[str, int, int]]) -> None:
+        # Пользователи записываются первыми, чтобы их click_count было что обновлять
+        if users:
+            conn.executemany(
+                """
+                INSERT INTO users (user_id, username, first_name, last_name, click_count)
+                VALUES (?, ?, ?, ?, 0)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    username = COALESCE(excluded.username, username),
+                    first_name = COALESCE(excluded.first_name, first_name),
+                    last_name = COALESCE(excluded.last_name, last_name)
+                """,
+                users
+            )
+        if usage:
+            conn.executemany("UPDATE movies SET usage_count = usage_count + ? WHERE code = ?", usage)
+        if clicks:
+            conn.executemany("UPDATE users SET click_count = ? WHERE user_id = ?", clicks)
+        if seen:
+            # Пользователь, который пишет боту, его не блокирует
+            conn.executemany(
+                """
+                UPDATE users SET last_seen = ?1,
+                    status_at = CASE WHEN status = 'active' THEN status_at ELSE ?1 END,
+                    status = 'active'
+                WHERE user_id = ?2
+                """,
+                seen
+            )
+        if lookups:
+            conn.executemany("UPDATE users SET lookups = lookups + ? WHERE user_id = ?", lookups)
+        # Статусы последними: ошибка доставки новее обращения из того же пакета
+        if statuses:
+            conn.executemany("UPDATE users SET status = ?, status_at = ? WHERE user_id = ?", statuses)
+
+    async def flush(self) -> None:
+        """Запись накопленных счетчиков одной транзакцией"""
+        async with self._flush_lock:
+            if not self.pending:
+                return
+
+            usage, self._usage = self._usage, defaultdict(int)
+            clicks, self._clicks = self._clicks, {}
+            users, self._users = self._users, {}
+            seen, self._seen = self._seen, {}
+            lookups, self._lookups = self._lookups, defaultdict(int)
+            statuses, self._statuses = self._statuses, {}
+            self._flushing_clicks = clicks
+            self._flushing_users = users
+            try:
+                await self._pool.write(
+                    self._write_batch,
+                    [(user_id, *profile) for user_id, profile in users.items()],
+                    [(delta, code) for code, delta in usage.items()],
+                    [(value, user_id) for user_id, value in clicks.items()],
+                    [(timestamp, user_id) for user_id, timestamp in seen.items()],
+                    [(delta, user_id) for user_id, delta in lookups.items()],
+                    [(status, timestamp, user_id) for user_id, (status, timestamp) in statuses.items()],
+                )
+            except Exception:
+                # Возвращаем данные в буфер, более новые значения кликов не затираем
+                for code, delta in usage.items():
+                    self._usage[code] += delta
+                for user_id, value in clicks.items():
+                    self._clicks.setdefault(user_id, value)
+                for user_id, profile in users.items():
+                    self._users.setdefault(user_id, profile)
+                for user_id, timestamp in seen.items():
+                    self._seen.setdefault(user_id, timestamp)
+                for user_id, delta in lookups.items():
+                    self._lookups[user_id] += delta
+                for user_id, status in statuses.items():
+                    self._statuses.setdefault(user_id, status)
+                raise
+            finally:
+                self._flushing_clicks = {}
+                self._flushing_users = {}
+
+            self.flushes += 1
+            self.flushed_rows += len(usage) + len(clicks) + len(users) + len(seen) + len(lookups) + len(statuses)
+            self.flushed_users += len(users)
+
+    async def _run_timer(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Ошибка записи счетчиков в базу данных")
+
+    def start(self) -> None:
+        """Запуск периодической записи"""
+        if self._timer_task is None:
+            self._timer_task = asyncio.create_task(self._run_timer())
+
+    async def stop(self) -> None:
+        """Остановка таймера и запись всего, что осталось в буфере"""
+        if self._timer_task is not None:
+            self._timer_task.cancel()
+            try:
+                await self._timer_task
+            except asyncio.CancelledError:
+                pass
+            self._timer_task = None
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self.flush()
@@ -1,136 +1,342 @@
+import asyncio
+import logging
 import sqlite3
-import datetime
-from typing import List, Dict, Any, Optional, Tuple
+import time
+from typing import List, Dict, Any, Optional, Sequence, AsyncIterator, Tuple
+
+from .analytics import Analytics
+from .bloom import CodeFilter
+from .cache import LRUCache
+from .code_index import CodeIndex
+from .counters import CounterBuffer
+from .migrations import migrate
+from .pool import ConnectionPool
+
+logger = logging.getLogger(__name__)
+
+# Столбцы, которые можно запрашивать при потоковом чтении таблиц
+MOVIE_COLUMNS = ("id", "code", "title", "created_at", "usage_count",
+                 "file_id", "file_type", "source_chat_id", "source_message_id")
+USER_COLUMNS = ("id", "user_id", "username", "first_name", "last_name", "joined_at", "is_admin", "click_count",
+                "last_seen", "status", "status_at", "lookups")
+
+# Сегменты пользователей для рассылок: условие отбора (:since - начало периода активности)
+USER_SEGMENTS = {
+    "reachable": "status = 'active'",
+    "active": "status = 'active' AND last_seen >= :since",
+    "lookups": "status = 'active' AND lookups > 0",
+    "all": "1 = 1",
+}
+# Период активности для сегмента active, дней
+ACTIVE_SEGMENT_DAYS = 30
 
 class DatabaseManager:
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, readers: int = 4,
+                 movie_cache_size: int = 10000, movie_cache_ttl: float = 600,
+                 catalogue_poll_interval: Optional[float] = None):
         self.db_path = db_path
-        self.conn = None
-        self.cursor = None
         self.init_db()
-    
-    def connect(self):
-        """Установка соединения с базой данных"""
-        self.conn = sqlite3.connect(self.db_path)
-        self.conn.row_factory = sqlite3.Row
-        self.cursor = self.conn.cursor()
-    
-    def disconnect(self):
-        """Закрытие соединения с базой данных"""
-        if self.conn:
-            self.conn.close()
-            self.conn = None
-            self.cursor = None
-    
-    def init_db(self):
-        """Инициализация базы данных и создание таблиц"""
-        self.connect()
-        
-        # Создание таблицы фильмов с добавлением столбца usage_count
-        self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS movies (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            code TEXT UNIQUE NOT NULL,
-            title TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            usage_count INTEGER DEFAULT 0
-        )
-        ''')
-        
-        # Проверка наличия столбца usage_count и добавление его, если отсутствует
-        try:
-            self.cursor.execute("SELECT usage_count FROM movies LIMIT 1")
-        except sqlite3.OperationalError:
-            self.cursor.execute("ALTER TABLE movies ADD COLUMN usage_count INTEGER DEFAULT 0")
-        
-        # Создание таблицы пользователей с добавлением столбца click_count
-        self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER UNIQUE NOT NULL,
-            username TEXT,
-            first_name TEXT,
-            last_name TEXT,
-            joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            is_admin BOOLEAN DEFAULT 0,
-            click_count INTEGER DEFAULT 0
-        )
-        ''')
-        
-        # Проверка наличия столбца click_count и добавление его, если отсутствует
-        try:
-            self.cursor.execute("SELECT click_count FROM users LIMIT 1")
-        except sqlite3.OperationalError:
-            self.cursor.execute("ALTER TABLE users ADD COLUMN click_count INTEGER DEFAULT 0")
-        
-        self.conn.commit()
-        self.disconnect()
-    
+        self.pool = ConnectionPool(db_path, readers)
+        # Кэш код -> фильм, инвалидируется при добавлении и удалении фильмов
+        self.movie_cache = LRUCache(movie_cache_size, movie_cache_ttl)
+        # Фильтр Блума по кодам: несуществующие коды отсекаются без запроса к базе
+        self.code_filter = CodeFilter()
+        self._code_filter_lock = asyncio.Lock()
+        # Индекс кодов для подсказок похожих кодов при опечатке
+        self.code_index = CodeIndex()
+        # Версия каталога растет при каждом изменении списка фильмов
+        self.catalogue_version = 0
+        # Если базой пользуются несколько процессов, изменения каталога в других
+        # процессах отслеживаются по общей версии в таблице catalogue_state
+        self.catalogue_poll_interval = catalogue_poll_interval
+        self._shared_catalogue_version: Optional[int] = None
+        self._watch_task: Optional[asyncio.Task] = None
+        # Отложенная пакетная запись счетчиков usage_count, click_count и новых пользователей
+        self.counters = CounterBuffer(self.pool)
+        # Сводная статистика по дням (см. database/analytics.py)
+        self.analytics = Analytics(self.pool)
+
+    def init_db(self) -> int:
+        """Создание или обновление схемы базы данных, возвращает версию схемы"""
+        started = time.perf_counter()
+        self.schema_version = migrate(self.db_path)
+        logger.info("База данных %s: версия схемы %d, проверка заняла %.1f мс",
+                    self.db_path, self.schema_version, (time.perf_counter() - started) * 1000)
+        return self.schema_version
+
+    async def start(self) -> None:
+        """
+        Подготовка к работе: прогрев кэша фильмов, загрузка фильтра и индекса
+        кодов и запуск записи счетчиков и статистики
+        """
+        if self.catalogue_poll_interval:
+            # Общая версия запоминается до прогрева, чтобы не пропустить изменения
+            await self.sync_catalogue()
+            self._watch_task = asyncio.create_task(self._watch_catalogue())
+        await self.warm_movie_cache()
+        await self.load_code_filter(with_index=True)
+        self.counters.start()
+        self.analytics.start()
+
+    async def close(self) -> None:
+        """Запись накопленных счетчиков и статистики и закрытие всех соединений с базой данных"""
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            await asyncio.gather(self._watch_task, return_exceptions=True)
+            self._watch_task = None
+        await self.counters.stop()
+        await self.analytics.stop()
+        self.pool.close()
+
+    async def sync_catalogue(self) -> bool:
+        """
+        Сверка с общей версией каталога, которую меняют триггеры на movies.
+        Если каталог изменился (в том числе в другом процессе), кэш фильмов
+        сбрасывается, а новые коды догружаются в фильтр; возвращает True,
+        если кэши были сброшены
+        """
+        row = await self.pool.fetchone("SELECT version FROM catalogue_state WHERE id = 1")
+        version = row[0] if row else 0
+        if self._shared_catalogue_version is None or version == self._shared_catalogue_version:
+            self._shared_catalogue_version = version
+            return False
+
+        self._shared_catalogue_version = version
+        self.catalogue_version += 1
+        self.movie_cache.clear()
+        if self.code_filter.ready:
+            await self.extend_code_filter()
+        return True
+
+    async def _watch_catalogue(self) -> None:
+        while True:
+            await asyncio.sleep(self.catalogue_poll_interval)
+            try:
+                await self.sync_catalogue()
+            except Exception:
+                logger.exception("Ошибка проверки версии каталога")
+
     # Методы для работы с фильмами
-    
-    def add_movie(self, code: str, title: str) -> bool:
-        """Добавление нового фильма"""
+
+    async def add_movie(self, code: str, title: str, file_id: Optional[str] = None,
+                        file_type: Optional[str] = None, source_chat_id: Optional[int] = None,
+                        source_message_id: Optional[int] = None) -> bool:
+        """Добавление нового фильма (с видео: file_id и/или исходное сообщение в канале)"""
         try:
-            self.connect()
-            self.cursor.execute(
-                "INSERT INTO movies (code, title, usage_count) VALUES (?, ?, 0)",
-                (code, title)
+            await self.pool.execute(
+                """
+                INSERT INTO movies (code, title, usage_count, file_id, file_type, source_chat_id, source_message_id)
+                VALUES (?, ?, 0, ?, ?, ?, ?)
+                """,
+                (code, title, file_id, file_type, source_chat_id, source_message_id)
             )
-            self.conn.commit()
+            self.code_filter.add(code)
+            self.code_index.add(code)
+            if self.code_filter.needs_rebuild:
+                await self.load_code_filter()
             return True
         except sqlite3.IntegrityError:
             # Код уже существует
             return False
         finally:
-            self.disconnect()
-    
-    def get_movie_by_code(self, code: str) -> Optional[Dict[str, Any]]:
-        """Получение фильма по коду"""
-        self.connect()
-        self.cursor.execute("SELECT * FROM movies WHERE code = ?", (code,))
-        movie = self.cursor.fetchone()
-        self.disconnect()
-        
-        if movie:
+            self._invalidate_movie(code)
+
+    async def add_movies(self, movies: Sequence[Tuple[str, str]]) -> Dict[str, str]:
+        """
+        Пакетное добавление фильмов (код, название) одной транзакцией.
+        Коды, которые уже есть в каталоге, не меняются; возвращает {код: название в каталоге} для них
+        """
+        def write(conn: sqlite3.Connection) -> Dict[str, str]:
+            existing: Dict[str, str] = {}
+            codes = [code for code, _ in movies]
+            # Ограничение SQLite на число параметров запроса
+            for start in range(0, len(codes), 500):
+                part = codes[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT code, title FROM movies WHERE code IN ({', '.join('?' * len(part))})", part
+                ).fetchall()
+                existing.update((row["code"], row["title"]) for row in rows)
+            conn.executemany(
+                "INSERT INTO movies (code, title, usage_count) VALUES (?, ?, 0)",
+                [movie for movie in movies if movie[0] not in existing]
+            )
+            return existing
+
+        existing = await self.pool.write(write)
+        self.catalogue_version += 1
+        for code, _ in movies:
+            if code not in existing:
+                self.code_filter.add(code)
+                self.code_index.add(code)
+                self.movie_cache.pop(code)
+        if self.code_filter.needs_rebuild:
+            await self.load_code_filter()
+        return existing
+
+    async def get_movie_by_code(self, code: str) -> Optional[Dict[str, Any]]:
+        """Получение фильма по коду (сначала из кэша)"""
+        movie = self.movie_cache.get(code)
+        if movie is not None:
             return dict(movie)
+
+        if not self.code_filter.might_contain(code):
+            return None
+
+        version = self.catalogue_version
+        row = await self.pool.fetchone("SELECT * FROM movies WHERE code = ?", (code,))
+
+        if row:
+            movie = dict(row)
+            # Если каталог изменился во время запроса, результат может быть устаревшим
+            if version == self.catalogue_version:
+                self.movie_cache.set(code, movie)
+            return dict(movie)
+        if self.code_filter.ready:
+            self.code_filter.false_positives += 1
         return None
-    
-    def increment_movie_usage(self, code: str) -> bool:
-        """Увеличение счетчика использования фильма"""
-        self.connect()
-        self.cursor.execute(
-            "UPDATE movies SET usage_count = usage_count + 1 WHERE code = ?",
-            (code,)
+
+    async def suggest_codes(self, code: str, limit: int = 5) -> List[Dict[str, Any]]:
+        """
+        Фильмы с кодами, похожими на code (опечатка, регистр, пробелы): сначала
+        совпадающие без учета регистра и разделителей, затем самые популярные
+        """
+        candidates = self.code_index.suggest(code)
+        if not candidates:
+            return []
+        distances = dict(candidates)
+        # Запрос к базе отсеивает фильмы, удаленные другими процессами, и дает названия
+        rows = await self.pool.fetchall(
+            f"SELECT code, title, usage_count FROM movies WHERE code IN ({', '.join('?' * len(distances))})",
+            list(distances)
+        )
+        movies = sorted((dict(row) for row in rows),
+                        key=lambda movie: (distances[movie["code"]], -movie["usage_count"]))
+        return movies[:limit]
+
+    def _invalidate_movie(self, code: str) -> None:
+        """Сброс кэшированного фильма после изменения каталога"""
+        self.catalogue_version += 1
+        self.movie_cache.pop(code)
+
+    async def warm_movie_cache(self) -> int:
+        """Загрузка самых популярных фильмов в кэш, возвращает число загруженных"""
+        rows = await self.pool.fetchall(
+            "SELECT * FROM movies ORDER BY usage_count DESC LIMIT ?",
+            (self.movie_cache.maxsize,)
+        )
+        # Самые популярные загружаются последними, чтобы вытесняться позже остальных
+        for row in reversed(rows):
+            self.movie_cache.set(row["code"], dict(row))
+        return len(rows)
+
+    async def load_code_filter(self, chunk_size: int = 5000, with_index: bool = False) -> int:
+        """
+        Построение фильтра кодов (и, если with_index, индекса подсказок) по всему
+        каталогу порциями, без загрузки каталога в память; возвращает число кодов
+        """
+        async with self._code_filter_lock:
+            # Фильмы с id больше max_id, добавленные во время загрузки, догрузит extend_code_filter
+            row = await self.pool.fetchone("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM movies")
+            count, max_id = row[0], row[1]
+            self.code_filter.begin(count)
+            if with_index:
+                self.code_index.clear()
+            async for chunk in self.iter_movie_chunks(("code",), chunk_size):
+                codes = [movie["code"] for movie in chunk]
+                self.code_filter.load(codes)
+                if with_index:
+                    self.code_index.load(codes)
+            self.code_filter.finish(max_id)
+            return count
+
+    async def extend_code_filter(self) -> int:
+        """
+        Догрузка в фильтр и индекс фильмов, добавленных другими процессами (movies.id
+        больше уже загруженных). Удаленные коды остаются в фильтре до перестроения,
+        а в индексе - до перезапуска (suggest_codes их не возвращает)
+        """
+        if self.code_filter.needs_rebuild:
+            return await self.load_code_filter()
+
+        rows = await self.pool.fetchall("SELECT id, code FROM movies WHERE id > ? ORDER BY id",
+                                        (self.code_filter.max_id,))
+        for row in rows:
+            self.code_filter.add(row["code"])
+            self.code_index.add(row["code"])
+        if rows:
+            self.code_filter.max_id = max(self.code_filter.max_id, rows[-1]["id"])
+        return len(rows)
+
+    async def increment_movie_usage(self, code: str) -> None:
+        """Увеличение счетчика использования фильма (запись в базу отложенная)"""
+        self.counters.add_usage(code)
+        cached = self.movie_cache.peek(code)
+        if cached is not None:
+            cached["usage_count"] += 1
+
+    async def set_movie_file(self, code: str, file_id: Optional[str], file_type: Optional[str]) -> bool:
+        """Замена file_id фильма (None - удалить устаревший)"""
+        updated = await self.pool.execute(
+            "UPDATE movies SET file_id = ?, file_type = ? WHERE code = ?",
+            (file_id, file_type, code)
         )
-        updated = self.cursor.rowcount > 0
-        self.conn.commit()
-        self.disconnect()
-        return updated
-    
-    def get_all_movies(self) -> List[Dict[str, Any]]:
+        self._invalidate_movie(code)
+        return updated > 0
+
+    async def get_all_movies(self) -> List[Dict[str, Any]]:
         """Получение всех фильмов"""
-        self.connect()
-        self.cursor.execute("SELECT * FROM movies ORDER BY created_at DESC")
-        movies = [dict(row) for row in self.cursor.fetchall()]
-        self.disconnect()
-        return movies
-    
-    def delete_movie(self, code: str) -> bool:
+        rows = await self.pool.fetchall("SELECT * FROM movies ORDER BY created_at DESC")
+        return [dict(row) for row in rows]
+
+    async def get_movies_page(self, limit: int, before_id: Optional[int] = None,
+                              after_id: Optional[int] = None, query: Optional[str] = None
+                              ) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        Страница каталога от новых фильмов к старым.
+        before_id - следующая страница (фильмы старше), after_id - предыдущая (новее).
+        query - поиск по началу кода или части названия.
+        Возвращает фильмы и признак того, что в выбранном направлении есть еще фильмы.
+        """
+        conditions, params = [], []
+        if query:
+            pattern = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            conditions.append("(code LIKE ? ESCAPE '\\' OR title LIKE ? ESCAPE '\\')")
+            params += [pattern + "%", "%" + pattern + "%"]
+
+        if after_id is not None:
+            conditions.append("id > ?")
+            params.append(after_id)
+            order = "ASC"
+        else:
+            if before_id is not None:
+                conditions.append("id < ?")
+                params.append(before_id)
+            order = "DESC"
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = await self.pool.fetchall(
+            f"SELECT id, code, title, usage_count FROM movies {where} ORDER BY id {order} LIMIT ?",
+            (*params, limit + 1)
+        )
+        movies = [dict(row) for row in rows[:limit]]
+        if order == "ASC":
+            movies.reverse()
+        return movies, len(rows) > limit
+
+    async def delete_movie(self, code: str) -> bool:
         """Удаление фильма по коду"""
-        self.connect()
-        self.cursor.execute("DELETE FROM movies WHERE code = ?", (code,))
-        deleted = self.cursor.rowcount > 0
-        self.conn.commit()
-        self.disconnect()
-        return deleted
-    
+        deleted = await self.pool.execute("DELETE FROM movies WHERE code = ?", (code,))
+        self._invalidate_movie(code)
+        if deleted:
+            self.code_index.remove(code)
+        return deleted > 0
+
     # Методы для работы с пользователями
-    
-    def add_or_update_user(self, user_id: int, username: str = None, 
-                          first_name: str = None, last_name: str = None) -> None:
+
+    async def add_or_update_user(self, user_id: int, username: str = None,
+                                 first_name: str = None, last_name: str = None) -> None:
         """Добавление или обновление пользователя"""
-        self.connect()
-        self.cursor.execute(
+        await self.pool.execute(
             """
             INSERT INTO users (user_id, username, first_name, last_name, click_count)
             VALUES (?, ?, ?, ?, 0)
@@ -141,62 +347,376 @@ class DatabaseManager:
             """,
             (user_id, username, first_name, last_name)
         )
-        self.conn.commit()
-        self.disconnect()
-    
-    def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+
+    def register_user(self, user_id: int, username: str = None,
+                      first_name: str = None, last_name: str = None) -> None:
+        """Добавление или обновление пользователя при следующей пакетной записи счетчиков"""
+        self.counters.add_user(user_id, username, first_name, last_name)
+
+    def mark_seen(self, user_id: int) -> None:
+        """
+        Учет обращения пользователя: статистика и last_seen (не чаще раза в день,
+        поэтому почти все обращения обходятся без записи в базу)
+        """
+        if self.analytics.active(user_id):
+            self.counters.add_seen(user_id, int(time.time()))
+
+    def record_lookup(self, user_id: int) -> None:
+        """Пользователь нашел фильм по коду (сегмент lookups)"""
+        self.counters.add_lookup(user_id)
+
+    def set_user_status(self, user_id: int, status: str) -> None:
+        """Пользователь недоступен для рассылок: blocked или deactivated"""
+        self.counters.set_status(user_id, status, int(time.time()))
+
+    async def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
         """Получение пользователя по ID"""
-        self.connect()
-        self.cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-        user = self.cursor.fetchone()
-        self.disconnect()
-        
+        user = await self.pool.fetchone("SELECT * FROM users WHERE user_id = ?", (user_id,))
+
         if user:
-            return dict(user)
+            user = dict(user)
+            # Счетчик кликов мог еще не попасть в базу
+            pending = self.counters.pending_click_count(user_id)
+            if pending is not None:
+                user["click_count"] = pending
+            return user
         return None
-    
-    def increment_click_count(self, user_id: int) -> int:
+
+    async def increment_click_count(self, user_id: int) -> int:
         """Увеличение счетчика кликов пользователя и возврат нового значения"""
-        self.connect()
-        self.cursor.execute(
-            """
-            UPDATE users SET click_count = click_count + 1 WHERE user_id = ?
-            RETURNING click_count
-            """,
-            (user_id,)
-        )
-        result = self.cursor.fetchone()
-        self.conn.commit()
-        self.disconnect()
-        
-        if result:
-            return result[0]
-        return 0
-    
-    def reset_click_count(self, user_id: int) -> None:
+        return await self.counters.increment_click(user_id)
+
+    async def reset_click_count(self, user_id: int) -> None:
         """Сброс счетчика кликов пользователя"""
-        self.connect()
-        self.cursor.execute(
-            "UPDATE users SET click_count = 0 WHERE user_id = ?",
-            (user_id,)
-        )
-        self.conn.commit()
-        self.disconnect()
-    
-    def set_admin_status(self, user_id: int, is_admin: bool) -> None:
+        self.counters.reset_click(user_id)
+
+    async def set_admin_status(self, user_id: int, is_admin: bool) -> None:
         """Установка статуса администратора для пользователя"""
-        self.connect()
-        self.cursor.execute(
+        await self.pool.execute(
             "UPDATE users SET is_admin = ? WHERE user_id = ?",
             (1 if is_admin else 0, user_id)
         )
-        self.conn.commit()
-        self.disconnect()
-    
-    def get_all_users(self) -> List[Dict[str, Any]]:
+
+    async def get_all_users(self) -> List[Dict[str, Any]]:
         """Получение всех пользователей"""
-        self.connect()
-        self.cursor.execute("SELECT * FROM users")
-        users = [dict(row) for row in self.cursor.fetchall()]
-        self.disconnect()
-        return users
+        rows = await self.pool.fetchall("SELECT * FROM users")
+        return [dict(row) for row in rows]
+
+    async def count_users(self, after_row: int = 0) -> int:
+        """Количество пользователей (после строки after_row)"""
+        row = await self.pool.fetchone("SELECT COUNT(*) FROM users WHERE id > ?", (after_row,))
+        return row[0]
+
+    @staticmethod
+    def _segment_condition(segment: str) -> str:
+        condition = USER_SEGMENTS.get(segment)
+        if condition is None:
+            raise ValueError(f"Неизвестный сегмент пользователей: {segment}")
+        return condition
+
+    async def count_segment(self, segment: str, since: Optional[int] = None, after_row: int = 0) -> int:
+        """Число пользователей сегмента (после строки after_row); считается по индексу"""
+        condition = self._segment_condition(segment)
+        where = f"({condition}) AND id > :after" if after_row else condition
+        row = await self.pool.fetchone(f"SELECT COUNT(*) FROM users WHERE {where}",
+                                       {"since": since, "after": after_row})
+        return row[0]
+
+    async def iter_segment_chunks(self, segment: str, since: Optional[int] = None, chunk_size: int = 500,
+                                  after_id: int = 0) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Пользователи сегмента порциями (id, user_id) в порядке users.id.
+        NOT INDEXED: обход идет по первичному ключу, иначе для каждой порции
+        SQLite выбирал бы весь сегмент по индексу и сортировал его заново
+        """
+        condition = self._segment_condition(segment)
+        while True:
+            rows = await self.pool.fetchall(
+                f"SELECT id, user_id FROM users NOT INDEXED WHERE id > :after AND ({condition}) "
+                f"ORDER BY id LIMIT :limit",
+                {"since": since, "after": after_id, "limit": chunk_size}
+            )
+            if not rows:
+                return
+
+            yield [dict(row) for row in rows]
+
+            if len(rows) < chunk_size:
+                return
+            after_id = rows[-1]["id"]
+
+    # Потоковое чтение таблиц порциями по первичному ключу (keyset-пагинация)
+
+    async def _iter_chunks(self, table: str, allowed: Sequence[str], columns: Optional[Sequence[str]],
+                           chunk_size: int, after_id: Optional[int], descending: bool
+                           ) -> AsyncIterator[List[Dict[str, Any]]]:
+        if columns is None:
+            select = "*"
+        else:
+            unknown = set(columns) - set(allowed)
+            if unknown:
+                raise ValueError(f"Неизвестные столбцы таблицы {table}: {', '.join(sorted(unknown))}")
+            # id нужен для курсора, поэтому выбирается всегда
+            select = ", ".join(dict.fromkeys(("id", *columns)))
+
+        order, op = ("DESC", "<") if descending else ("ASC", ">")
+        while True:
+            if after_id is None:
+                rows = await self.pool.fetchall(
+                    f"SELECT {select} FROM {table} ORDER BY id {order} LIMIT ?",
+                    (chunk_size,)
+                )
+            else:
+                rows = await self.pool.fetchall(
+                    f"SELECT {select} FROM {table} WHERE id {op} ? ORDER BY id {order} LIMIT ?",
+                    (after_id, chunk_size)
+                )
+            if not rows:
+                return
+
+            yield [dict(row) for row in rows]
+
+            if len(rows) < chunk_size:
+                return
+            after_id = rows[-1]["id"]
+
+    def iter_movie_chunks(self, columns: Optional[Sequence[str]] = None, chunk_size: int = 500,
+                          after_id: Optional[int] = None) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Фильмы порциями, от новых к старым"""
+        return self._iter_chunks("movies", MOVIE_COLUMNS, columns, chunk_size, after_id, descending=True)
+
+    async def iter_movies(self, columns: Optional[Sequence[str]] = None,
+                          chunk_size: int = 500) -> AsyncIterator[Dict[str, Any]]:
+        """Потоковый обход фильмов, от новых к старым"""
+        async for chunk in self.iter_movie_chunks(columns, chunk_size):
+            for movie in chunk:
+                yield movie
+
+    def iter_user_chunks(self, columns: Optional[Sequence[str]] = None, chunk_size: int = 500,
+                         after_id: Optional[int] = None) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Пользователи порциями в порядке users.id (начиная после строки after_id)"""
+        return self._iter_chunks("users", USER_COLUMNS, columns, chunk_size, after_id, descending=False)
+
+    async def iter_users(self, columns: Optional[Sequence[str]] = None,
+                         chunk_size: int = 500) -> AsyncIterator[Dict[str, Any]]:
+        """Потоковый обход пользователей"""
+        async for chunk in self.iter_user_chunks(columns, chunk_size):
+            for user in chunk:
+                yield user
+
+    async def iter_user_profile_chunks(self, chunk_size: int = 5000) -> AsyncIterator[List[tuple]]:
+        """Кортежи (user_id, username, first_name, last_name) порциями в порядке user_id"""
+        after_user_id = None
+        while True:
+            if after_user_id is None:
+                rows = await self.pool.fetchall(
+                    "SELECT user_id, username, first_name, last_name FROM users ORDER BY user_id LIMIT ?",
+                    (chunk_size,)
+                )
+            else:
+                rows = await self.pool.fetchall(
+                    "SELECT user_id, username, first_name, last_name FROM users "
+                    "WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                    (after_user_id, chunk_size)
+                )
+            if not rows:
+                return
+
+            yield [tuple(row) for row in rows]
+            after_user_id = rows[-1][0]
+
+    # Методы для работы с заявками в каналы
+
+    async def add_channel_request(self, user_id: int, channel_id: int, status: str = "pending") -> None:
+        """Сохранение заявки пользователя в канал (повторная заявка обновляет существующую)"""
+        await self.pool.execute(
+            """
+            INSERT INTO channel_requests (user_id, channel_id, status)
+            VALUES (?, ?, ?)
+            ON CONFLICT(user_id, channel_id) DO UPDATE SET
+                status = excluded.status,
+                request_date = CURRENT_TIMESTAMP
+            """,
+            (user_id, channel_id, status)
+        )
+
+    async def update_channel_request_status(self, user_id: int, channel_id: int, status: str) -> None:
+        """Обновление статуса заявки"""
+        await self.pool.execute(
+            "UPDATE channel_requests SET status = ? WHERE user_id = ? AND channel_id = ?",
+            (status, user_id, channel_id)
+        )
+
+    async def get_channel_requests(self, user_id: int) -> Dict[int, str]:
+        """Статусы заявок пользователя: channel_id -> status"""
+        rows = await self.pool.fetchall(
+            "SELECT channel_id, status FROM channel_requests WHERE user_id = ?",
+            (user_id,)
+        )
+        return {row["channel_id"]: row["status"] for row in rows}
+
+    # Очередь одобрения заявок в каналы (см. utils/join_queue.py)
+
+    async def write_join_queue(self, enqueued: List[Tuple[int, int, float]], approved: List[Tuple[int, int, int]],
+                               dropped: List[int], retries: List[Tuple[int, float, int]]) -> None:
+        """
+        Пакетная запись одной транзакцией: новые заявки (user_id, channel_id, время),
+        одобренные (id, user_id, channel_id), снятые с очереди без одобрения (id)
+        и отложенные после ошибки (attempts, next_attempt_at, id)
+        """
+        def write(conn: sqlite3.Connection) -> None:
+            if enqueued:
+                conn.executemany(
+                    """
+                    INSERT INTO channel_requests (user_id, channel_id, status) VALUES (?, ?, 'pending')
+                    ON CONFLICT(user_id, channel_id) DO UPDATE SET
+                        status = excluded.status,
+                        request_date = CURRENT_TIMESTAMP
+                    """,
+                    [(user_id, channel_id) for user_id, channel_id, _ in enqueued]
+                )
+                # Повторная заявка, которая еще в очереди, не дублируется
+                conn.executemany(
+                    "INSERT OR IGNORE INTO join_queue (user_id, channel_id, created_at, next_attempt_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    [(user_id, channel_id, created_at, created_at) for user_id, channel_id, created_at in enqueued]
+                )
+            if approved:
+                conn.executemany("DELETE FROM join_queue WHERE id = ?", [(row[0],) for row in approved])
+                conn.executemany(
+                    "UPDATE channel_requests SET status = 'approved' WHERE user_id = ? AND channel_id = ?",
+                    [(user_id, channel_id) for _, user_id, channel_id in approved]
+                )
+            if dropped:
+                conn.executemany("DELETE FROM join_queue WHERE id = ?", [(row_id,) for row_id in dropped])
+            if retries:
+                conn.executemany("UPDATE join_queue SET attempts = ?, next_attempt_at = ? WHERE id = ?", retries)
+        await self.pool.write(write)
+
+    async def claim_join_requests(self, now: float, lease_until: float, limit: int) -> List[Dict[str, Any]]:
+        """
+        Захват заявок, которые пора одобрять: до lease_until их не возьмет никто другой,
+        в том числе другой процесс. Если процесс остановится, не закончив, заявки
+        вернутся в работу по истечении срока
+        """
+        # Одна инструкция UPDATE ... RETURNING: два процесса не захватят одну заявку
+        def write(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+            rows = conn.execute(
+                """
+                UPDATE join_queue SET next_attempt_at = ? WHERE id IN (
+                    SELECT id FROM join_queue WHERE next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?
+                )
+                RETURNING id, user_id, channel_id, created_at, attempts
+                """,
+                (lease_until, now, limit)
+            ).fetchall()
+            return sorted((dict(row) for row in rows), key=lambda row: row["created_at"])
+        return await self.pool.write(write)
+
+    async def get_join_queue_state(self) -> Tuple[int, Optional[float]]:
+        """Число заявок в очереди и время поступления самой старой"""
+        row = await self.pool.fetchone("SELECT COUNT(*), MIN(created_at) FROM join_queue")
+        return row[0], row[1]
+
+    # Методы для работы с каналами
+
+    async def get_channels(self) -> List[Dict[str, Any]]:
+        """Каналы в порядке добавления (в формате CHANNELS: id, title, link)"""
+        rows = await self.pool.fetchall(
+            "SELECT channel_id AS id, title, link FROM channels ORDER BY position, channel_id"
+        )
+        return [dict(row) for row in rows]
+
+    async def get_channels_version(self) -> int:
+        """Версия списка каналов (растет при любом изменении, в том числе из других процессов)"""
+        row = await self.pool.fetchone("SELECT version FROM channel_state WHERE id = 1")
+        return row[0] if row else 0
+
+    async def add_channel(self, channel_id: int, title: str, link: str) -> bool:
+        """Добавление канала или изменение названия и ссылки; True, если канал новый"""
+        def write(conn: sqlite3.Connection) -> bool:
+            exists = conn.execute("SELECT 1 FROM channels WHERE channel_id = ?", (channel_id,)).fetchone()
+            if exists:
+                conn.execute("UPDATE channels SET title = ?, link = ? WHERE channel_id = ?",
+                             (title, link, channel_id))
+                return False
+            conn.execute(
+                "INSERT INTO channels (channel_id, title, link, position) "
+                "VALUES (?, ?, ?, (SELECT COALESCE(MAX(position), 0) + 1 FROM channels))",
+                (channel_id, title, link)
+            )
+            return True
+        return await self.pool.write(write)
+
+    async def delete_channel(self, channel_id: int) -> bool:
+        """Удаление канала"""
+        return await self.pool.execute("DELETE FROM channels WHERE channel_id = ?", (channel_id,)) > 0
+
+    async def seed_channels(self, channels: List[Dict[str, Any]]) -> bool:
+        """
+        Однократное заполнение таблицы каналов из CHANNELS (config.py).
+        Возвращает True, если каналы были добавлены; после удаления всех
+        каналов из админ-панели список повторно не заполняется
+        """
+        def write(conn: sqlite3.Connection) -> bool:
+            if conn.execute("SELECT seeded FROM channel_state WHERE id = 1").fetchone()[0]:
+                return False
+            conn.executemany(
+                "INSERT OR IGNORE INTO channels (channel_id, title, link, position) VALUES (?, ?, ?, ?)",
+                [(channel["id"], channel["title"], channel.get("link", ""), position)
+                 for position, channel in enumerate(channels, start=1)]
+            )
+            conn.execute("UPDATE channel_state SET seeded = 1 WHERE id = 1")
+            return True
+        return await self.pool.write(write)
+
+    # Методы для работы с рассылками
+
+    async def create_broadcast(self, text: str, total: int, admin_chat_id: int,
+                               segment: str = "all", segment_since: Optional[int] = None) -> int:
+        """Создание задания рассылки по сегменту пользователей, возвращает его ID"""
+        return await self.pool.write(
+            lambda conn: conn.execute(
+                "INSERT INTO broadcasts (text, total, admin_chat_id, segment, segment_since) VALUES (?, ?, ?, ?, ?)",
+                (text, total, admin_chat_id, segment, segment_since)
+            ).lastrowid
+        )
+
+    async def get_broadcast(self, broadcast_id: int) -> Optional[Dict[str, Any]]:
+        """Получение задания рассылки по ID"""
+        row = await self.pool.fetchone("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,))
+
+        if row:
+            return dict(row)
+        return None
+
+    async def get_running_broadcasts(self) -> List[Dict[str, Any]]:
+        """Незавершенные рассылки (для продолжения после перезапуска)"""
+        rows = await self.pool.fetchall("SELECT * FROM broadcasts WHERE status = 'running' ORDER BY id")
+        return [dict(row) for row in rows]
+
+    async def set_broadcast_status_message(self, broadcast_id: int, message_id: int) -> None:
+        """Сохранение ID сообщения с прогрессом рассылки"""
+        await self.pool.execute(
+            "UPDATE broadcasts SET status_message_id = ? WHERE id = ?",
+            (message_id, broadcast_id)
+        )
+
+    async def save_broadcast_progress(self, broadcast_id: int, last_user_row: int,
+                                      sent: int, failed: int, blocked: int = 0) -> None:
+        """Сохранение курсора и счетчиков рассылки"""
+        await self.pool.execute(
+            "UPDATE broadcasts SET last_user_row = ?, sent = ?, failed = ?, blocked = ? WHERE id = ?",
+            (last_user_row, sent, failed, blocked, broadcast_id)
+        )
+
+    async def finish_broadcast(self, broadcast_id: int, status: str, sent: int, failed: int,
+                               blocked: int = 0) -> None:
+        """Завершение рассылки со статусом finished или cancelled"""
+        await self.pool.execute(
+            """
+            UPDATE broadcasts SET status = ?, sent = ?, failed = ?, blocked = ?, finished_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+            """,
+            (status, sent, failed, blocked, broadcast_id)
+        )
@@ -0,0 +1,187 @@
+import asyncio
+import json
+import logging
+import sqlite3
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from .cache import LRUCache
+from .pool import ConnectionPool
+
+logger = logging.getLogger(__name__)
+
+# Запись хранилища: состояние и данные
+Record = Tuple[Optional[str], Dict[str, Any]]
+
+EMPTY_RECORD: Record = (None, {})
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище FSM в таблице fsm_states.
+    Перед базой стоит горячий уровень в памяти: записи вытесняются, если не
+    использовались idle_ttl секунд или если их больше hot_size, поэтому память
+    не растет с числом пользователей. Отсутствие состояния тоже кэшируется,
+    так как FSM запрашивает состояние на каждый апдейт. Изменения сразу видны
+    при чтении и записываются в базу пачками по таймеру или по порогу.
+    Данные сохраняются в JSON, поэтому в них должны быть только JSON-типы.
+    """
+
+    def __init__(self, pool: ConnectionPool, hot_size: int = 10000, idle_ttl: float = 600,
+                 flush_interval: float = 1.0, max_pending: int = 500,
+                 key_builder: Optional[KeyBuilder] = None):
+        self._pool = pool
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self.hot = LRUCache(hot_size, idle_ttl)
+        # Измененные записи, еще не записанные в базу, и записываемые прямо сейчас
+        self._dirty: Dict[str, Record] = {}
+        self._flushing: Dict[str, Record] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._timer_task: Optional[asyncio.Task] = None
+        self.db_reads = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._dirty)
+
+    def _pending_record(self, key: str) -> Optional[Record]:
+        if key in self._dirty:
+            return self._dirty[key]
+        return self._flushing.get(key)
+
+    async def _get(self, key: str) -> Record:
+        record = self._pending_record(key)
+        if record is not None:
+            return record
+
+        record = self.hot.get(key)
+        if record is not None:
+            # Повторная запись продлевает время жизни: вытесняются только неактивные записи
+            self.hot.set(key, record)
+            return record
+
+        self.db_reads += 1
+        row = await self._pool.fetchone("SELECT state, data FROM fsm_states WHERE key = ?", (key,))
+
+        # Пока шел запрос, запись могла измениться
+        record = self._pending_record(key)
+        if record is not None:
+            return record
+
+        record = (row[0], json.loads(row[1]) if row[1] else {}) if row else EMPTY_RECORD
+        self.hot.set(key, record)
+        return record
+
+    def _put(self, key: str, record: Record) -> None:
+        self.hot.set(key, record)
+        self._dirty[key] = record
+        if self.pending >= self.max_pending and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.create_task(self.flush())
+
+    # Интерфейс BaseStorage
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = self.key_builder.build(key)
+        _, data = await self._get(storage_key)
+        self._put(storage_key, (state.state if isinstance(state, State) else state, data))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._get(self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        storage_key = self.key_builder.build(key)
+        state, _ = await self._get(storage_key)
+        self._put(storage_key, (state, data.copy()))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._get(self.key_builder.build(key))
+        return data.copy()
+
+    async def close(self) -> None:
+        """Остановка таймера и запись всех изменений"""
+        if self._timer_task is not None:
+            self._timer_task.cancel()
+            try:
+                await self._timer_task
+            except asyncio.CancelledError:
+                pass
+            self._timer_task = None
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self.flush()
+
+    # Запись в базу
+
+    @staticmethod
+    def _write_batch(conn: sqlite3.Connection, upserts: List[Tuple[str, Optional[str], str]],
+                     deletes: List[Tuple[str]]) -> None:
+        if upserts:
+            conn.executemany('''
+            INSERT INTO fsm_states (key, state, data) VALUES (?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                state = excluded.state,
+                data = excluded.data,
+                updated_at = CURRENT_TIMESTAMP
+            ''', upserts)
+        if deletes:
+            conn.executemany("DELETE FROM fsm_states WHERE key = ?", deletes)
+
+    async def flush(self) -> None:
+        """Запись накопленных изменений одной транзакцией"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+
+            records, self._dirty = self._dirty, {}
+            self._flushing = records
+            upserts, deletes = [], []
+            for key, (state, data) in records.items():
+                # Пустые записи (после state.clear()) удаляются из базы
+                if state is None and not data:
+                    deletes.append((key,))
+                else:
+                    upserts.append((key, state, json.dumps(data, ensure_ascii=False)))
+            try:
+                await self._pool.write(self._write_batch, upserts, deletes)
+            except Exception:
+                # Возвращаем записи в буфер, более новые изменения не затираем
+                for key, record in records.items():
+                    self._dirty.setdefault(key, record)
+                raise
+            finally:
+                self._flushing = {}
+
+            self.flushes += 1
+            self.flushed_rows += len(records)
+
+    async def _run_timer(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Ошибка записи состояний FSM в базу данных")
+
+    # Корутина, так как синхронные обработчики запуска aiogram вызывает в другом потоке
+    async def start(self) -> None:
+        """Запуск периодической записи"""
+        if self._timer_task is None:
+            self._timer_task = asyncio.create_task(self._run_timer())
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика горячего уровня и записи в базу"""
+        return {
+            **self.hot.stats(),
+            "db_reads": self.db_reads,
+            "pending": self.pending,
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+        }
@@ -0,0 +1,73 @@
+import heapq
+from typing import Dict, List, Tuple
+
+
+class SpaceSaving:
+    """
+    Самые частые значения потока в ограниченной памяти (алгоритм Space-Saving).
+    Хранится не больше capacity счетчиков; новое значение при заполнении
+    вытесняет самый редкий счетчик и наследует его число как погрешность.
+    Для каждого значения известна гарантированная частота count - error:
+    значение встретилось не меньше этого числа раз с момента сброса.
+    Частое значение (чаще 1/capacity доли потока) не может быть вытеснено.
+    """
+
+    def __init__(self, capacity: int = 1000):
+        self.capacity = capacity
+        # значение -> [count, error, сколько гарантированных уже выдано drain()]
+        self._counters: Dict[str, List[int]] = {}
+        # Куча (count, значение) с устаревшими записями, которые пропускаются при вытеснении
+        self._heap: List[Tuple[int, str]] = []
+        self.total = 0
+
+    def __len__(self) -> int:
+        return len(self._counters)
+
+    def add(self, item: str) -> None:
+        self.total += 1
+        counter = self._counters.get(item)
+        if counter is not None:
+            counter[0] += 1
+            heapq.heappush(self._heap, (counter[0], item))
+        elif len(self._counters) < self.capacity:
+            self._counters[item] = [1, 0, 0]
+            heapq.heappush(self._heap, (1, item))
+        else:
+            minimum = self._evict()
+            self._counters[item] = [minimum + 1, minimum, 0]
+            heapq.heappush(self._heap, (minimum + 1, item))
+        # Устаревших записей в куче не больше, чем актуальных
+        if len(self._heap) > 2 * self.capacity + 16:
+            self._heap = [(counter[0], value) for value, counter in self._counters.items()]
+            heapq.heapify(self._heap)
+
+    def _evict(self) -> int:
+        while True:
+            count, item = heapq.heappop(self._heap)
+            counter = self._counters.get(item)
+            if counter is not None and counter[0] == count:
+                del self._counters[item]
+                return count
+
+    def top(self, limit: int) -> List[Tuple[str, int, int]]:
+        """(значение, оценка частоты, погрешность) по убыванию оценки"""
+        items = sorted(self._counters.items(), key=lambda item: item[1][0], reverse=True)[:limit]
+        return [(item, counter[0], counter[1]) for item, counter in items]
+
+    def drain(self) -> List[Tuple[str, int]]:
+        """
+        Прирост гарантированной частоты значений с прошлого вызова: (значение, прирост).
+        Сумма приростов по значению никогда не превышает его настоящую частоту
+        """
+        increments = []
+        for item, counter in self._counters.items():
+            guaranteed = counter[0] - counter[1]
+            if guaranteed > counter[2]:
+                increments.append((item, guaranteed - counter[2]))
+                counter[2] = guaranteed
+        return increments
+
+    def clear(self) -> None:
+        self._counters.clear()
+        self._heap.clear()
+        self.total = 0
@@ -0,0 +1,325 @@
+import logging
+import sqlite3
+from contextlib import closing
+from typing import Callable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Миграция получает соединение внутри транзакции и не делает commit сама
+Migration = Callable[[sqlite3.Connection], None]
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _initial_schema(conn: sqlite3.Connection) -> None:
+    """Таблицы бота; для баз, созданных до появления версий, добавляет недостающие столбцы"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS movies (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        code TEXT UNIQUE NOT NULL,
+        title TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        usage_count INTEGER DEFAULT 0
+    )
+    ''')
+    if "usage_count" not in _columns(conn, "movies"):
+        conn.execute("ALTER TABLE movies ADD COLUMN usage_count INTEGER DEFAULT 0")
+
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER UNIQUE NOT NULL,
+        username TEXT,
+        first_name TEXT,
+        last_name TEXT,
+        joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        is_admin BOOLEAN DEFAULT 0,
+        click_count INTEGER DEFAULT 0
+    )
+    ''')
+    if "click_count" not in _columns(conn, "users"):
+        conn.execute("ALTER TABLE users ADD COLUMN click_count INTEGER DEFAULT 0")
+
+    # Рассылки: состояние задания и курсор по users.id
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS broadcasts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        text TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'running',
+        total INTEGER DEFAULT 0,
+        sent INTEGER DEFAULT 0,
+        failed INTEGER DEFAULT 0,
+        last_user_row INTEGER DEFAULT 0,
+        admin_chat_id INTEGER,
+        status_message_id INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        finished_at TIMESTAMP
+    )
+    ''')
+
+    # Заявки в каналы: одна запись на пару пользователь-канал
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS channel_requests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        channel_id INTEGER NOT NULL,
+        request_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        status TEXT NOT NULL DEFAULT 'pending'
+    )
+    ''')
+    conn.execute('''
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_channel_requests_user_channel
+    ON channel_requests (user_id, channel_id)
+    ''')
+
+    # Состояния FSM (см. database/fsm_storage.py)
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS fsm_states (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    ) WITHOUT ROWID
+    ''')
+
+
+def _movie_indexes(conn: sqlite3.Connection) -> None:
+    """Индексы для сортировок каталога: по дате добавления и по популярности (прогрев кэша)"""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_movies_created_at ON movies (created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_movies_usage_count ON movies (usage_count)")
+
+
+def _catalogue_state(conn: sqlite3.Connection) -> None:
+    """
+    Общая версия каталога для нескольких процессов: триггеры увеличивают ее
+    при любом изменении списка фильмов, процессы сверяют с ней свои кэши
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS catalogue_state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    conn.execute("INSERT OR IGNORE INTO catalogue_state (id, version) VALUES (1, 0)")
+    # Изменение usage_count не меняет каталог, поэтому UPDATE только по code и title
+    for name, event in (("insert", "INSERT"), ("delete", "DELETE"), ("update", "UPDATE OF code, title")):
+        conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_movies_catalogue_{name} AFTER {event} ON movies
+        BEGIN
+            UPDATE catalogue_state SET version = version + 1 WHERE id = 1;
+        END
+        ''')
+
+
+def _channels(conn: sqlite3.Connection) -> None:
+    """
+    Каналы для обязательной подписки (раньше - список CHANNELS в config.py).
+    channel_state хранит версию списка для других процессов и признак того,
+    что список уже заполнен из CHANNELS
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS channels (
+        channel_id INTEGER PRIMARY KEY,
+        title TEXT NOT NULL,
+        link TEXT NOT NULL DEFAULT '',
+        position INTEGER NOT NULL DEFAULT 0,
+        added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS channel_state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL DEFAULT 0,
+        seeded INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    conn.execute("INSERT OR IGNORE INTO channel_state (id, version, seeded) VALUES (1, 0, 0)")
+    for name, event in (("insert", "INSERT"), ("delete", "DELETE"), ("update", "UPDATE")):
+        conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_channels_state_{name} AFTER {event} ON channels
+        BEGIN
+            UPDATE channel_state SET version = version + 1 WHERE id = 1;
+        END
+        ''')
+
+
+def _stats_rollups(conn: sqlite3.Connection) -> None:
+    """Сводные таблицы статистики по дням (UTC), которые пополняются по мере событий"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS stats_daily (
+        day TEXT PRIMARY KEY,
+        active_users INTEGER NOT NULL DEFAULT 0,
+        new_users INTEGER NOT NULL DEFAULT 0,
+        lookups INTEGER NOT NULL DEFAULT 0,
+        hits INTEGER NOT NULL DEFAULT 0,
+        promo_shown INTEGER NOT NULL DEFAULT 0,
+        join_requests INTEGER NOT NULL DEFAULT 0,
+        join_approved INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS stats_code_daily (
+        day TEXT NOT NULL,
+        code TEXT NOT NULL,
+        lookups INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, code)
+    ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS stats_channel_daily (
+        day TEXT NOT NULL,
+        channel_id INTEGER NOT NULL,
+        join_requests INTEGER NOT NULL DEFAULT 0,
+        join_approved INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, channel_id)
+    ) WITHOUT ROWID
+    ''')
+    # Лучшие коды дня для отчета о популярных кодах
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_stats_code_daily_lookups ON stats_code_daily (day, lookups)")
+    # Кто уже учтен в active_users за день; хранится только за последние дни
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS stats_active_users (
+        day TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        PRIMARY KEY (day, user_id)
+    ) WITHOUT ROWID
+    ''')
+
+
+def _movie_media(conn: sqlite3.Connection) -> None:
+    """
+    Видео фильма: file_id в Telegram и ссылка на исходное сообщение в канале.
+    Изменение этих столбцов тоже меняет версию каталога, чтобы другие
+    процессы не отправляли устаревший file_id из своих кэшей
+    """
+    columns = _columns(conn, "movies")
+    for column, definition in (("file_id", "TEXT"), ("file_type", "TEXT"),
+                               ("source_chat_id", "INTEGER"), ("source_message_id", "INTEGER")):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE movies ADD COLUMN {column} {definition}")
+    conn.execute("DROP TRIGGER IF EXISTS trg_movies_catalogue_update")
+    conn.execute('''
+    CREATE TRIGGER trg_movies_catalogue_update
+    AFTER UPDATE OF code, title, file_id, file_type, source_chat_id, source_message_id ON movies
+    BEGIN
+        UPDATE catalogue_state SET version = version + 1 WHERE id = 1;
+    END
+    ''')
+
+
+def _user_segments(conn: sqlite3.Connection) -> None:
+    """
+    Сегменты пользователей для рассылок: когда пользователь последний раз
+    обращался к боту, доступен ли он (не заблокировал ли бота) и искал ли фильмы.
+    Рассылка запоминает свой сегмент, чтобы после перезапуска продолжить с тем же
+    """
+    columns = _columns(conn, "users")
+    for column, definition in (("last_seen", "INTEGER"), ("status", "TEXT NOT NULL DEFAULT 'active'"),
+                               ("status_at", "INTEGER"), ("lookups", "INTEGER NOT NULL DEFAULT 0")):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE users ADD COLUMN {column} {definition}")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_status_last_seen ON users (status, last_seen)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_status_lookups ON users (status, lookups)")
+
+    # Рассылки, начатые до появления сегментов, продолжаются по всем пользователям
+    columns = _columns(conn, "broadcasts")
+    for column, definition in (("segment", "TEXT NOT NULL DEFAULT 'all'"), ("segment_since", "INTEGER"),
+                               ("blocked", "INTEGER NOT NULL DEFAULT 0")):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE broadcasts ADD COLUMN {column} {definition}")
+
+
+def _missing_codes(conn: sqlite3.Connection) -> None:
+    """
+    Самые частые несуществующие коды по дням: сколько раз их искали.
+    За день хранится ограниченное число кодов, редкие опечатки вытесняются
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS stats_missing_daily (
+        day TEXT NOT NULL,
+        code TEXT NOT NULL,
+        lookups INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, code)
+    ) WITHOUT ROWID
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_stats_missing_daily_lookups ON stats_missing_daily (day, lookups)")
+
+
+def _join_queue(conn: sqlite3.Connection) -> None:
+    """
+    Очередь заявок в каналы, ожидающих одобрения. Заявка удаляется из очереди,
+    когда одобрена или исчерпала попытки; next_attempt_at - когда ее можно взять
+    в работу (время захвата обработчиком или следующей попытки после ошибки)
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS join_queue (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        channel_id INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL,
+        UNIQUE (user_id, channel_id)
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_join_queue_next_attempt ON join_queue (next_attempt_at)")
+
+
+# Миграции по порядку: номер версии схемы равен позиции в списке (начиная с 1).
+# Новые миграции только добавляются в конец, уже выпущенные не меняются
+MIGRATIONS: List[Tuple[str, Migration]] = [
+    ("Начальная схема", _initial_schema),
+    ("Индексы movies.created_at и movies.usage_count", _movie_indexes),
+    ("Общая версия каталога catalogue_state", _catalogue_state),
+    ("Каналы в базе данных", _channels),
+    ("Сводные таблицы статистики", _stats_rollups),
+    ("Видео фильмов: file_id и исходное сообщение", _movie_media),
+    ("Сегменты пользователей для рассылок", _user_segments),
+    ("Несуществующие коды, которые ищут чаще всего", _missing_codes),
+    ("Очередь одобрения заявок в каналы", _join_queue),
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def migrate(db_path: str) -> int:
+    """
+    Приведение схемы базы к последней версии, возвращает версию схемы.
+    Версия хранится в PRAGMA user_version, поэтому для актуальной базы
+    это одно чтение заголовка файла. Каждая миграция выполняется в своей
+    транзакции вместе с записью новой версии.
+    """
+    with closing(sqlite3.connect(db_path, isolation_level=None)) as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version == SCHEMA_VERSION:
+            return version
+        if version > SCHEMA_VERSION:
+            raise RuntimeError(
+                f"Версия схемы базы {db_path} ({version}) новее, чем поддерживает бот ({SCHEMA_VERSION})"
+            )
+
+        # Новая база создается с auto_vacuum = INCREMENTAL: свободные страницы
+        # возвращаются файлу по частям фоновым обслуживанием (utils/maintenance.py).
+        # У существующей базы режим меняется только полным VACUUM
+        if version == 0 and conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone() is None:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        # Режим WAL сохраняется в файле базы и позволяет читать во время записи
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA busy_timeout = 5000")
+        for number, (description, migration) in enumerate(MIGRATIONS[version:], start=version + 1):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Другой процесс мог уже выполнить эту миграцию
+                if conn.execute("PRAGMA user_version").fetchone()[0] >= number:
+                    conn.execute("ROLLBACK")
+                    continue
+                migration(conn)
+                conn.execute(f"PRAGMA user_version = {number}")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            logger.info("База %s: миграция %d (%s)", db_path, number, description)
+        return SCHEMA_VERSION
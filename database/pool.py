@@ -0,0 +1,158 @@
+import asyncio
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, TypeVar
+
+T = TypeVar("T")
+
+# Обработчик замеров: (read/write, запрос, ожидание потока, выполнение, была ли ошибка)
+QueryObserver = Callable[[str, str, float, float, bool], None]
+
+# Таблица запроса: после FROM/INTO или сразу после UPDATE
+_TABLE = re.compile(r"^\s*UPDATE\s+(\w+)|\b(?:FROM|INTO)\s+(\w+)", re.IGNORECASE)
+
+# Настройки, которые применяются к каждому новому соединению
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 268435456",
+)
+
+
+def _func_label(func: Callable) -> str:
+    """Имя функции для замеров: CounterBuffer._write_batch, DatabaseManager.create_broadcast"""
+    return func.__qualname__.split(".<locals>")[0]
+
+
+class ConnectionPool:
+    """
+    Пул долгоживущих соединений SQLite.
+    Чтение выполняется в нескольких потоках-читателях, запись - в одном
+    потоке-писателе, поэтому транзакции записи никогда не конкурируют между собой,
+    а цикл событий aiogram не блокируется на диске.
+    """
+
+    def __init__(self, db_path: str, readers: int = 4):
+        self.db_path = db_path
+        # Замеры времени запросов (например, для метрик), None - замеры выключены
+        self.observer: Optional[QueryObserver] = None
+        # Число запросов через пул: по нему фоновое обслуживание оценивает нагрузку
+        self.queries = 0
+        self._labels: Dict[str, str] = {}
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-reader")
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+
+    def _connection(self, readonly: bool) -> sqlite3.Connection:
+        """Соединение текущего потока (создается при первом обращении)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+            if readonly:
+                conn.execute("PRAGMA query_only = ON")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _run_read(self, func: Callable[..., T], *args: Any) -> T:
+        return func(self._connection(readonly=True), *args)
+
+    def _run_write(self, func: Callable[..., T], *args: Any) -> T:
+        conn = self._connection(readonly=False)
+        try:
+            result = func(conn, *args)
+            conn.commit()
+            return result
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def _label(self, sql: str) -> str:
+        """Короткое имя запроса для замеров: операция и таблица, например SELECT movies"""
+        label = self._labels.get(sql)
+        if label is None:
+            words = sql.split(None, 1)
+            match = _TABLE.search(sql)
+            table = (match.group(1) or match.group(2)) if match else ""
+            label = f"{words[0].upper() if words else 'SQL'} {table}".strip()
+            self._labels[sql] = label
+        return label
+
+    async def _submit(self, executor: ThreadPoolExecutor, run: Callable[..., T], kind: str,
+                      label: Callable[[], str], func: Callable[..., T], *args: Any) -> T:
+        self.queries += 1
+        loop = asyncio.get_running_loop()
+        observer = self.observer
+        if observer is None:
+            return await loop.run_in_executor(executor, partial(run, func, *args))
+
+        # Замер времени ожидания свободного потока и времени выполнения
+        started = [0.0]
+
+        def timed(conn: sqlite3.Connection, *args: Any) -> T:
+            started[0] = time.perf_counter()
+            return func(conn, *args)
+
+        submitted = time.perf_counter()
+        failed = False
+        try:
+            return await loop.run_in_executor(executor, partial(run, timed, *args))
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            finished = time.perf_counter()
+            begun = started[0] or finished
+            observer(kind, label(), begun - submitted, finished - begun, failed)
+
+    async def read(self, func: Callable[..., T], *args: Any, sql: Optional[str] = None) -> T:
+        """Выполнение func(conn, *args) в потоке-читателе"""
+        label = (lambda: self._label(sql)) if sql else (lambda: _func_label(func))
+        return await self._submit(self._readers, self._run_read, "read", label, func, *args)
+
+    async def write(self, func: Callable[..., T], *args: Any, sql: Optional[str] = None) -> T:
+        """Выполнение func(conn, *args) в потоке-писателе в одной транзакции"""
+        label = (lambda: self._label(sql)) if sql else (lambda: _func_label(func))
+        return await self._submit(self._writer, self._run_write, "write", label, func, *args)
+
+    # Готовые операции для простых запросов
+
+    async def fetchone(self, sql: str, params: Sequence[Any] = ()) -> Optional[sqlite3.Row]:
+        return await self.read(lambda conn: conn.execute(sql, params).fetchone(), sql=sql)
+
+    async def fetchall(self, sql: str, params: Sequence[Any] = ()) -> List[sqlite3.Row]:
+        return await self.read(lambda conn: conn.execute(sql, params).fetchall(), sql=sql)
+
+    async def execute(self, sql: str, params: Sequence[Any] = ()) -> int:
+        """Выполнение запроса на запись, возвращает число измененных строк"""
+        return await self.write(lambda conn: conn.execute(sql, params).rowcount, sql=sql)
+
+    async def execute_fetchone(self, sql: str, params: Sequence[Any] = ()) -> Optional[sqlite3.Row]:
+        """Выполнение запроса на запись с RETURNING"""
+        return await self.write(lambda conn: conn.execute(sql, params).fetchone(), sql=sql)
+
+    async def executemany(self, sql: str, seq_of_params: Iterable[Sequence[Any]]) -> int:
+        """Пакетная запись одной транзакцией"""
+        return await self.write(lambda conn: conn.executemany(sql, seq_of_params).rowcount, sql=sql)
+
+    def close(self) -> None:
+        """Ожидание незавершенных запросов и закрытие всех соединений"""
+        self._readers.shutdown(wait=True)
+        self._writer.shutdown(wait=True)
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
@@ -1,15 +1,30 @@
+import os
+import tempfile
+from typing import Optional
+
 from aiogram import Router, F
-from aiogram.types import Message
-from aiogram.filters import Command, StateFilter
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import Message, CallbackQuery, FSInputFile
+from aiogram.filters import Command, CommandObject, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import BaseStorage
 
-from keyboards import get_admin_keyboard, get_start_keyboard
-from database import DatabaseManager
-from config import DB_PATH, ADMIN_IDS
-
-# Инициализация менеджера базы данных
-db = DatabaseManager(DB_PATH)
+from keyboards import (get_admin_keyboard, get_start_keyboard, BroadcastCallback, get_broadcast_keyboard,
+                       BroadcastSegmentCallback, get_broadcast_segments_keyboard, MoviesPageCallback, StatsCallback)
+from database import DatabaseManager, SQLiteStorage
+from config import ADMIN_IDS
+from utils.broadcast import BroadcastManager, SEGMENT_TITLES
+from utils.catalogue import MovieCatalogue
+from utils.catalogue_io import (CSV, FORMATS, MAX_IMPORT_SIZE, REPORT_EXAMPLES, ImportReport, detect_format,
+                                export_file_name, export_movies, import_movies)
+from utils.channel_manager import ChannelManager
+from utils.dashboard import render_dashboard, render_missing_codes
+from utils.join_queue import JoinApprover
+from utils.maintenance import DatabaseMaintenance
+from utils.scheduler import PriorityScheduler
+from utils.delivery import extract_media, forward_source
+from middlewares import RegistrationMiddleware, ThrottlingMiddleware
 
 # Создание роутера для админских команд
 router = Router()
@@ -20,7 +35,9 @@ class AdminStates(StatesGroup):
     adding_movie = State()    # Добавление фильма - ожидание кода
     adding_movie_title = State()  # Добавление фильма - ожидание названия
     deleting_movie = State()  # Удаление фильма
+    searching_movie = State() # Поиск по каталогу фильмов
     broadcasting = State()    # Рассылка сообщения
+    importing_movies = State()  # Импорт каталога - ожидание файла
 
 # Middleware для проверки прав администратора
 @router.message(Command("admin"))
@@ -64,12 +81,12 @@ async def add_movie_start(message: Message, state: FSMContext):
 
 # Обработчик ввода кода фильма
 @router.message(StateFilter(AdminStates.adding_movie))
-async def add_movie_code(message: Message, state: FSMContext):
+async def add_movie_code(message: Message, state: FSMContext, db: DatabaseManager):
     # Получаем код фильма
     code = message.text.strip()
     
     # Проверяем, существует ли фильм с таким кодом
-    existing_movie = db.get_movie_by_code(code)
+    existing_movie = await db.get_movie_by_code(code)
     
     if existing_movie:
         # Если фильм с таким кодом уже существует
@@ -82,27 +99,47 @@ async def add_movie_code(message: Message, state: FSMContext):
         await state.set_state(AdminStates.in_admin_panel)
     else:
         # Если код уникален, сохраняем его и запрашиваем название
-        await state.update_data(code=code)
+        await state.update_data(code=code, media=None, source=None)
         await state.set_state(AdminStates.adding_movie_title)
-        await message.answer("Введите название фильма:")
+        await message.answer(
+            "Введите название фильма или перешлите сообщение с видео из канала "
+            "(первая строка подписи станет названием):"
+        )
 
-# Обработчик ввода названия фильма
+# Обработчик ввода названия фильма или пересланного видео
 @router.message(StateFilter(AdminStates.adding_movie_title))
-async def add_movie_title(message: Message, state: FSMContext):
-    # Получаем название фильма
-    title = message.text.strip()
-    
-    # Получаем сохраненный код
+async def add_movie_title(message: Message, state: FSMContext, db: DatabaseManager):
     data = await state.get_data()
     code = data.get("code")
     
+    # Видео сохраняется по file_id (отправка без загрузки файла), а если сообщение
+    # переслано из канала - еще и ссылка на него, чтобы обновлять устаревший file_id
+    media = extract_media(message)
+    if media:
+        source = forward_source(message)
+        data.update(media=list(media), source=list(source) if source else None)
+        await state.update_data(media=data["media"], source=data["source"])
+    
+    # Название - текст сообщения или первая строка подписи к видео
+    title = (message.text or message.caption or "").strip().split("\n")[0].strip()
+    if not title:
+        if media:
+            await message.answer("Видео сохранено. Введите название фильма:")
+        else:
+            await message.answer("Введите название фильма текстом или перешлите сообщение с видео:")
+        return
+    
+    file_id, file_type = data.get("media") or (None, None)
+    source_chat_id, source_message_id = data.get("source") or (None, None)
+    
     # Добавляем фильм в базу данных
-    success = db.add_movie(code, title)
+    success = await db.add_movie(code, title, file_id, file_type, source_chat_id, source_message_id)
     
     if success:
         # Если фильм успешно добавлен
+        video = "есть" if file_id else "нет (будет отправляться только название)"
         await message.answer(
-            f"Фильм успешно добавлен:\nКод: {code}\nНазвание: {title}\nИспользований: 0",
+            f"Фильм успешно добавлен:\nКод: {code}\nНазвание: {title}\nВидео: {video}\nИспользований: 0",
             reply_markup=get_admin_keyboard()
         )
     else:
@@ -117,38 +154,29 @@ async def add_movie_title(message: Message, state: FSMContext):
 
 # Обработчик кнопки "Список фильмов"
 @router.message(StateFilter(AdminStates.in_admin_panel), F.text == "Список фильмов")
-async def list_movies(message: Message):
-    # Получаем список всех фильмов
-    movies = db.get_all_movies()
+async def list_movies(message: Message, state: FSMContext, catalogue: MovieCatalogue):
+    # Открываем первую страницу каталога без поиска
+    await state.update_data(catalogue_query=None)
+    page = await catalogue.render()
     
-    if movies:
-        # Если есть фильмы, формируем сообщение
-        movies_text = "Список фильмов:\n\n"
-        
-        for i, movie in enumerate(movies, 1):
-            movies_text += f"{i}. Код: {movie['code']} - {movie['title']} (Использований: {movie['usage_count']})\n"
-        
-        # Отправляем список фильмов
-        await message.answer(movies_text)
+    if page:
+        text, keyboard = page
+        await message.answer(text, reply_markup=keyboard)
     else:
         # Если фильмов нет
         await message.answer("В базе данных нет фильмов.")
 
 # Обработчик кнопки "Удалить фильм"
 @router.message(StateFilter(AdminStates.in_admin_panel), F.text == "Удалить фильм")
-async def delete_movie_start(message: Message, state: FSMContext):
-    # Получаем список всех фильмов
-    movies = db.get_all_movies()
+async def delete_movie_start(message: Message, state: FSMContext, catalogue: MovieCatalogue):
+    await state.update_data(catalogue_query=None)
+    page = await catalogue.render()
     
-    if movies:
-        # Если есть фильмы, формируем сообщение
-        movies_text = "Выберите фильм для удаления. Введите код фильма:\n\n"
-        
-        for i, movie in enumerate(movies, 1):
-            movies_text += f"{i}. Код: {movie['code']} - {movie['title']} (Использований: {movie['usage_count']})\n"
-        
-        # Отправляем список фильмов
-        await message.answer(movies_text)
+    if page:
+        # Показываем каталог, по которому можно листать и искать, и запрашиваем код
+        text, keyboard = page
+        await message.answer(text, reply_markup=keyboard)
+        await message.answer("Выберите фильм для удаления. Введите код фильма:")
         
         # Устанавливаем состояние удаления фильма
         await state.set_state(AdminStates.deleting_movie)
@@ -156,14 +184,64 @@ async def delete_movie_start(message: Message, state: FSMContext):
         # Если фильмов нет
         await message.answer("В базе данных нет фильмов для удаления.")
 
+# Обработчик кнопок навигации и поиска по каталогу
+@router.callback_query(MoviesPageCallback.filter())
+async def movies_page(callback: CallbackQuery, callback_data: MoviesPageCallback, state: FSMContext,
+                      catalogue: MovieCatalogue):
+    if callback.from_user.id not in ADMIN_IDS:
+        await callback.answer("У вас нет прав для доступа к админ-панели.")
+        return
+    
+    if callback_data.action == "search":
+        # Запоминаем, в какое состояние вернуться после ввода запроса
+        await state.update_data(catalogue_return_state=await state.get_state())
+        await state.set_state(AdminStates.searching_movie)
+        await callback.answer()
+        await callback.message.answer("Введите начало кода или часть названия фильма:")
+        return
+    
+    if callback_data.action == "reset":
+        await state.update_data(catalogue_query=None)
+    
+    data = await state.get_data()
+    page = await catalogue.render(callback_data.before_id, callback_data.after_id, data.get("catalogue_query"))
+    
+    if page is None:
+        # Фильмы на странице были удалены, возвращаемся к началу
+        page = await catalogue.render(query=data.get("catalogue_query"))
+    
+    await callback.answer()
+    if page:
+        text, keyboard = page
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    else:
+        await callback.message.edit_text("Фильмы не найдены.")
+
+# Обработчик ввода поискового запроса по каталогу
+@router.message(StateFilter(AdminStates.searching_movie))
+async def search_movies(message: Message, state: FSMContext, catalogue: MovieCatalogue):
+    query = message.text.strip()
+    data = await state.get_data()
+    
+    await state.update_data(catalogue_query=query)
+    await state.set_state(data.get("catalogue_return_state") or AdminStates.in_admin_panel)
+    
+    page = await catalogue.render(query=query)
+    
+    if page:
+        text, keyboard = page
+        await message.answer(text, reply_markup=keyboard)
+    else:
+        await message.answer(f"По запросу «{query}» фильмы не найдены.")
+
 # Обработчик ввода кода фильма для удаления
 @router.message(StateFilter(AdminStates.deleting_movie))
-async def delete_movie_code(message: Message, state: FSMContext):
+async def delete_movie_code(message: Message, state: FSMContext, db: DatabaseManager):
     # Получаем код фильма
     code = message.text.strip()
     
     # Удаляем фильм из базы данных
-    success = db.delete_movie(code)
+    success = await db.delete_movie(code)
     
     if success:
         # Если фильм успешно удален
@@ -181,54 +259,383 @@ async def delete_movie_code(message: Message, state: FSMContext):
     # Возвращаемся в админ-панель
     await state.set_state(AdminStates.in_admin_panel)
 
+# Подсказка по формату файла импорта
+IMPORT_HELP = (
+    "Отправьте файл каталога:\n"
+    "CSV - строки «код,название» (разделитель - запятая, точка с запятой или табуляция; "
+    "первая строка может быть заголовком code,title);\n"
+    "JSON - массив объектов {\"code\": ..., \"title\": ...} или такие объекты по одному в строке (.jsonl).\n"
+    "Коды, которые уже есть в каталоге, не изменятся. Файл выгрузки /export тоже подходит.\n"
+    "Любое сообщение без файла отменяет импорт."
+)
+
+# Обработчик команды /import - загрузка каталога из файла
+@router.message(StateFilter(AdminStates.in_admin_panel), Command("import"))
+async def import_start(message: Message, state: FSMContext):
+    await state.set_state(AdminStates.importing_movies)
+    await message.answer(IMPORT_HELP)
+
+# Обработчик файла каталога
+@router.message(StateFilter(AdminStates.importing_movies), F.document)
+async def import_file(message: Message, state: FSMContext, db: DatabaseManager):
+    document = message.document
+    file_format = detect_format(document.file_name)
+    if file_format is None:
+        await message.answer("Нужен файл .csv, .json или .jsonl. Отправьте другой файл или любое сообщение для отмены.")
+        return
+    if document.file_size and document.file_size > MAX_IMPORT_SIZE:
+        await message.answer(f"Файл больше {MAX_IMPORT_SIZE >> 20} МБ: Telegram не дает ботам скачивать такие файлы. "
+                             "Разделите его на части.")
+        return
+    
+    await state.set_state(AdminStates.in_admin_panel)
+    status = await message.answer("Файл получен, импорт начался...")
+    # Файл читается с диска построчно, в памяти держится только текущая порция
+    with tempfile.TemporaryDirectory(prefix="moviebot-import-") as directory:
+        path = os.path.join(directory, f"import.{file_format}")
+        await message.bot.download(document, destination=path)
+        report = ImportReport(os.path.join(directory, "problems.csv"))
+        try:
+            await import_movies(db, path, file_format, report)
+        finally:
+            report.close()
+        # Файл отчета отправляется, даже если итог не удалось показать в сообщении
+        try:
+            await status.edit_text(report.render())
+            edited = True
+        except TelegramAPIError:
+            await message.answer(f"Импорт завершен: добавлено {report.added}, проблемных строк {report.problems}.")
+            edited = False
+        if report.problems > REPORT_EXAMPLES or (report.problems and not edited):
+            await message.answer_document(
+                FSInputFile(report.problems_path, filename="import-problems.csv"),
+                caption=f"Все проблемные строки: {report.problems}"
+            )
+
+# Любое другое сообщение во время ожидания файла отменяет импорт
+@router.message(StateFilter(AdminStates.importing_movies))
+async def import_cancel(message: Message, state: FSMContext):
+    await state.set_state(AdminStates.in_admin_panel)
+    await message.answer("Импорт отменен.", reply_markup=get_admin_keyboard())
+
+# Обработчик команды /export [csv|json|jsonl] - выгрузка каталога со счетчиками использования
+@router.message(StateFilter(AdminStates.in_admin_panel), Command("export"))
+async def export_catalogue(message: Message, command: CommandObject, db: DatabaseManager):
+    file_format = (command.args or CSV).strip().lower()
+    if file_format not in FORMATS:
+        await message.answer(f"Формат выгрузки: {', '.join(FORMATS)} (по умолчанию {CSV}).")
+        return
+    
+    with tempfile.TemporaryDirectory(prefix="moviebot-export-") as directory:
+        file_name = export_file_name(file_format)
+        path = os.path.join(directory, file_name)
+        count = await export_movies(db, path, file_format)
+        await message.answer_document(FSInputFile(path, filename=file_name), caption=f"Фильмов: {count}")
+
+# Обработчик команды /cache_stats - статистика кэша фильмов
+@router.message(StateFilter(AdminStates.in_admin_panel), Command("cache_stats"))
+async def cache_stats(message: Message, db: DatabaseManager, fsm_storage: BaseStorage,
+                      throttling: ThrottlingMiddleware, registration: RegistrationMiddleware,
+                      join_approver: JoinApprover, scheduler: Optional[PriorityScheduler] = None):
+    stats = db.movie_cache.stats()
+    text = (
+        "Кэш фильмов:\n"
+        f"Записей: {stats['size']} из {stats['maxsize']}\n"
+        f"Попаданий: {stats['hits']}\n"
+        f"Промахов: {stats['misses']}\n"
+        f"Вытеснено: {stats['evictions']}\n"
+        f"Устарело: {stats['expirations']}\n"
+        f"Доля попаданий: {stats['hit_ratio']:.1%}"
+    )
+    
+    # Статистика хранилища состояний FSM
+    if isinstance(fsm_storage, SQLiteStorage):
+        stats = fsm_storage.stats()
+        text += (
+            "\n\nСостояния FSM в памяти:\n"
+            f"Записей: {stats['size']} из {stats['maxsize']}\n"
+            f"Вытеснено: {stats['evictions']}\n"
+            f"Неактивных удалено: {stats['expirations']}\n"
+            f"Чтений из базы: {stats['db_reads']}\n"
+            f"Ожидают записи: {stats['pending']}"
+        )
+    
+    # Сколько поисков несуществующих кодов обошлись без запроса к базе
+    stats = db.code_filter.stats()
+    text += (
+        "\n\nФильтр кодов:\n"
+        f"Кодов: {stats['codes']} из {stats['capacity']} ({stats['bytes'] // 1024} КБ)\n"
+        f"Отсечено без запроса к базе: {stats['rejected']}\n"
+        f"Пропущено к базе: {stats['passed']}, из них лишних: {stats['false_positives']}"
+    )
+    
+    # Подсказки похожих кодов при опечатке
+    stats = db.code_index.stats()
+    text += (
+        "\n\nПодсказки кодов:\n"
+        f"Кодов в индексе: {stats['codes']}\n"
+        f"Промахов проверено: {stats['searches']}, с подсказками: {stats['suggested']}, "
+        f"подсказку выбрали: {stats['accepted']}"
+    )
+    
+    # Счетчики антифлуда
+    stats = throttling.stats()
+    shed = stats["shed"]
+    text += (
+        "\n\nАнтифлуд:\n"
+        f"Пропущено: {stats['passed']}\n"
+        f"Отброшено: {sum(shed.values())} (поиск: {shed.get('lookup', 0)}, "
+        f"админы: {shed.get('admin', 0)}, прочее: {shed.get('default', 0)})\n"
+        f"Предупреждений: {stats['replied']}\n"
+        f"Пользователей в таблице лимитов: {stats['tracked']}"
+    )
+    
+    # Сколько записей пользователей удалось избежать
+    stats = registration.stats()
+    text += (
+        "\n\nРегистрация пользователей:\n"
+        f"Известных: {stats['known']}\n"
+        f"Обращений: {stats['seen']}, без записи: {stats['skipped']} ({stats['skip_ratio']:.1%})\n"
+        f"Поставлено в очередь: {stats['queued']}, записано в базу: {stats['written']}"
+    )
+    
+    # Очередь одобрения заявок в каналы
+    stats = join_approver.stats()
+    text += (
+        "\n\nОчередь заявок в каналы:\n"
+        f"В очереди: {stats['depth']} (ожидают записи: {stats['buffered']}, в работе: {stats['claimed']})\n"
+        f"Самая старая: {stats['oldest_age']:.1f} с\n"
+        f"Одобрено: {stats['approved']}, задержка: последняя {stats['last_lag']:.1f} с, "
+        f"средняя {stats['avg_lag']:.1f} с\n"
+        f"Повторов: {stats['retried']}, снято без одобрения: {stats['dropped']}"
+    )
+    
+    # Очередь апдейтов с приоритетами (если включена)
+    if scheduler is not None:
+        stats = scheduler.stats()
+        text += "\n\nОчередь апдейтов (выполняются / ждут, среднее и наибольшее ожидание):"
+        for name, title in (("admin", "админы"), ("lookup", "поиск"),
+                            ("registration", "/start и заявки"), ("default", "прочее")):
+            text += (
+                f"\n{title}: {stats['running'][name]} / {stats['waiting'][name]}, "
+                f"{stats['avg_wait'][name] * 1000:.1f} мс, {stats['max_wait'][name] * 1000:.0f} мс"
+            )
+    
+    await message.answer(text)
+
+# Подсказка по командам управления каналами
+CHANNELS_HELP = (
+    "Команды:\n"
+    "/add_channel ID ссылка название - добавить канал или изменить название и ссылку\n"
+    "/del_channel ID - удалить канал\n\n"
+    "ID канала начинается с -100, бот должен быть администратором канала."
+)
+
+# Обработчик команды /channels - список каналов для обязательной подписки
+@router.message(StateFilter(AdminStates.in_admin_panel), Command("channels"))
+async def list_channels(message: Message, channel_manager: ChannelManager):
+    channels = channel_manager.current.channels
+    if channels:
+        lines = [f"{channel['id']} - {channel['title']} ({channel['link'] or 'без ссылки'})" for channel in channels]
+        text = "Каналы для подписки:\n" + "\n".join(lines)
+    else:
+        text = "Каналов для подписки нет."
+    await message.answer(f"{text}\n\n{CHANNELS_HELP}", disable_web_page_preview=True)
+
+# Обработчик команды /add_channel ID ссылка название
+@router.message(StateFilter(AdminStates.in_admin_panel), Command("add_channel"))
+async def add_channel(message: Message, command: CommandObject, channel_manager: ChannelManager):
+    parts = (command.args or "").split(maxsplit=2)
+    if len(parts) < 3 or not parts[0].lstrip("-").isdigit():
+        await message.answer(f"Неверный формат.\n\n{CHANNELS_HELP}")
+        return
+    
+    channel_id, link, title = int(parts[0]), parts[1], parts[2]
+    added = await channel_manager.add_channel(channel_id, title, link)
+    await message.answer(
+        f"Канал {'добавлен' if added else 'изменен'}: {title}. Всего каналов: {len(channel_manager.current.ids)}",
+        disable_web_page_preview=True
+    )
+
+# Обработчик команды /del_channel ID
+@router.message(StateFilter(AdminStates.in_admin_panel), Command("del_channel"))
+async def delete_channel(message: Message, command: CommandObject, channel_manager: ChannelManager):
+    arg = (command.args or "").strip()
+    if not arg.lstrip("-").isdigit():
+        await message.answer(f"Укажите ID канала.\n\n{CHANNELS_HELP}")
+        return
+    
+    if await channel_manager.remove_channel(int(arg)):
+        await message.answer(f"Канал удален. Осталось каналов: {len(channel_manager.current.ids)}")
+    else:
+        await message.answer("Канал с таким ID не найден.")
+
+# Обработчик кнопки "Статистика"
+@router.message(StateFilter(AdminStates.in_admin_panel), F.text == "Статистика")
+async def show_stats(message: Message, db: DatabaseManager, channel_manager: ChannelManager):
+    text, keyboard = await render_dashboard(db, channel_manager.current.by_id)
+    await message.answer(text, reply_markup=keyboard)
+
+# Обработчик команды /missing [дни] - несуществующие коды, которые чаще всего ищут
+@router.message(StateFilter(AdminStates.in_admin_panel), Command("missing"))
+async def missing_codes(message: Message, command: CommandObject, db: DatabaseManager):
+    arg = (command.args or "").strip()
+    days = int(arg) if arg.isdigit() and int(arg) > 0 else 7
+    await message.answer(await render_missing_codes(db, days))
+
+# Обработчик команды /backup - состояние обслуживания базы; /backup now - внеочередная копия,
+# /backup vacuum - перевод базы в режим, при котором свободные страницы возвращаются файлу
+@router.message(StateFilter(AdminStates.in_admin_panel), Command("backup"))
+async def backup_status(message: Message, command: CommandObject,
+                        maintenance: Optional[DatabaseMaintenance] = None):
+    if maintenance is None:
+        await message.answer("Обслуживание базы выполняется в первом процессе-обработчике.")
+        return
+
+    text = ""
+    arg = (command.args or "").strip()
+    if arg == "vacuum":
+        if maintenance.request_conversion():
+            text = ("Полный VACUUM с переводом в auto_vacuum = INCREMENTAL начнется в ближайший тихий период. "
+                    "Нужно свободное место на диске размером с базу.\n\n")
+        else:
+            text = "Возврат свободных страниц уже включен.\n\n"
+    elif arg == "now":
+        if maintenance.request_backup():
+            text = "Резервная копия начнется в течение нескольких секунд.\n\n"
+        elif maintenance.backup_dir:
+            text = "Резервная копия уже делается.\n\n"
+        else:
+            text = "Резервные копии выключены (BACKUP_DIR не задан).\n\n"
+
+    stats = maintenance.stats()
+    if stats["last_backup"]:
+        text += (
+            f"Последняя копия: {stats['last_backup']} ({stats['last_backup_size'] / 2 ** 20:.1f} МБ), "
+            f"{stats['last_backup_age'] / 3600:.1f} ч назад\n"
+        )
+    else:
+        text += "Резервных копий еще нет\n"
+    text += (
+        f"Копий сделано: {stats['backups']}, ошибок: {stats['backup_failures']}\n"
+        f"Выполняется: {stats['running'] or 'ничего'}\n"
+        f"Нагрузка: {stats['rate']:.0f} запросов в секунду{' (высокая)' if stats['busy'] else ''}, "
+        f"отложено операций: {stats['deferred']}\n"
+        f"Пробный запрос: {stats['probe_idle'] * 1000:.2f} мс без обслуживания, "
+        f"{stats['probe_busy'] * 1000:.2f} мс во время него\n"
+        f"Контрольных точек WAL: {stats['checkpoints']}, ANALYZE: {stats['analyzes']}\n"
+        f"Свободных страниц: {stats['free_pages']}, возвращено файлу: {stats['vacuumed_pages']}"
+    )
+    if not stats["vacuum_enabled"]:
+        text += (
+            "\nВозврат свободных страниц выключен: база создана без auto_vacuum = INCREMENTAL"
+            + (", перевод запланирован" if stats["conversion_requested"] else " (включить - /backup vacuum)")
+        )
+    await message.answer(text)
+
+# Обработчик кнопок выбора периода статистики
+@router.callback_query(StatsCallback.filter())
+async def stats_period(callback: CallbackQuery, callback_data: StatsCallback, db: DatabaseManager,
+                       channel_manager: ChannelManager):
+    if callback.from_user.id not in ADMIN_IDS:
+        await callback.answer("У вас нет прав для доступа к админ-панели.")
+        return
+    
+    text, keyboard = await render_dashboard(db, channel_manager.current.by_id, callback_data.days)
+    await callback.answer()
+    await callback.message.edit_text(text, reply_markup=keyboard)
+
+# Получатели рассылки по умолчанию: все, кто не заблокировал бота
+DEFAULT_SEGMENT = "reachable"
+
+async def segments_keyboard(broadcasts: BroadcastManager, selected: str):
+    """Клавиатура выбора получателей с числом пользователей в каждом сегменте"""
+    segments = [
+        (segment, f"{title.capitalize()}: {await broadcasts.count(segment)}")
+        for segment, title in SEGMENT_TITLES.items()
+    ]
+    return get_broadcast_segments_keyboard(segments, selected)
+
 # Обработчик кнопки "Рассылка"
 @router.message(StateFilter(AdminStates.in_admin_panel), F.text == "Рассылка")
-async def broadcast_start(message: Message, state: FSMContext):
+async def broadcast_start(message: Message, state: FSMContext, broadcasts: BroadcastManager):
+    # Показываем рассылки, которые еще выполняются
+    for job in broadcasts.jobs.values():
+        await message.answer(job.progress_text(), reply_markup=get_broadcast_keyboard(job.id))
+    
     # Устанавливаем состояние рассылки
     await state.set_state(AdminStates.broadcasting)
+    await state.update_data(broadcast_segment=DEFAULT_SEGMENT)
     
-    # Запрашиваем текст рассылки
-    await message.answer("Введите текст для рассылки всем пользователям:")
+    # Запрашиваем получателей и текст рассылки
+    await message.answer(
+        "Выберите получателей и введите текст для рассылки:",
+        reply_markup=await segments_keyboard(broadcasts, DEFAULT_SEGMENT)
+    )
+
+# Обработчик выбора получателей рассылки
+@router.callback_query(StateFilter(AdminStates.broadcasting), BroadcastSegmentCallback.filter())
+async def broadcast_segment(callback: CallbackQuery, callback_data: BroadcastSegmentCallback, state: FSMContext,
+                            broadcasts: BroadcastManager):
+    if callback.from_user.id not in ADMIN_IDS or callback_data.segment not in SEGMENT_TITLES:
+        await callback.answer("У вас нет прав для управления рассылкой.")
+        return
+    
+    await state.update_data(broadcast_segment=callback_data.segment)
+    await callback.answer(f"Получатели: {SEGMENT_TITLES[callback_data.segment]}")
+    await callback.message.edit_reply_markup(reply_markup=await segments_keyboard(broadcasts, callback_data.segment))
 
 # Обработчик ввода текста рассылки
 @router.message(StateFilter(AdminStates.broadcasting))
-async def broadcast_text(message: Message, state: FSMContext):
-    # Получаем текст рассылки
+async def broadcast_text(message: Message, state: FSMContext, broadcasts: BroadcastManager):
+    # Получаем текст рассылки и выбранных получателей
     broadcast_text = message.text
+    segment = (await state.get_data()).get("broadcast_segment", DEFAULT_SEGMENT)
     
-    # Получаем список всех пользователей
-    users = db.get_all_users()
-    
-    if users:
-        # Счетчики для статистики
-        total_users = len(users)
-        successful_sends = 0
-        
-        # Отправляем сообщение о начале рассылки
-        await message.answer(f"Начинаю рассылку {total_users} пользователям...")
-        
-        # Отправляем сообщение каждому пользователю
-        for user in users:
-            try:
-                # Пытаемся отправить сообщение
-                await message.bot.send_message(user['user_id'], broadcast_text)
-                successful_sends += 1
-            except Exception as e:
-                # Если произошла ошибка, пропускаем пользователя
-                print(f"Error sending message to user {user['user_id']}: {e}")
+    if await broadcasts.count(segment):
+        # Рассылка выполняется в фоне, прогресс обновляется в отдельном сообщении
+        broadcast_id = await broadcasts.start(message.bot, broadcast_text, message.chat.id, segment)
         
-        # Отправляем статистику рассылки
         await message.answer(
-            f"Рассылка завершена.\n"
-            f"Успешно отправлено: {successful_sends} из {total_users}",
+            f"Рассылка #{broadcast_id} запущена в фоне. Прогресс отображается в сообщении выше.",
             reply_markup=get_admin_keyboard()
         )
     else:
         # Если пользователей нет
         await message.answer(
-            "В базе данных нет пользователей для рассылки.",
+            "Среди выбранных получателей нет пользователей для рассылки.",
             reply_markup=get_admin_keyboard()
         )
     
     # Возвращаемся в админ-панель
     await state.set_state(AdminStates.in_admin_panel)
+
+# Обработчик кнопок "Обновить" и "Отменить" под сообщением с прогрессом рассылки
+@router.callback_query(BroadcastCallback.filter())
+async def broadcast_control(callback: CallbackQuery, callback_data: BroadcastCallback, db: DatabaseManager,
+                            broadcasts: BroadcastManager):
+    if callback.from_user.id not in ADMIN_IDS:
+        await callback.answer("У вас нет прав для управления рассылкой.")
+        return
+    
+    job = broadcasts.jobs.get(callback_data.broadcast_id)
+    
+    if job is None:
+        # Рассылка уже завершена, показываем итог из базы данных
+        row = await db.get_broadcast(callback_data.broadcast_id)
+        await callback.answer("Рассылка уже не выполняется.")
+        if row:
+            status = {"cancelled": "отменена", "failed": "прервана с ошибкой"}.get(row["status"], "завершена")
+            await callback.message.edit_text(
+                f"Рассылка #{row['id']}: {status}\n"
+                f"Успешно отправлено: {row['sent']} из {row['total']}\n"
+                f"Ошибок: {row['failed']} (заблокировали бота или удалены: {row['blocked']})"
+            )
+        return
+    
+    if callback_data.action == "cancel":
+        broadcasts.cancel(job.id)
+        await callback.answer("Рассылка будет остановлена.")
+    else:
+        await callback.answer()
+        await broadcasts.report(callback.bot, job, final=False, force=True)
@@ -1,38 +1,31 @@
+import logging
+
 from aiogram import Router, F
 from aiogram.types import ChatJoinRequest
 from database import DatabaseManager
-from config import DB_PATH, CHANNELS
+from utils.channel_manager import ChannelManager
+from utils.join_queue import JoinApprover
 
-# Инициализация менеджера базы данных
-db = DatabaseManager(DB_PATH)
+logger = logging.getLogger(__name__)
 
 # Создание роутера для обработки заявок в каналы
 router = Router()
 
 @router.chat_join_request()
-async def process_join_request(join_request: ChatJoinRequest):
+async def process_join_request(join_request: ChatJoinRequest, db: DatabaseManager,
+                               channel_manager: ChannelManager, join_approver: JoinApprover):
     """
     Обработчик заявок на вступление в канал.
-    Сохраняет информацию о заявке в базу данных.
+    Ставит заявку в очередь на одобрение и сразу возвращается:
+    запись в базу и одобрение выполняются в фоне (см. utils/join_queue.py).
     """
     user_id = join_request.from_user.id
     chat_id = join_request.chat.id
     
     # Проверяем, является ли канал одним из наших каналов
-    is_our_channel = False
-    for channel in CHANNELS:
-        if channel["id"] == chat_id:
-            is_our_channel = True
-            break
-    
-    if is_our_channel:
-        # Сохраняем информацию о заявке в базу данных
-        db.add_channel_request(user_id, chat_id, status="pending")
+    if channel_manager.is_our_channel(chat_id):
+        join_approver.enqueue(user_id, chat_id)
+        db.analytics.join_request(chat_id)
         
-        # Автоматически одобряем заявку
-        try:
-            await join_request.approve()
-            # Обновляем статус заявки в базе данных
-            db.update_channel_request_status(user_id, chat_id, status="approved")
-        except Exception as e:
-            print(f"Error approving join request: {e}")
+        # Заявка засчитывается как подписка сразу, без запроса к Telegram
+        channel_manager.remember(user_id, chat_id, True)
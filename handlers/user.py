@@ -1,15 +1,15 @@
-from aiogram import Router, F
+from typing import Any, Dict, Optional
+
+from aiogram import Bot, Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-from keyboards import get_start_keyboard
+from keyboards import get_start_keyboard, get_suggestions_keyboard, SuggestCallback
 from database import DatabaseManager
-from config import DB_PATH, CHANNELS
-
-# Инициализация менеджера базы данных
-db = DatabaseManager(DB_PATH)
+from utils.channel_manager import ChannelManager
+from utils.delivery import MovieDelivery
 
 # Создание роутера для пользовательских команд
 router = Router()
@@ -21,13 +21,7 @@ class UserStates(StatesGroup):
 # Обработчик команды /start
 @router.message(Command("start"))
 async def cmd_start(message: Message, state: FSMContext):
-    # Сохраняем или обновляем информацию о пользователе
-    user_id = message.from_user.id
-    username = message.from_user.username
-    first_name = message.from_user.first_name
-    last_name = message.from_user.last_name
-    
-    db.add_or_update_user(user_id, username, first_name, last_name)
+    # Пользователя сохраняет RegistrationMiddleware (middlewares/registration.py)
     
     # Сбрасываем состояние FSM
     await state.clear()
@@ -39,57 +33,128 @@ async def cmd_start(message: Message, state: FSMContext):
         reply_markup=get_start_keyboard()
     )
 
-# Обработчик нажатия на кнопку "Ввести код"
-@router.message(F.text == "Ввести код")
-async def enter_code_button(message: Message, state: FSMContext):
-    user_id = message.from_user.id
+# Сообщения, когда подписку не удалось подтвердить
+NOT_SUBSCRIBED = "Вы подписались не на все каналы."
+NOT_VERIFIED = "Не удалось проверить подписку на все каналы. Подпишитесь на них и нажмите кнопку еще раз."
+
+# Проверка подписки на все каналы (заявки и участие в канале) перед доступом к фильмам.
+# True - доступ открыт, False - подписки нет, None - часть каналов проверить не удалось,
+# а нажатий для доступа пока мало (count_click=False - нажатие не засчитывается)
+async def has_access(bot: Bot, user_id: int, db: DatabaseManager, channel_manager: ChannelManager,
+                     count_click: bool = True) -> Optional[bool]:
+    subscribed = await channel_manager.is_subscribed(bot, user_id)
     
-    # Увеличиваем счетчик кликов и получаем новое значение
-    click_count = db.increment_click_count(user_id)
+    if subscribed is None:
+        # Доступ уже открыт недавно - нажатия заново не нужны
+        if channel_manager.has_access(user_id):
+            return True
+        if not count_click:
+            return None
+        
+        # Часть каналов проверить не удалось (бот не администратор канала),
+        # поэтому доступ открывается после третьего нажатия, как раньше
+        click_count = await db.increment_click_count(user_id)
+        if click_count < 3:
+            return None
+        
+        # Сбрасываем счетчик кликов
+        await db.reset_click_count(user_id)
+        subscribed = True
     
-    if click_count >= 3:
-        # Если пользователь нажал на кнопку 3 или более раз, разрешаем ввод кода
+    if subscribed:
+        channel_manager.grant_access(user_id)
+    return subscribed
+
+# Обработчик нажатия на кнопку "Ввести код"
+@router.message(F.text == "Ввести код")
+async def enter_code_button(message: Message, state: FSMContext, db: DatabaseManager,
+                            channel_manager: ChannelManager):
+    if await has_access(message.bot, message.from_user.id, db, channel_manager):
+        # Если пользователь подписан на все каналы, разрешаем ввод кода
         await state.set_state(UserStates.waiting_for_code)
         await message.answer("Введите код фильма:")
-        
-        # Сбрасываем счетчик кликов
-        db.reset_click_count(user_id)
     else:
-        # Если пользователь нажал на кнопку меньше 3 раз
-        remaining_clicks = 3 - click_count
-        
-        # Формируем сообщение с ссылками на каналы из config.py
-        channels_text = "Для пользования ботом нужно обязательно подписаться на каналы команды!\n\n"
-        
-        for channel in CHANNELS:
-            # Добавляем название канала как ссылку
-            channels_text += f"<a href='{channel['link']}'>{channel['title']}</a>\n"
-        
-        channels_text += "\nБлагодарим за поддержку!\n\n"
-        
+        # Если подписки нет, отправляем готовое сообщение со ссылками на каналы
+        # и кнопку повторной проверки
+        channels = channel_manager.current
+        db.analytics.promo_shown()
         await message.answer(
-            channels_text,
+            channels.promo_text,
             parse_mode="HTML",
-            disable_web_page_preview=True
+            disable_web_page_preview=True,
+            reply_markup=channels.keyboard
         )
 
+# Обработчик кнопки "Проверить заявки"
+@router.callback_query(F.data == "check_requests")
+async def check_requests(callback: CallbackQuery, state: FSMContext, db: DatabaseManager,
+                         channel_manager: ChannelManager):
+    user_id = callback.from_user.id
+    
+    # Пользователь сообщает, что подписался: прежние отрицательные результаты не учитываем
+    channel_manager.forget_negative(user_id)
+    
+    subscribed = await has_access(callback.bot, user_id, db, channel_manager)
+    if not subscribed:
+        await callback.answer(NOT_SUBSCRIBED if subscribed is False else NOT_VERIFIED, show_alert=True)
+        return
+    
+    await callback.answer()
+    await state.set_state(UserStates.waiting_for_code)
+    await callback.message.answer("Введите код фильма:")
+
+# Отправка найденного фильма и учет использования кода
+async def send_movie(message: Message, user_id: int, movie: Dict[str, Any], db: DatabaseManager, delivery: MovieDelivery):
+    # Видео отправляется по file_id или копией из канала, а если видео нет - только название
+    if not await delivery.deliver(message.bot, message.chat.id, movie):
+        await message.answer(f"Название фильма: {movie['title']}")
+    
+    # Увеличиваем счетчик использования кода и поисков пользователя
+    await db.increment_movie_usage(movie["code"])
+    db.record_lookup(user_id)
+
 # Обработчик ввода кода фильма
 @router.message(StateFilter(UserStates.waiting_for_code))
-async def process_movie_code(message: Message, state: FSMContext):
+async def process_movie_code(message: Message, state: FSMContext, db: DatabaseManager,
+                             delivery: MovieDelivery):
     code = message.text.strip()
     
     # Ищем фильм по коду
-    movie = db.get_movie_by_code(code)
+    movie = await db.get_movie_by_code(code)
+    db.analytics.lookup(code, found=movie is not None)
     
     if movie:
-        # Если фильм найден, отправляем его название
-        await message.answer(f"Название фильма: {movie['title']}")
-        
-        # Увеличиваем счетчик использования кода
-        db.increment_movie_usage(code)
+        await send_movie(message, message.from_user.id, movie, db, delivery)
     else:
-        # Если фильм не найден
-        await message.answer("Фильм с таким кодом не найден. Пожалуйста, проверьте код и попробуйте снова.")
+        # Если фильм не найден, предлагаем похожие коды кнопками, чтобы не вводить код заново
+        suggestions = await db.suggest_codes(code)
+        keyboard = get_suggestions_keyboard(suggestions) if suggestions else None
+        if keyboard and keyboard.inline_keyboard:
+            await message.answer("Фильм с таким кодом не найден. Возможно, вы имели в виду:", reply_markup=keyboard)
+        else:
+            await message.answer("Фильм с таким кодом не найден. Пожалуйста, проверьте код и попробуйте снова.")
     
     # Сбрасываем состояние
     await state.clear()
+
+# Обработчик кнопки с похожим кодом фильма
+@router.callback_query(SuggestCallback.filter())
+async def pick_suggestion(callback: CallbackQuery, callback_data: SuggestCallback, db: DatabaseManager,
+                          delivery: MovieDelivery, channel_manager: ChannelManager):
+    # Кнопка могла остаться в чате, поэтому подписка проверяется снова (результат обычно в кэше).
+    # Нажатие не засчитывается в счетчик: доступ к вводу кода обычно уже открыт
+    subscribed = await has_access(callback.bot, callback.from_user.id, db, channel_manager, count_click=False)
+    if not subscribed:
+        text = NOT_SUBSCRIBED if subscribed is False else "Не удалось проверить подписку. Нажмите «Ввести код»."
+        await callback.answer(text, show_alert=True)
+        return
+    
+    movie = await db.get_movie_by_code(callback_data.code)
+    db.analytics.lookup(callback_data.code, found=movie is not None)
+    if movie is None:
+        await callback.answer("Этого фильма больше нет в каталоге.", show_alert=True)
+        return
+    
+    await callback.answer()
+    db.code_index.accepted += 1
+    await send_movie(callback.message, callback.from_user.id, movie, db, delivery)
@@ -1,3 +1,8 @@
 from keyboards.keyboards import *
 
-__all__ = ['get_start_keyboard', 'get_check_subscription_keyboard', 'get_admin_keyboard']
+__all__ = ['get_start_keyboard', 'get_check_subscription_keyboard', 'get_admin_keyboard',
+           'BroadcastCallback', 'get_broadcast_keyboard',
+           'BroadcastSegmentCallback', 'get_broadcast_segments_keyboard',
+           'MoviesPageCallback', 'get_movies_page_keyboard',
+           'StatsCallback', 'get_stats_keyboard',
+           'SuggestCallback', 'get_suggestions_keyboard']
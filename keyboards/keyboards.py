@@ -1,5 +1,34 @@
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from aiogram.filters.callback_data import CallbackData
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 
+class BroadcastCallback(CallbackData, prefix="broadcast"):
+    """Данные кнопок управления рассылкой"""
+    action: str
+    broadcast_id: int
+
+class StatsCallback(CallbackData, prefix="stats"):
+    """Данные кнопок выбора периода статистики"""
+    days: int
+
+class BroadcastSegmentCallback(CallbackData, prefix="segment"):
+    """Данные кнопок выбора получателей рассылки"""
+    segment: str
+
+class MoviesPageCallback(CallbackData, prefix="movies"):
+    """Данные кнопок навигации по каталогу фильмов"""
+    action: str
+    before_id: Optional[int] = None
+    after_id: Optional[int] = None
+
+class SuggestCallback(CallbackData, prefix="suggest"):
+    """Данные кнопок подсказки похожего кода фильма"""
+    code: str
+
+# Название фильма на кнопке подсказки обрезается
+SUGGEST_TITLE_LIMIT = 40
+
 def get_start_keyboard() -> ReplyKeyboardMarkup:
     """Клавиатура для команды /start"""
     return ReplyKeyboardMarkup(
@@ -7,6 +36,23 @@ def get_start_keyboard() -> ReplyKeyboardMarkup:
         resize_keyboard=True
     )
 
+def get_suggestions_keyboard(movies: Sequence[Dict[str, Any]]) -> InlineKeyboardMarkup:
+    """Кнопки с похожими кодами фильмов (код и начало названия)"""
+    buttons = []
+    for movie in movies:
+        # Код с двоеточием не упаковать в данные кнопки, а Telegram ограничивает их 64 байтами
+        try:
+            callback_data = SuggestCallback(code=movie["code"]).pack()
+        except ValueError:
+            continue
+        if len(callback_data.encode()) > 64:
+            continue
+        title = movie["title"]
+        if len(title) > SUGGEST_TITLE_LIMIT:
+            title = title[:SUGGEST_TITLE_LIMIT - 1] + "…"
+        buttons.append([InlineKeyboardButton(text=f"{movie['code']} - {title}", callback_data=callback_data)])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
 def get_check_subscription_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура для проверки подписки на каналы"""
     return InlineKeyboardMarkup(
@@ -23,7 +69,73 @@ def get_admin_keyboard() -> ReplyKeyboardMarkup:
             [KeyboardButton(text="Список фильмов")],
             [KeyboardButton(text="Удалить фильм")],
             [KeyboardButton(text="Рассылка")],
+            [KeyboardButton(text="Статистика")],
             [KeyboardButton(text="Выйти из админ-панели")]
         ],
         resize_keyboard=True
     )
+
+def get_broadcast_keyboard(broadcast_id: int) -> InlineKeyboardMarkup:
+    """Клавиатура для управления запущенной рассылкой"""
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text="Обновить",
+                    callback_data=BroadcastCallback(action="refresh", broadcast_id=broadcast_id).pack()
+                ),
+                InlineKeyboardButton(
+                    text="Отменить",
+                    callback_data=BroadcastCallback(action="cancel", broadcast_id=broadcast_id).pack()
+                )
+            ]
+        ]
+    )
+
+def get_broadcast_segments_keyboard(segments: Sequence[Tuple[str, str]], selected: str) -> InlineKeyboardMarkup:
+    """Клавиатура выбора получателей рассылки: (сегмент, текст кнопки), выбранный отмечен"""
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(
+                text=f"✓ {text}" if segment == selected else text,
+                callback_data=BroadcastSegmentCallback(segment=segment).pack()
+            )]
+            for segment, text in segments
+        ]
+    )
+
+def get_movies_page_keyboard(newer_after_id: Optional[int], older_before_id: Optional[int],
+                             is_search: bool) -> InlineKeyboardMarkup:
+    """Клавиатура для навигации по каталогу фильмов"""
+    navigation = []
+    if newer_after_id is not None:
+        navigation.append(InlineKeyboardButton(
+            text="« Назад",
+            callback_data=MoviesPageCallback(action="page", after_id=newer_after_id).pack()
+        ))
+    if older_before_id is not None:
+        navigation.append(InlineKeyboardButton(
+            text="Вперед »",
+            callback_data=MoviesPageCallback(action="page", before_id=older_before_id).pack()
+        ))
+    
+    search = [InlineKeyboardButton(text="Поиск", callback_data=MoviesPageCallback(action="search").pack())]
+    if is_search:
+        search.append(InlineKeyboardButton(
+            text="Сбросить поиск",
+            callback_data=MoviesPageCallback(action="reset").pack()
+        ))
+    
+    return InlineKeyboardMarkup(inline_keyboard=[row for row in (navigation, search) if row])
+
+def get_stats_keyboard(days: int, periods: Sequence[int]) -> InlineKeyboardMarkup:
+    """Клавиатура выбора периода статистики (текущий период отмечен)"""
+    return InlineKeyboardMarkup(
+        inline_keyboard=[[
+            InlineKeyboardButton(
+                text=f"· {period} дн. ·" if period == days else f"{period} дн.",
+                callback_data=StatsCallback(days=period).pack()
+            )
+            for period in periods
+        ]]
+    )
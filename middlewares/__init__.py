@@ -1,4 +1,6 @@
-from aiogram.types import Middleware
+from .metrics import BotMetrics
+from .registration import RegistrationMiddleware
+from .scheduling import SchedulingMiddleware
+from .throttling import ThrottlingMiddleware
 
-# Этот файл создан для соответствия структуре проекта
-# В текущей реализации middleware не используются, но файл нужен для полноты структуры
+__all__ = ['BotMetrics', 'RegistrationMiddleware', 'SchedulingMiddleware', 'ThrottlingMiddleware']
@@ -0,0 +1,131 @@
+import time
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.dispatcher.event.bases import UNHANDLED, CancelHandler, SkipHandler
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject
+
+from database.pool import ConnectionPool
+from utils.metrics import MetricsRegistry
+
+# Наблюдатели диспетчера, которые не относятся к обработке апдейтов
+SKIP_OBSERVERS = {"update", "error"}
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Время работы и результат каждого обработчика (inner-middleware)"""
+
+    def __init__(self, metrics: "BotMetrics"):
+        self.metrics = metrics
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        event_type = type(event).__name__
+
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            result = await handler(event, data)
+            if result is UNHANDLED:
+                outcome = "skipped"
+            return result
+        except (SkipHandler, CancelHandler):
+            outcome = "skipped"
+            raise
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            self.metrics.handler_latency.observe(time.perf_counter() - started, event_type, name)
+            self.metrics.handler_calls.inc(event_type, name, outcome)
+
+
+class RequestMetricsMiddleware(BaseRequestMiddleware):
+    """Время запросов к Telegram Bot API и ошибки по методам (middleware сессии бота)"""
+
+    def __init__(self, metrics: "BotMetrics"):
+        self.metrics = metrics
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        name = method.__api_method__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            self.metrics.api_errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            self.metrics.api_latency.observe(time.perf_counter() - started, name)
+
+
+class BotMetrics:
+    """
+    Метрики бота: обработчики, запросы к базе данных и к Telegram Bot API.
+    Если метрики выключены, install() не вызывается и замеры ничего не стоят.
+    """
+
+    def __init__(self, registry: MetricsRegistry):
+        self.registry = registry
+        self.handler_latency = registry.histogram(
+            "moviebot_handler_duration_seconds", "Время работы обработчика", ("event", "handler")
+        )
+        self.handler_calls = registry.counter(
+            "moviebot_handler_calls_total", "Вызовы обработчиков по результату", ("event", "handler", "outcome")
+        )
+        self.db_wait = registry.histogram(
+            "moviebot_db_wait_seconds", "Ожидание свободного потока пула соединений", ("kind", "query")
+        )
+        self.db_latency = registry.histogram(
+            "moviebot_db_query_duration_seconds", "Время выполнения запроса к базе данных", ("kind", "query")
+        )
+        self.db_errors = registry.counter(
+            "moviebot_db_errors_total", "Ошибки запросов к базе данных", ("kind", "query")
+        )
+        self.api_latency = registry.histogram(
+            "moviebot_telegram_request_duration_seconds", "Время запроса к Telegram Bot API", ("method",)
+        )
+        self.api_errors = registry.counter(
+            "moviebot_telegram_errors_total", "Ошибки запросов к Telegram Bot API", ("method", "error")
+        )
+
+    def observe_query(self, kind: str, query: str, wait: float, duration: float, failed: bool) -> None:
+        self.db_wait.observe(wait, kind, query)
+        self.db_latency.observe(duration, kind, query)
+        if failed:
+            self.db_errors.inc(kind, query)
+
+    def add_stats(self, name: str, documentation: str, stats: Callable[[], Dict[str, Any]]) -> None:
+        """Публикация словаря stats() одного из компонентов бота как метрики с меткой stat"""
+        def collect() -> Dict[Tuple[str, ...], float]:
+            values: Dict[Tuple[str, ...], float] = {}
+            for key, value in stats().items():
+                if isinstance(value, dict):
+                    for subkey, subvalue in value.items():
+                        values[(f"{key}_{subkey}",)] = subvalue
+                elif isinstance(value, (int, float)):
+                    values[(key,)] = value
+            return values
+        self.registry.gauge(name, documentation, collect, ("stat",))
+
+    def install(self, dp: Dispatcher, bot: Bot, pool: ConnectionPool) -> None:
+        """Подключение замеров к диспетчеру, сессии бота и пулу соединений"""
+        middleware = HandlerMetricsMiddleware(self)
+        for name, observer in dp.observers.items():
+            if name not in SKIP_OBSERVERS:
+                observer.middleware(middleware)
+        bot.session.middleware(RequestMetricsMiddleware(self))
+        pool.observer = self.observe_query
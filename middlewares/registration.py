@@ -0,0 +1,77 @@
+import logging
+from array import array
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from database import DatabaseManager
+from utils.known_users import KnownUsers, profile_fingerprint
+
+logger = logging.getLogger(__name__)
+
+
+class RegistrationMiddleware(BaseMiddleware):
+    """
+    Регистрация пользователей, которые пишут боту или нажимают кнопки.
+    Для известных пользователей в памяти хранится отпечаток профиля, поэтому
+    повторный /start без изменений имени ничего не пишет в базу. Новые и
+    изменившиеся пользователи записываются пачками вместе со счетчиками.
+    Здесь же учитываются активные за день и новые пользователи для статистики
+    и время последнего обращения (users.last_seen, раз в день).
+    owns - если бот работает в нескольких процессах, загружаются только
+    пользователи этого процесса.
+    """
+
+    def __init__(self, db: DatabaseManager, owns: Optional[Callable[[int], bool]] = None):
+        self.db = db
+        self.owns = owns
+        self.known = KnownUsers()
+        self.seen = 0
+        self.skipped = 0
+        self.queued = 0
+
+    async def start(self) -> None:
+        """Загрузка известных пользователей из базы"""
+        ids, prints = array("q"), array("I")
+        async for chunk in self.db.iter_user_profile_chunks():
+            for user_id, username, first_name, last_name in chunk:
+                if self.owns is not None and not self.owns(user_id):
+                    continue
+                ids.append(user_id)
+                prints.append(profile_fingerprint(username, first_name, last_name))
+        self.known.load(ids, prints)
+        logger.info("Загружено известных пользователей: %s", len(self.known))
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is not None and not user.is_bot:
+            self.seen += 1
+            self.db.mark_seen(user.id)
+            fingerprint = profile_fingerprint(user.username, user.first_name, user.last_name)
+            known = self.known.get(user.id)
+            if known == fingerprint:
+                self.skipped += 1
+            else:
+                if known is None:
+                    self.db.analytics.new_user()
+                self.db.register_user(user.id, user.username, user.first_name, user.last_name)
+                self.known.set(user.id, fingerprint)
+                self.queued += 1
+        return await handler(event, data)
+
+    def stats(self) -> Dict[str, Any]:
+        """Сколько обращений обошлось без записи в базу"""
+        return {
+            "known": len(self.known),
+            "seen": self.seen,
+            "skipped": self.skipped,
+            "queued": self.queued,
+            "written": self.db.counters.flushed_users,
+            "skip_ratio": self.skipped / self.seen if self.seen else 0.0,
+        }
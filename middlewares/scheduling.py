@@ -0,0 +1,59 @@
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import ChatJoinRequest, Message, TelegramObject
+
+from middlewares.throttling import ADMIN, DEFAULT, LOOKUP
+from utils.scheduler import PriorityScheduler
+
+# Классы приоритета по убыванию важности; ADMIN, LOOKUP и DEFAULT совпадают с классами антифлуда
+REGISTRATION = "registration"
+PRIORITIES = (ADMIN, LOOKUP, REGISTRATION, DEFAULT)
+
+
+class SchedulingMiddleware(BaseMiddleware):
+    """
+    Очередь апдейтов с приоритетами перед обработчиками: администраторы,
+    затем поиск фильмов, затем /start и заявки в каналы, затем все остальное.
+    Одновременно выполняется не больше scheduler.concurrency обработчиков,
+    и у каждого класса свой лимит, поэтому при перегрузке ждут в первую
+    очередь менее важные апдейты. Класс определяет classify антифлуда.
+    Регистрируется как outer-middleware для message, callback_query и
+    chat_join_request после антифлуда, чтобы отброшенные апдейты не занимали очередь.
+    До очереди выполняются только работа с памятью (состояние FSM из кэша,
+    антифлуд, регистрация с отложенной записью); запросы к базе и Bot API
+    обработчиков идут уже под ее лимитами. Очередь образуется, только когда
+    одновременно принято больше апдейтов, чем scheduler.concurrency.
+    """
+
+    def __init__(self, scheduler: PriorityScheduler,
+                 classify: Callable[[TelegramObject, int, Optional[str]], str]):
+        self.scheduler = scheduler
+        self.classify = classify
+
+    def priority(self, event: TelegramObject, data: Dict[str, Any]) -> str:
+        """Класс приоритета апдейта"""
+        user = data.get("event_from_user")
+        if user is None:
+            return DEFAULT
+        priority = self.classify(event, user.id, data.get("raw_state"))
+        if priority != DEFAULT:
+            return priority
+        if isinstance(event, ChatJoinRequest):
+            return REGISTRATION
+        if isinstance(event, Message) and event.text and event.text.split(maxsplit=1)[0] == "/start":
+            return REGISTRATION
+        return DEFAULT
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        priority = self.priority(event, data)
+        await self.scheduler.acquire(priority)
+        try:
+            return await handler(event, data)
+        finally:
+            self.scheduler.release(priority)
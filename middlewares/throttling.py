@@ -0,0 +1,96 @@
+import logging
+from typing import Any, Awaitable, Callable, Collection, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramAPIError
+from aiogram.fsm.state import State
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from utils.rate_limiter import BucketTable
+
+logger = logging.getLogger(__name__)
+
+# Ответ пользователю, превысившему лимит (отправляется один раз подряд)
+THROTTLED_TEXT = "Слишком много запросов. Подождите несколько секунд."
+
+# Классы лимитов
+LOOKUP = "lookup"
+ADMIN = "admin"
+DEFAULT = "default"
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Антифлуд для сообщений и нажатий кнопок.
+    У каждого пользователя свое ведро токенов отдельно для поиска фильмов
+    («Ввести код» и ввод кода), для администраторов и для остальных действий.
+    Апдейт сверх лимита отбрасывается до фильтров, обработчиков и запросов к
+    базе данных; пользователь получает одно короткое предупреждение подряд.
+    Регистрируется как outer-middleware для message и callback_query.
+    """
+
+    def __init__(self, admin_ids: Collection[int], limits: Dict[str, tuple],
+                 lookup_states: Collection[State] = (), lookup_texts: Collection[str] = (),
+                 lookup_callbacks: Collection[str] = (), reply: bool = True):
+        self.admin_ids = set(admin_ids)
+        # Класс лимита -> (частота в секунду, запас подряд)
+        self.tables = {name: BucketTable(rate, burst) for name, (rate, burst) in limits.items()}
+        self.lookup_states = {state.state for state in lookup_states}
+        self.lookup_texts = set(lookup_texts)
+        self.lookup_callbacks = set(lookup_callbacks)
+        self.reply = reply
+        self.passed = 0
+        self.shed = {name: 0 for name in self.tables}
+        self.replied = 0
+
+    def classify(self, event: TelegramObject, user_id: int, raw_state: Optional[str]) -> str:
+        """Класс лимита для апдейта"""
+        if user_id in self.admin_ids:
+            return ADMIN
+        if raw_state in self.lookup_states:
+            return LOOKUP
+        if isinstance(event, Message) and event.text in self.lookup_texts:
+            return LOOKUP
+        # Кнопка совпадает целиком или префиксом CallbackData (до двоеточия)
+        if isinstance(event, CallbackQuery) and (event.data or "").split(":", 1)[0] in self.lookup_callbacks:
+            return LOOKUP
+        return DEFAULT
+
+    async def _warn(self, event: TelegramObject) -> None:
+        if not isinstance(event, (Message, CallbackQuery)):
+            return
+        try:
+            await event.answer(THROTTLED_TEXT)
+        except TelegramAPIError as e:
+            logger.debug("Не удалось предупредить о превышении лимита: %s", e)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        limit = self.classify(event, user.id, data.get("raw_state"))
+        table = self.tables.get(limit)
+        if table is None or table.allow(user.id):
+            self.passed += 1
+            return await handler(event, data)
+
+        self.shed[limit] += 1
+        if self.reply and table.warn(user.id):
+            self.replied += 1
+            await self._warn(event)
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики пропущенных и отброшенных апдейтов"""
+        return {
+            "passed": self.passed,
+            "shed": dict(self.shed),
+            "replied": self.replied,
+            "tracked": sum(len(table) for table in self.tables.values()),
+        }
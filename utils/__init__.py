@@ -1,2 +1 @@
-# Этот файл создан для соответствия структуре проекта
-# В текущей реализации utils не используются, но файл нужен для полноты структуры
+# Вспомогательные модули бота
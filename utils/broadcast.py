@@ -0,0 +1,266 @@
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from database import DatabaseManager
+from database.db_manager import ACTIVE_SEGMENT_DAYS
+from keyboards import get_broadcast_keyboard
+from utils.rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Названия сегментов пользователей для сообщений администратору
+SEGMENT_TITLES = {
+    "reachable": "все, кто не заблокировал бота",
+    "active": f"активные за {ACTIVE_SEGMENT_DAYS} дней",
+    "lookups": "искали фильмы по коду",
+    "all": "все пользователи, включая заблокировавших",
+}
+
+# Результаты отправки одного сообщения
+SENT, FAILED, BLOCKED, DEACTIVATED = "sent", "failed", "blocked", "deactivated"
+
+
+class BroadcastJob:
+    """Состояние одной рассылки в памяти"""
+
+    def __init__(self, row: Dict):
+        self.id = row["id"]
+        self.text = row["text"]
+        self.total = row["total"]
+        self.sent = row["sent"]
+        self.failed = row["failed"]
+        self.cursor = row["last_user_row"]
+        self.admin_chat_id = row["admin_chat_id"]
+        self.status_message_id = row["status_message_id"]
+        self.segment = row["segment"]
+        self.segment_since = row["segment_since"]
+        self.blocked = row["blocked"]
+        self.cancelled = False
+        # Рассылка прервана непредвиденной ошибкой (статус failed в базе)
+        self.aborted = False
+        self.task: Optional[asyncio.Task] = None
+        self.reported_at = 0.0
+
+    def progress_text(self, status: str = "идет") -> str:
+        done = self.sent + self.failed
+        percent = done / self.total if self.total else 1.0
+        return (
+            f"Рассылка #{self.id}: {status}\n"
+            f"Получатели: {SEGMENT_TITLES.get(self.segment, self.segment)}\n"
+            f"Обработано: {done} из {self.total} ({percent:.0%})\n"
+            f"Успешно отправлено: {self.sent}\n"
+            f"Ошибок: {self.failed} (заблокировали бота или удалены: {self.blocked})"
+        )
+
+
+class BroadcastManager:
+    """
+    Фоновые рассылки по сегменту пользователей (USER_SEGMENTS в database/db_manager.py).
+    Пользователи читаются порциями по users.id, каждая порция отправляется
+    несколькими параллельными отправителями под общим ведром токенов.
+    После каждой порции курсор и счетчики сохраняются в базу, поэтому после
+    перезапуска рассылка продолжается с места остановки (повторно может
+    уйти не больше одной порции). Пользователи, которые заблокировали бота или
+    удалены, отмечаются в базе и в следующие рассылки по умолчанию не попадают.
+    owns - если бот работает в нескольких процессах, после перезапуска
+    продолжаются только рассылки администраторов этого процесса (туда же
+    приходят нажатия кнопок «Обновить» и «Отменить»).
+    """
+
+    def __init__(self, db: DatabaseManager, rate: float = 25, workers: int = 8,
+                 chunk_size: int = 200, max_attempts: int = 5, progress_interval: float = 5,
+                 owns: Optional[Callable[[int], bool]] = None):
+        self.db = db
+        self.owns = owns
+        self.bucket = TokenBucket(rate)
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.max_attempts = max_attempts
+        self.progress_interval = progress_interval
+        self.jobs: Dict[int, BroadcastJob] = {}
+
+    @staticmethod
+    def segment_since(segment: str) -> Optional[int]:
+        """Начало периода активности для сегмента (фиксируется при запуске рассылки)"""
+        return int(time.time()) - ACTIVE_SEGMENT_DAYS * 86400 if segment == "active" else None
+
+    async def count(self, segment: str) -> int:
+        """Число получателей рассылки по сегменту"""
+        return await self.db.count_segment(segment, self.segment_since(segment))
+
+    async def start(self, bot: Bot, text: str, admin_chat_id: int, segment: str = "reachable") -> int:
+        """Создание и запуск новой рассылки по сегменту пользователей, возвращает ее ID"""
+        since = self.segment_since(segment)
+        total = await self.db.count_segment(segment, since)
+        broadcast_id = await self.db.create_broadcast(text, total, admin_chat_id, segment, since)
+        job = BroadcastJob(await self.db.get_broadcast(broadcast_id))
+
+        status_message = await bot.send_message(
+            admin_chat_id,
+            job.progress_text(),
+            reply_markup=get_broadcast_keyboard(job.id)
+        )
+        job.status_message_id = status_message.message_id
+        await self.db.set_broadcast_status_message(job.id, job.status_message_id)
+
+        self._launch(bot, job)
+        return job.id
+
+    async def resume(self, bot: Bot) -> None:
+        """Продолжение рассылок, прерванных остановкой бота"""
+        for row in await self.db.get_running_broadcasts():
+            if self.owns is not None and not self.owns(row["admin_chat_id"] or 0):
+                continue
+            job = BroadcastJob(row)
+            logger.info("Продолжение рассылки #%s с пользователя %s", job.id, job.cursor)
+            self._launch(bot, job)
+
+    def cancel(self, broadcast_id: int) -> bool:
+        """Отмена рассылки, возвращает False, если она не выполняется"""
+        job = self.jobs.get(broadcast_id)
+        if job is None:
+            return False
+        job.cancelled = True
+        return True
+
+    async def stop(self) -> None:
+        """Остановка всех рассылок без смены статуса (они продолжатся после запуска)"""
+        tasks = [job.task for job in self.jobs.values() if job.task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _launch(self, bot: Bot, job: BroadcastJob) -> None:
+        self.jobs[job.id] = job
+        job.task = asyncio.create_task(self._run(bot, job))
+        job.task.add_done_callback(lambda _: self.jobs.pop(job.id, None))
+
+    async def _run(self, bot: Bot, job: BroadcastJob) -> None:
+        queue: asyncio.Queue = asyncio.Queue()
+        senders = [asyncio.create_task(self._sender(bot, job, queue)) for _ in range(self.workers)]
+        try:
+            chunks = self.db.iter_segment_chunks(job.segment, job.segment_since, self.chunk_size, job.cursor)
+            async for users in chunks:
+                if job.cancelled:
+                    break
+
+                for user in users:
+                    queue.put_nowait(user["user_id"])
+                await queue.join()
+
+                job.cursor = users[-1]["id"]
+                await self.db.save_broadcast_progress(job.id, job.cursor, job.sent, job.failed, job.blocked)
+                await self.report(bot, job)
+
+            status = "cancelled" if job.cancelled else "finished"
+            await self.db.finish_broadcast(job.id, status, job.sent, job.failed, job.blocked)
+            await self.report(bot, job, final=True)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Рассылка #%s прервана с ошибкой", job.id)
+            # Статус failed, а не running: иначе рассылка выглядит идущей,
+            # хотя ее нельзя ни отменить, ни продолжить до перезапуска
+            job.aborted = True
+            try:
+                await self.db.finish_broadcast(job.id, "failed", job.sent, job.failed, job.blocked)
+                await self.report(bot, job, final=True)
+            except Exception:
+                logger.exception("Не удалось отметить рассылку #%s прерванной", job.id)
+        finally:
+            for sender in senders:
+                sender.cancel()
+
+    async def _sender(self, bot: Bot, job: BroadcastJob, queue: asyncio.Queue) -> None:
+        while True:
+            user_id = await queue.get()
+            try:
+                if not job.cancelled:
+                    result = await self._send(bot, user_id, job.text)
+                    if result == SENT:
+                        job.sent += 1
+                    else:
+                        job.failed += 1
+                        if result in (BLOCKED, DEACTIVATED):
+                            job.blocked += 1
+                            self.db.set_user_status(user_id, result)
+            finally:
+                queue.task_done()
+
+    async def _send(self, bot: Bot, chat_id: int, text: str) -> str:
+        """Отправка одного сообщения с повторами, возвращает SENT, FAILED, BLOCKED или DEACTIVATED"""
+        for attempt in range(self.max_attempts):
+            await self.bucket.acquire()
+            try:
+                await bot.send_message(chat_id, text)
+                return SENT
+            except TelegramRetryAfter as e:
+                # Ограничение действует на весь бот, поэтому останавливаются все отправители
+                logger.warning("Флуд-контроль Telegram, пауза %s с", e.retry_after)
+                self.bucket.pause(e.retry_after)
+            except TelegramForbiddenError as e:
+                # Пользователь заблокировал бота или удален: повтор бесполезен
+                logger.info("Сообщение пользователю %s не доставлено: %s", chat_id, e)
+                return DEACTIVATED if "deactivated" in e.message.lower() else BLOCKED
+            except TelegramBadRequest as e:
+                # Чат недоступен: повтор бесполезен
+                logger.info("Сообщение пользователю %s не доставлено: %s", chat_id, e)
+                return FAILED
+            except (TelegramNetworkError, TelegramServerError) as e:
+                logger.warning("Ошибка отправки пользователю %s (попытка %s): %s", chat_id, attempt + 1, e)
+                await asyncio.sleep(min(2 ** attempt, 30))
+            except TelegramAPIError as e:
+                logger.warning("Сообщение пользователю %s не доставлено: %s", chat_id, e)
+                return FAILED
+        return FAILED
+
+    async def report(self, bot: Bot, job: BroadcastJob, final: bool = False, force: bool = False) -> None:
+        """Обновление сообщения с прогрессом (не чаще progress_interval секунд)"""
+        if job.status_message_id is None:
+            return
+
+        now = time.monotonic()
+        if not (final or force) and now - job.reported_at < self.progress_interval:
+            return
+        job.reported_at = now
+
+        if final:
+            if job.aborted:
+                status = "прервана с ошибкой"
+            else:
+                status = "отменена" if job.cancelled else "завершена"
+            text = job.progress_text(status)
+            reply_markup = None
+        else:
+            text = job.progress_text()
+            reply_markup = get_broadcast_keyboard(job.id)
+
+        try:
+            await bot.edit_message_text(
+                text,
+                chat_id=job.admin_chat_id,
+                message_id=job.status_message_id,
+                reply_markup=reply_markup
+            )
+        except TelegramBadRequest:
+            # Текст не изменился или сообщение удалено
+            pass
+        except TelegramRetryAfter as e:
+            # Прогресс обновится в следующий раз, а отправители подождут вместе с ним
+            logger.warning("Флуд-контроль Telegram при обновлении прогресса, пауза %s с", e.retry_after)
+            self.bucket.pause(e.retry_after)
+        except TelegramAPIError as e:
+            # Неудачное обновление прогресса не должно останавливать рассылку
+            logger.warning("Не удалось обновить прогресс рассылки #%s: %s", job.id, e)
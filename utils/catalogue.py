@@ -0,0 +1,65 @@
+from typing import Optional, Tuple
+
+from aiogram.types import InlineKeyboardMarkup
+
+from database import DatabaseManager
+from database.cache import LRUCache
+from keyboards import get_movies_page_keyboard
+
+# Название фильма в списке обрезается, чтобы страница гарантированно помещалась в сообщение
+TITLE_LIMIT = 100
+
+
+class MovieCatalogue:
+    """
+    Постраничный просмотр каталога фильмов в админ-панели.
+    Отрисованные страницы кэшируются и сбрасываются при изменении каталога,
+    счетчики использований на закэшированной странице обновляются раз в cache_ttl секунд.
+    """
+
+    def __init__(self, db: DatabaseManager, page_size: int = 20,
+                 cache_size: int = 256, cache_ttl: float = 60):
+        self.db = db
+        self.page_size = page_size
+        self.pages = LRUCache(cache_size, cache_ttl)
+        self._version = db.catalogue_version
+
+    async def render(self, before_id: Optional[int] = None, after_id: Optional[int] = None,
+                     query: Optional[str] = None) -> Optional[Tuple[str, InlineKeyboardMarkup]]:
+        """Текст и клавиатура страницы (None, если на странице нет фильмов)"""
+        version = self.db.catalogue_version
+        if version != self._version:
+            self.pages.clear()
+            self._version = version
+
+        key = (before_id, after_id, query)
+        page = self.pages.get(key)
+        if page is not None:
+            return page
+
+        movies, has_more = await self.db.get_movies_page(self.page_size, before_id, after_id, query)
+        if not movies:
+            return None
+
+        # В направлении, откуда пришли, фильмы точно есть
+        if after_id is not None:
+            has_newer, has_older = has_more, True
+        else:
+            has_newer, has_older = before_id is not None, has_more
+
+        header = f"Результаты поиска «{query}»:\n\n" if query else "Список фильмов:\n\n"
+        lines = [
+            f"Код: {movie['code']} - {movie['title'][:TITLE_LIMIT]} (Использований: {movie['usage_count']})"
+            for movie in movies
+        ]
+        keyboard = get_movies_page_keyboard(
+            movies[0]["id"] if has_newer else None,
+            movies[-1]["id"] if has_older else None,
+            is_search=bool(query)
+        )
+        page = (header + "\n".join(lines), keyboard)
+
+        # Каталог мог измениться, пока страница читалась из базы
+        if version == self.db.catalogue_version:
+            self.pages.set(key, page)
+        return page
@@ -0,0 +1,288 @@
+import csv
+import json
+import os
+import re
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, TextIO, Tuple
+
+from database import DatabaseManager
+
+# Форматы файлов каталога: CSV, JSON-массив объектов и JSON Lines (объект в строке)
+CSV, JSON, JSONL = "csv", "json", "jsonl"
+FORMATS = (CSV, JSON, JSONL)
+
+# Наибольший файл, который бот может скачать через Bot API
+MAX_IMPORT_SIZE = 20 << 20
+
+# Ограничения на код и название при импорте
+MAX_CODE_LENGTH = 64
+MAX_TITLE_LENGTH = 256
+
+# Названия столбцов кода и названия в заголовке CSV и ключи объектов JSON
+CODE_KEYS = ("code", "код")
+TITLE_KEYS = ("title", "название")
+
+# Столбцы выгрузки
+EXPORT_COLUMNS = ("code", "title", "usage_count", "created_at")
+
+# Наибольший размер одного элемента JSON, символов (ошибка синтаксиса не дочитывает файл целиком)
+MAX_ITEM_SIZE = 1 << 20
+
+# Сколько строк добавлять одной транзакцией
+IMPORT_CHUNK_SIZE = 1000
+
+# Сколько проблемных строк показывать в сообщении (все - в файле отчета)
+REPORT_EXAMPLES = 5
+# Код и подробности в примерах обрезаются, чтобы отчет помещался в сообщение Telegram
+REPORT_FIELD_LIMIT = 64
+
+_WHITESPACE = re.compile(r"[\s,]*")
+
+
+def detect_format(file_name: Optional[str]) -> Optional[str]:
+    """Формат по расширению файла"""
+    extension = os.path.splitext(file_name or "")[1].lower().lstrip(".")
+    return {"txt": CSV, "ndjson": JSONL}.get(extension, extension if extension in FORMATS else None)
+
+
+def _iter_csv(file: TextIO) -> Iterator[Tuple[int, Any]]:
+    """
+    Строки CSV как (номер строки, (код, название)). Разделитель - запятая,
+    точка с запятой или табуляция (какой чаще встречается в первой строке)
+    """
+    first_line = file.readline()
+    file.seek(0)
+    delimiter = max(",;\t", key=first_line.count)
+    reader = csv.reader(file, delimiter=delimiter)
+    code_column, title_column = 0, 1
+    first = True
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        if first:
+            first = False
+            header = [cell.strip().lower() for cell in row]
+            if any(key in header for key in CODE_KEYS):
+                # Столбцы ищутся по заголовку, поэтому читается и файл выгрузки /export
+                code_column = next(header.index(key) for key in CODE_KEYS if key in header)
+                title_column = next((header.index(key) for key in TITLE_KEYS if key in header), code_column + 1)
+                continue
+        yield reader.line_num, (row[code_column] if len(row) > code_column else "",
+                                row[title_column] if len(row) > title_column else "")
+
+
+def _iter_json(file: TextIO, chunk_size: int = 65536) -> Iterator[Tuple[int, Any]]:
+    """
+    Элементы JSON-массива по одному, не читая файл целиком:
+    (номер элемента, значение). Ошибка синтаксиса - ValueError
+    """
+    decoder = json.JSONDecoder()
+    buffer, position, index = file.read(chunk_size).lstrip(), 0, 0
+    if not buffer.startswith("["):
+        # Файл .json без массива читается как JSON Lines
+        file.seek(0)
+        yield from _iter_json_lines(file)
+        return
+    position = 1
+    exhausted = False
+    while True:
+        position = _WHITESPACE.match(buffer, position).end()
+        if buffer.startswith("]", position):
+            return
+        if position == len(buffer) or not exhausted and len(buffer) - position < 1024:
+            # Мало данных в буфере: дочитываем, чтобы не разрезать значение
+            more = "" if exhausted else file.read(chunk_size)
+            if more:
+                buffer, position = buffer[position:] + more, 0
+                continue
+            exhausted = True
+            if position == len(buffer):
+                raise ValueError(f"Массив не закрыт после элемента {index}")
+        try:
+            value, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError as e:
+            more = "" if exhausted or len(buffer) - position > MAX_ITEM_SIZE else file.read(chunk_size)
+            if not more:
+                raise ValueError(f"Ошибка JSON после элемента {index}: {e.msg}") from None
+            buffer, position = buffer[position:] + more, 0
+            continue
+        index += 1
+        yield index, value
+        position = end
+
+
+def _iter_json_lines(file: TextIO) -> Iterator[Tuple[int, Any]]:
+    """Строки JSON Lines как (номер строки, значение); строка с ошибкой - (номер, None)"""
+    for line, text in enumerate(file, 1):
+        if not text.strip():
+            continue
+        try:
+            yield line, json.loads(text)
+        except ValueError:
+            yield line, None
+
+
+def _movie_from_json(value: Any) -> Tuple[str, str]:
+    if value is None:
+        return "", ""
+    if isinstance(value, dict):
+        code = next((value[key] for key in CODE_KEYS if key in value), "")
+        title = next((value[key] for key in TITLE_KEYS if key in value), "")
+    elif isinstance(value, list) and len(value) >= 2:
+        code, title = value[0], value[1]
+    else:
+        return "", ""
+    return ("" if code is None else str(code)), ("" if title is None else str(title))
+
+
+def _validate(code: str, title: str) -> Optional[str]:
+    """Описание ошибки в строке или None"""
+    if not code:
+        return "нет кода"
+    if len(code) > MAX_CODE_LENGTH or any(char.isspace() for char in code):
+        return "недопустимый код"
+    if not title:
+        return "нет названия"
+    if len(title) > MAX_TITLE_LENGTH:
+        return f"название длиннее {MAX_TITLE_LENGTH} символов"
+    return None
+
+
+class ImportReport:
+    """
+    Итог импорта каталога. Проблемные строки (номер строки или элемента, код,
+    проблема, подробности) пишутся в CSV-файл отчета по мере чтения
+    """
+
+    def __init__(self, problems_path: str):
+        self.problems_path = problems_path
+        self._problems = open(problems_path, "w", newline="", encoding="utf-8-sig")
+        self._writer = csv.writer(self._problems)
+        self._writer.writerow(("line", "code", "problem", "details"))
+        self.rows = 0
+        self.added = 0
+        self.unchanged = 0
+        self.conflicts = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.error: Optional[str] = None
+        self.examples: List[str] = []
+
+    @property
+    def problems(self) -> int:
+        return self.conflicts + self.duplicates + self.invalid
+
+    def problem(self, line: int, code: str, problem: str, details: str = "") -> None:
+        self._writer.writerow((line, code, problem, details))
+        if len(self.examples) < REPORT_EXAMPLES:
+            code, details = _shorten(code), _shorten(details)
+            self.examples.append(f"{line}: {code or '-'} - {problem}{f' ({details})' if details else ''}")
+
+    def close(self) -> None:
+        self._problems.close()
+
+    def render(self) -> str:
+        lines = [
+            f"Импорт завершен: строк {self.rows}.",
+            f"Добавлено: {self.added}",
+            f"Уже в каталоге с тем же названием: {self.unchanged}",
+            f"Конфликты (код занят другим фильмом): {self.conflicts}",
+            f"Повторы кода в файле: {self.duplicates}",
+            f"Ошибки в строках: {self.invalid}",
+        ]
+        if self.error:
+            lines += ["", f"Файл прочитан не полностью: {self.error}. Добавленное до ошибки сохранено, "
+                          "повторный импорт исправленного файла добавит остальное."]
+        if self.examples:
+            lines += ["", "Примеры (строка: код - проблема):", *self.examples]
+        return "\n".join(lines)
+
+
+def _shorten(text: str, limit: int = REPORT_FIELD_LIMIT) -> str:
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+async def import_movies(db: DatabaseManager, path: str, file_format: str, report: ImportReport,
+                        chunk_size: int = IMPORT_CHUNK_SIZE) -> ImportReport:
+    """
+    Потоковый импорт фильмов из файла: строки читаются по одной и добавляются
+    порциями по chunk_size одной транзакцией. Существующие коды не меняются
+    """
+    seen = set()
+    chunk: List[Tuple[str, str]] = []
+    lines: Dict[str, int] = {}
+
+    async def flush() -> None:
+        existing = await db.add_movies(chunk)
+        report.added += len(chunk) - len(existing)
+        for code, title in chunk:
+            if code not in existing:
+                continue
+            if existing[code] == title:
+                report.unchanged += 1
+            else:
+                report.conflicts += 1
+                report.problem(lines[code], code, "код уже занят", existing[code])
+        chunk.clear()
+        lines.clear()
+
+    with open(path, encoding="utf-8-sig", newline="") as file:
+        readers = {CSV: _iter_csv, JSON: _iter_json, JSONL: _iter_json_lines}
+        rows = readers[file_format](file)
+        try:
+            for line, value in rows:
+                code, title = value if file_format == CSV else _movie_from_json(value)
+                code, title = code.strip(), title.strip().split("\n")[0].strip()
+                report.rows += 1
+                error = _validate(code, title) if value is not None else "ошибка JSON"
+                if error:
+                    report.invalid += 1
+                    report.problem(line, code, error)
+                    continue
+                if code in seen:
+                    report.duplicates += 1
+                    report.problem(line, code, "повтор кода в файле")
+                    continue
+                seen.add(code)
+                chunk.append((code, title))
+                lines[code] = line
+                if len(chunk) >= chunk_size:
+                    await flush()
+        except (ValueError, csv.Error) as e:
+            report.error = str(e)
+    if chunk:
+        await flush()
+    return report
+
+
+async def export_movies(db: DatabaseManager, path: str, file_format: str = CSV) -> int:
+    """
+    Выгрузка каталога со счетчиками использования в файл, от новых фильмов
+    к старым; фильмы читаются порциями, каталог целиком в памяти не держится.
+    Возвращает число фильмов
+    """
+    count = 0
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        if file_format == CSV:
+            writer = csv.writer(file)
+            writer.writerow(EXPORT_COLUMNS)
+        elif file_format == JSON:
+            file.write("[")
+        async for movie in db.iter_movies(EXPORT_COLUMNS, chunk_size=1000):
+            row = {column: movie[column] for column in EXPORT_COLUMNS}
+            if file_format == CSV:
+                writer.writerow(row.values())
+            else:
+                if file_format == JSON:
+                    file.write(",\n" if count else "\n")
+                file.write(json.dumps(row, ensure_ascii=False, default=str))
+                if file_format == JSONL:
+                    file.write("\n")
+            count += 1
+        if file_format == JSON:
+            file.write("\n]\n")
+    return count
+
+
+def export_file_name(file_format: str) -> str:
+    return f"movies-{datetime.now().strftime('%Y%m%d-%H%M')}.{file_format}"
@@ -0,0 +1,198 @@
+import asyncio
+import html
+import logging
+from typing import Any, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.enums import ChatMemberStatus
+from aiogram.exceptions import TelegramAPIError
+
+from database import DatabaseManager
+from database.cache import LRUCache
+from keyboards import get_check_subscription_keyboard
+
+logger = logging.getLogger(__name__)
+
+# Статусы участника, при которых пользователь считается подписанным
+MEMBER_STATUSES = {ChatMemberStatus.CREATOR, ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.MEMBER}
+
+# Статусы заявок, которые засчитываются как подписка
+REQUEST_STATUSES = {"pending", "approved"}
+
+
+def render_promo_text(channels: List[Dict[str, Any]]) -> str:
+    """Сообщение со ссылками на каналы (HTML)"""
+    channels_text = "Для пользования ботом нужно обязательно подписаться на каналы команды!\n\n"
+    
+    for channel in channels:
+        # Добавляем название канала как ссылку
+        channels_text += f"<a href='{html.escape(channel['link'])}'>{html.escape(channel['title'])}</a>\n"
+    
+    channels_text += "\nБлагодарим за поддержку!\n\n"
+    return channels_text
+
+
+class ChannelSet:
+    """
+    Скомпилированный список каналов: словарь id -> канал, готовое сообщение
+    со ссылками и клавиатура. Не изменяется после создания, поэтому при
+    изменении каналов заменяется целиком одним присваиванием.
+    """
+
+    def __init__(self, channels: List[Dict[str, Any]], version: int = 0):
+        self.version = version
+        self.channels = channels
+        self.by_id: Dict[int, Dict[str, Any]] = {channel["id"]: channel for channel in channels}
+        self.ids = frozenset(self.by_id)
+        self.promo_text = render_promo_text(channels)
+        self.keyboard = get_check_subscription_keyboard()
+
+
+class ChannelManager:
+    """
+    Каналы для обязательной подписки и проверка подписки пользователя.
+    Каналы хранятся в базе данных и меняются из админ-панели без перезапуска;
+    при первом запуске таблица заполняется из CHANNELS. Обработчики работают
+    с готовым снимком current (ChannelSet). Если задан poll_interval, изменения
+    из других процессов подхватываются по версии списка каналов.
+    
+    При проверке подписки сначала учитываются сохраненные заявки на вступление,
+    для остальных каналов get_chat_member вызывается параллельно. Результаты
+    кэшируются: положительные надолго, отрицательные ненадолго, чтобы недавно
+    подписавшийся пользователь быстро прошел проверку. Отдельно на access_ttl
+    секунд запоминается, что пользователь получил доступ к вводу кода (в том
+    числе по счетчику нажатий, когда часть каналов проверить нельзя), чтобы
+    кнопки подсказок не проходили проверку нажатиями заново.
+    """
+
+    def __init__(self, db: DatabaseManager, channels: List[Dict], positive_ttl: float = 600,
+                 negative_ttl: float = 30, cache_size: int = 100000,
+                 poll_interval: Optional[float] = None, access_ttl: float = 600):
+        self.db = db
+        # Каналы из config.py: начальное заполнение таблицы и список до загрузки из базы
+        self.seed = channels
+        self.current = ChannelSet(channels)
+        self.negative_ttl = negative_ttl
+        self.poll_interval = poll_interval
+        self._watch_task: Optional[asyncio.Task] = None
+        # (user_id, channel_id) -> подписан ли пользователь
+        self.cache = LRUCache(cache_size, positive_ttl)
+        # user_id -> True, если доступ к вводу кода недавно открыт
+        self.access = LRUCache(cache_size, access_ttl)
+
+    async def start(self) -> None:
+        """Загрузка каналов из базы (при первом запуске - заполнение из CHANNELS)"""
+        if await self.db.seed_channels(self.seed):
+            logger.info("Каналы из CHANNELS перенесены в базу данных: %s", len(self.seed))
+        await self.reload()
+        if self.poll_interval and self._watch_task is None:
+            self._watch_task = asyncio.create_task(self._watch())
+
+    async def stop(self) -> None:
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            await asyncio.gather(self._watch_task, return_exceptions=True)
+            self._watch_task = None
+
+    async def reload(self) -> None:
+        """Перечитывание каналов из базы и замена снимка"""
+        # Версия читается первой: если каналы изменятся между запросами, следующая проверка перечитает их
+        version = await self.db.get_channels_version()
+        self.current = ChannelSet(await self.db.get_channels(), version)
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                if await self.db.get_channels_version() != self.current.version:
+                    await self.reload()
+                    logger.info("Список каналов обновлен: %s", len(self.current.ids))
+            except Exception:
+                logger.exception("Ошибка проверки списка каналов")
+
+    async def add_channel(self, channel_id: int, title: str, link: str) -> bool:
+        """Добавление или изменение канала; True, если канал новый"""
+        added = await self.db.add_channel(channel_id, title, link)
+        await self.reload()
+        return added
+
+    async def remove_channel(self, channel_id: int) -> bool:
+        """Удаление канала; False, если такого канала нет"""
+        removed = await self.db.delete_channel(channel_id)
+        await self.reload()
+        return removed
+
+    def is_our_channel(self, chat_id: int) -> bool:
+        return chat_id in self.current.by_id
+
+    def remember(self, user_id: int, channel_id: int, subscribed: bool) -> None:
+        """Сохранение результата проверки в кэш"""
+        self.cache.set((user_id, channel_id), subscribed, None if subscribed else self.negative_ttl)
+
+    def forget_negative(self, user_id: int) -> None:
+        """Сброс отрицательных результатов (пользователь сообщил, что подписался)"""
+        for channel_id in self.current.ids:
+            if self.cache.peek((user_id, channel_id)) is False:
+                self.cache.pop((user_id, channel_id))
+
+    def grant_access(self, user_id: int) -> None:
+        """Пользователь прошел проверку подписки и может вводить коды"""
+        self.access.set(user_id, True)
+
+    def has_access(self, user_id: int) -> bool:
+        """Доступ к вводу кода открыт не раньше чем access_ttl секунд назад"""
+        return self.access.get(user_id) is True
+
+    async def _check_member(self, bot: Bot, user_id: int, channel_id: int) -> Optional[bool]:
+        try:
+            member = await bot.get_chat_member(channel_id, user_id)
+        except TelegramAPIError as e:
+            # Обычно бот не является администратором канала и не видит участников
+            logger.warning("Не удалось проверить подписку %s на канал %s: %s", user_id, channel_id, e)
+            return None
+
+        if member.status in MEMBER_STATUSES:
+            return True
+        if member.status == ChatMemberStatus.RESTRICTED:
+            return member.is_member
+        return False
+
+    async def check(self, bot: Bot, user_id: int) -> Dict[int, Optional[bool]]:
+        """Подписка по каждому каналу: True, False или None, если проверить не удалось"""
+        channel_ids = self.current.ids
+        result: Dict[int, Optional[bool]] = {}
+        for channel_id in channel_ids:
+            cached = self.cache.get((user_id, channel_id))
+            if cached is not None:
+                result[channel_id] = cached
+
+        unknown = set(channel_ids).difference(result)
+        if unknown:
+            requests = await self.db.get_channel_requests(user_id)
+            for channel_id in list(unknown):
+                if requests.get(channel_id) in REQUEST_STATUSES:
+                    result[channel_id] = True
+                    self.remember(user_id, channel_id, True)
+                    unknown.discard(channel_id)
+
+        if unknown:
+            pending = list(unknown)
+            statuses = await asyncio.gather(*(self._check_member(bot, user_id, cid) for cid in pending))
+            for channel_id, subscribed in zip(pending, statuses):
+                result[channel_id] = subscribed
+                if subscribed is not None:
+                    self.remember(user_id, channel_id, subscribed)
+
+        return result
+
+    async def is_subscribed(self, bot: Bot, user_id: int) -> Optional[bool]:
+        """
+        True - подписан на все каналы, False - хотя бы на один нет,
+        None - отрицательных ответов нет, но часть каналов проверить не удалось.
+        """
+        statuses = (await self.check(bot, user_id)).values()
+        if False in statuses:
+            return False
+        if None in statuses:
+            return None
+        return True
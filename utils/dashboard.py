@@ -0,0 +1,109 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Mapping, Tuple
+
+from aiogram.types import InlineKeyboardMarkup
+
+from database import DatabaseManager
+from keyboards import get_stats_keyboard
+
+# Периоды, которые можно выбрать кнопками, в днях
+PERIODS = (1, 7, 30)
+# Сколько кодов показывать в списке самых популярных
+TOP_CODES = 10
+# Сколько несуществующих кодов показывать в отчете и в команде /missing
+TOP_MISSING = 10
+MISSING_REPORT_LIMIT = 50
+# Название фильма в списке обрезается, чтобы отчет гарантированно помещался в сообщение
+TITLE_LIMIT = 60
+# То же для кода: коды из базы, сохраненные до ограничения длины, могут быть любыми
+CODE_LIMIT = 64
+
+
+def _ratio(part: int, total: int) -> str:
+    return f"{part / total:.1%}" if total else "-"
+
+
+def _sum(rows: List[Dict[str, Any]], field: str) -> int:
+    return sum(row[field] for row in rows)
+
+
+def _missing_lines(missing: List[Dict[str, Any]]) -> List[str]:
+    return [f"{position}. {row['code'][:CODE_LIMIT]}: {row['lookups']}" for position, row in enumerate(missing, start=1)]
+
+
+async def render_dashboard(db: DatabaseManager, channels: Mapping[int, Dict[str, Any]],
+                           days: int = 7) -> Tuple[str, InlineKeyboardMarkup]:
+    """
+    Текст и клавиатура отчета «Статистика» за последние days дней.
+    Отчет строится только по сводным таблицам, поэтому время не зависит от числа
+    пользователей. События других процессов видны с задержкой до интервала записи.
+    """
+    started = time.perf_counter()
+    # Сначала записываются события этого процесса, чтобы отчет был актуальным
+    await db.analytics.flush()
+    daily, top, missing, joins = await asyncio.gather(
+        db.analytics.daily(days),
+        db.analytics.top_codes(days, TOP_CODES),
+        db.analytics.missing_codes(days, TOP_MISSING),
+        db.analytics.channel_joins(days),
+    )
+
+    lookups, hits = _sum(daily, "lookups"), _sum(daily, "hits")
+    promo, requests, approved = _sum(daily, "promo_shown"), _sum(daily, "join_requests"), _sum(daily, "join_approved")
+    lines = [
+        f"Статистика за {days} дн. (дни по UTC)",
+        "",
+        f"Новых пользователей: {_sum(daily, 'new_users')}",
+        f"Активных в день: до {max((row['active_users'] for row in daily), default=0)}",
+        f"Поисков по коду: {lookups}, найдено: {_ratio(hits, lookups)}",
+        f"Показов списка каналов: {promo}",
+        f"Заявок в каналы: {requests} ({_ratio(requests, promo)} от показов), "
+        f"одобрено: {approved} ({_ratio(approved, requests)})",
+    ]
+
+    if days > 1 and daily:
+        lines += ["", "По дням (активные / новые / поиски / найдено / заявки):"]
+        lines += [
+            f"{row['day'][5:]}: {row['active_users']} / {row['new_users']} / {row['lookups']} / "
+            f"{_ratio(row['hits'], row['lookups'])} / {row['join_requests']}"
+            for row in reversed(daily)
+        ]
+
+    if top:
+        lines += ["", f"Популярные коды (топ-{TOP_CODES}):"]
+        lines += [
+            f"{position}. {row['code'][:CODE_LIMIT]} - {(row['title'] or 'удален')[:TITLE_LIMIT]}: {row['lookups']}"
+            for position, row in enumerate(top, start=1)
+        ]
+
+    if missing:
+        lines += ["", f"Ищут, но нет в каталоге (топ-{TOP_MISSING}, все - /missing):"]
+        lines += _missing_lines(missing)
+
+    if joins:
+        lines += ["", "Заявки по каналам:"]
+        lines += [
+            f"{channels.get(row['channel_id'], {}).get('title', row['channel_id'])}: "
+            f"{row['join_requests']}, одобрено {row['join_approved']}"
+            for row in joins
+        ]
+
+    lines += ["", f"Отчет построен за {(time.perf_counter() - started) * 1000:.1f} мс"]
+    return "\n".join(lines), get_stats_keyboard(days, PERIODS)
+
+
+async def render_missing_codes(db: DatabaseManager, days: int = 7) -> str:
+    """
+    Отчет «Ищут, но нет в каталоге»: несуществующие коды, которые чаще всего
+    искали за последние days дней, - что стоит добавить в первую очередь
+    """
+    await db.analytics.flush()
+    missing = await db.analytics.missing_codes(days, MISSING_REPORT_LIMIT)
+    if not missing:
+        return f"За {days} дн. несуществующие коды не искали."
+    return "\n".join([
+        f"Ищут, но нет в каталоге, за {days} дн. (код: сколько раз искали, не меньше):",
+        "",
+        *_missing_lines(missing),
+    ])
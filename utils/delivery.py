@@ -0,0 +1,155 @@
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
+from aiogram.types import Message, MessageOriginChannel
+
+from database import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+# Вложения, которые можно сохранить у фильма (анимация проверяется раньше документа:
+# у GIF в сообщении заполнены оба поля)
+MEDIA_TYPES = ("video", "animation", "document")
+
+# Ошибки Bot API, которые означают, что file_id больше не действует
+STALE_FILE_ERRORS = ("wrong file identifier", "wrong remote file identifier", "file reference", "file_reference")
+
+# Подпись к видео не может быть длиннее 1024 символов
+CAPTION_LIMIT = 1024
+
+
+def extract_media(message: Message) -> Optional[Tuple[str, str]]:
+    """(file_id, тип) видео, анимации или документа из сообщения"""
+    for file_type in MEDIA_TYPES:
+        media = getattr(message, file_type)
+        if media is not None:
+            return media.file_id, file_type
+    return None
+
+
+def forward_source(message: Message) -> Optional[Tuple[int, int]]:
+    """(ID канала, ID сообщения), если сообщение переслано из канала"""
+    origin = message.forward_origin
+    if isinstance(origin, MessageOriginChannel):
+        return origin.chat.id, origin.message_id
+    return None
+
+
+def movie_caption(movie: Dict[str, Any]) -> str:
+    return f"Название фильма: {movie['title']}"[:CAPTION_LIMIT]
+
+
+def has_media(movie: Dict[str, Any]) -> bool:
+    """У фильма есть видео, которое можно отправить"""
+    return bool(movie.get("file_id") or movie.get("source_message_id"))
+
+
+def is_stale_file_error(error: TelegramBadRequest) -> bool:
+    message = error.message.lower()
+    return any(part in message for part in STALE_FILE_ERRORS)
+
+
+class MovieDelivery:
+    """
+    Отправка фильма одним запросом к Bot API без загрузки файла: по сохраненному
+    file_id (send_video и т.п.) или копией исходного сообщения из канала (copy_message).
+    Если file_id перестал действовать, новый берется из исходного сообщения: бот
+    пересылает его в служебный чат media_chat_id, сохраняет file_id из ответа и
+    удаляет пересланное сообщение. Без исходного сообщения устаревший file_id
+    удаляется, и фильм снова отправляется только названием.
+    """
+
+    def __init__(self, db: DatabaseManager, media_chat_id: Optional[int] = None):
+        self.db = db
+        self.media_chat_id = media_chat_id
+        # Обновление file_id одного фильма выполняется один раз, даже если его ждут несколько пользователей
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self.sent_file = 0
+        self.sent_copy = 0
+        self.stale = 0
+        self.refreshed = 0
+        self.failed = 0
+
+    async def _send_file(self, bot: Bot, chat_id: int, file_id: str, file_type: str, caption: str) -> None:
+        send = getattr(bot, f"send_{file_type}")
+        await send(chat_id, file_id, caption=caption)
+
+    async def deliver(self, bot: Bot, chat_id: int, movie: Dict[str, Any]) -> bool:
+        """Отправка видео фильма; False, если видео у фильма нет или отправить его не удалось"""
+        if not has_media(movie):
+            return False
+        caption = movie_caption(movie)
+
+        if movie.get("file_id"):
+            try:
+                await self._send_file(bot, chat_id, movie["file_id"], movie["file_type"], caption)
+                self.sent_file += 1
+                return True
+            except TelegramBadRequest as e:
+                if not is_stale_file_error(e):
+                    raise
+                self.stale += 1
+                logger.warning("Устаревший file_id фильма %s: %s", movie["code"], e.message)
+
+            media = await self.refresh(bot, movie)
+            if media is not None:
+                await self._send_file(bot, chat_id, *media, caption=caption)
+                self.sent_file += 1
+                return True
+
+        if movie.get("source_message_id"):
+            try:
+                await bot.copy_message(chat_id, movie["source_chat_id"], movie["source_message_id"],
+                                       caption=caption)
+                self.sent_copy += 1
+                return True
+            except TelegramBadRequest as e:
+                logger.warning("Не удалось скопировать видео фильма %s из канала %s: %s",
+                               movie["code"], movie["source_chat_id"], e.message)
+
+        self.failed += 1
+        return False
+
+    async def refresh(self, bot: Bot, movie: Dict[str, Any]) -> Optional[Tuple[str, str]]:
+        """Новый file_id из исходного сообщения фильма (None, если получить не удалось)"""
+        code = movie["code"]
+        task = self._refreshing.get(code)
+        if task is None:
+            task = asyncio.ensure_future(self._refresh(bot, movie))
+            self._refreshing[code] = task
+            task.add_done_callback(lambda _: self._refreshing.pop(code, None))
+        return await asyncio.shield(task)
+
+    async def _refresh(self, bot: Bot, movie: Dict[str, Any]) -> Optional[Tuple[str, str]]:
+        media = None
+        if movie.get("source_message_id") and self.media_chat_id:
+            try:
+                forwarded = await bot.forward_message(self.media_chat_id, movie["source_chat_id"],
+                                                      movie["source_message_id"], disable_notification=True)
+                media = extract_media(forwarded)
+                try:
+                    await bot.delete_message(self.media_chat_id, forwarded.message_id)
+                except TelegramAPIError:
+                    pass
+            except TelegramAPIError as e:
+                logger.warning("Не удалось обновить file_id фильма %s: %s", movie["code"], e)
+
+        # Устаревший file_id не должен отправляться снова
+        await self.db.set_movie_file(movie["code"], *(media or (None, None)))
+        if media is not None:
+            self.refreshed += 1
+            logger.info("file_id фильма %s обновлен", movie["code"])
+        return media
+
+    def stats(self) -> Dict[str, Any]:
+        """Отправки по file_id и копированием, обновления устаревших file_id"""
+        return {
+            "sent_file": self.sent_file,
+            "sent_copy": self.sent_copy,
+            "stale": self.stale,
+            "refreshed": self.refreshed,
+            "failed": self.failed,
+        }
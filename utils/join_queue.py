@@ -0,0 +1,256 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from database import DatabaseManager
+from utils.rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Результаты одной попытки одобрения
+APPROVED, RETRY, DROPPED = "approved", "retry", "dropped"
+
+# Ответы Telegram, после которых заявку одобрять уже не нужно
+ALREADY_MEMBER_ERRORS = ("USER_ALREADY_PARTICIPANT",)
+
+
+class JoinApprover:
+    """
+    Одобрение заявок в каналы через очередь в базе данных (таблица join_queue).
+    Обработчик заявки только кладет ее в буфер и сразу возвращается; буфер
+    записывается в базу пакетами раз в flush_interval секунд вместе с
+    результатами одобрения. Фоновые обработчики захватывают заявки из базы
+    порциями и одобряют их под своим ведром токенов, не отнимая лимит
+    у поиска фильмов. Сетевые ошибки и ошибки Telegram повторяются с растущей
+    паузой до max_attempts раз. После перезапуска очередь продолжается с того
+    же места; захваченные, но не обработанные заявки возвращаются в работу через
+    lease секунд. В режиме нескольких процессов очередь общая: заявку может
+    одобрить любой процесс, лимит rate действует на каждый.
+    """
+
+    def __init__(self, db: DatabaseManager, rate: float = 20, workers: int = 4, batch_size: int = 100,
+                 flush_interval: float = 0.2, poll_interval: float = 1.0, lease: float = 60,
+                 max_attempts: int = 5, retry_delay: float = 5, max_retry_delay: float = 600):
+        self.db = db
+        self.bucket = TokenBucket(rate)
+        self.workers = workers
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        # Новые заявки (user_id, channel_id, время поступления), еще не записанные в базу
+        self._incoming: List[Tuple[int, int, float]] = []
+        # Результаты, еще не записанные в базу
+        self._approved: List[Tuple[int, int, int]] = []
+        self._dropped: List[int] = []
+        self._retries: List[Tuple[int, float, int]] = []
+        self._queue: asyncio.Queue = asyncio.Queue()
+        # Пора записать буфер / пора выбрать заявки из базы
+        self._wake = asyncio.Event()
+        self._fetch_now = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._tasks: List[asyncio.Task] = []
+        self._running = False
+        self._in_flight = 0
+        # Состояние очереди в базе на момент последней проверки
+        self.depth = 0
+        self.oldest: Optional[float] = None
+        self.approved = 0
+        self.dropped = 0
+        self.retried = 0
+        self.last_lag = 0.0
+        self.lag_total = 0.0
+
+    # Постановка в очередь
+
+    def enqueue(self, user_id: int, channel_id: int) -> None:
+        """Заявка в канал; в базу попадет при следующей пакетной записи"""
+        self._incoming.append((user_id, channel_id, time.time()))
+        if len(self._incoming) >= self.batch_size:
+            self._wake.set()
+
+    @property
+    def pending_writes(self) -> int:
+        return len(self._incoming) + len(self._approved) + len(self._dropped) + len(self._retries)
+
+    async def flush(self) -> None:
+        """Запись новых заявок и результатов одобрения одной транзакцией"""
+        async with self._flush_lock:
+            if not self.pending_writes:
+                return
+
+            incoming, self._incoming = self._incoming, []
+            approved, self._approved = self._approved, []
+            dropped, self._dropped = self._dropped, []
+            retries, self._retries = self._retries, []
+            try:
+                await self.db.write_join_queue(incoming, approved, dropped, retries)
+            except Exception:
+                # Возвращаем все в буфер, чтобы записать в следующий раз
+                self._incoming[:0] = incoming
+                self._approved[:0] = approved
+                self._dropped[:0] = dropped
+                self._retries[:0] = retries
+                raise
+
+    # Фоновые задачи
+
+    async def start(self, bot: Bot) -> None:
+        """Запуск записи буфера, выборки заявок из базы и обработчиков"""
+        if self._tasks:
+            return
+        self._running = True
+        self._tasks = [
+            asyncio.create_task(self._run_writer()),
+            asyncio.create_task(self._run_fetcher()),
+            *(asyncio.create_task(self._approver(bot)) for _ in range(self.workers)),
+        ]
+
+    async def stop(self) -> None:
+        """
+        Остановка обработчиков и запись буфера. Заявки, захваченные, но не
+        одобренные, вернутся в работу после перезапуска по истечении lease
+        """
+        # wait_for может поглотить отмену, если событие сработало одновременно с ней,
+        # поэтому циклы записи и выборки проверяют еще и флаг
+        self._running = False
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.flush()
+
+    async def _run_writer(self) -> None:
+        while self._running:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            had_incoming = bool(self._incoming)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Ошибка записи очереди заявок в базу данных")
+                await asyncio.sleep(self.flush_interval)
+                continue
+            # Выборка заявок сразу после записи новых, а не по таймеру
+            self._wake.clear()
+            if had_incoming:
+                self._fetch_now.set()
+
+    async def _run_fetcher(self) -> None:
+        while self._running:
+            try:
+                claimed = 0
+                # Новая порция берется, когда обработчики разобрали предыдущую
+                if self._queue.qsize() < self.workers:
+                    now = time.time()
+                    rows = await self.db.claim_join_requests(now, now + self.lease, self.batch_size)
+                    for row in rows:
+                        self._queue.put_nowait(row)
+                    claimed = len(rows)
+                    self.depth, self.oldest = await self.db.get_join_queue_state()
+                if claimed == self.batch_size:
+                    await asyncio.sleep(0)
+                    continue
+            except Exception:
+                logger.exception("Ошибка выборки заявок из очереди")
+
+            try:
+                await asyncio.wait_for(self._fetch_now.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._fetch_now.clear()
+
+    async def _approver(self, bot: Bot) -> None:
+        while True:
+            row = await self._queue.get()
+            self._in_flight += 1
+            try:
+                result = await self._approve(bot, row["user_id"], row["channel_id"])
+                self._record(row, result)
+            except Exception:
+                logger.exception("Ошибка одобрения заявки %s в канал %s", row["user_id"], row["channel_id"])
+                self._record(row, RETRY)
+            finally:
+                self._in_flight -= 1
+                self._queue.task_done()
+            # Порция почти разобрана - пора брать следующую (один раз на порцию)
+            if self._queue.qsize() == self.workers - 1:
+                self._fetch_now.set()
+
+    async def _approve(self, bot: Bot, user_id: int, channel_id: int) -> str:
+        """Одна попытка одобрения (паузы флуд-контроля не считаются), возвращает APPROVED, RETRY или DROPPED"""
+        while True:
+            await self.bucket.acquire()
+            try:
+                await bot.approve_chat_join_request(chat_id=channel_id, user_id=user_id)
+                return APPROVED
+            except TelegramRetryAfter as e:
+                # Ограничение действует на весь бот, поэтому останавливаются все обработчики
+                logger.warning("Флуд-контроль Telegram при одобрении заявок, пауза %s с", e.retry_after)
+                self.bucket.pause(e.retry_after)
+            except TelegramBadRequest as e:
+                if any(error in e.message for error in ALREADY_MEMBER_ERRORS):
+                    return APPROVED
+                # Заявка отозвана или уже обработана: повтор бесполезен
+                logger.info("Заявка %s в канал %s не одобрена: %s", user_id, channel_id, e)
+                return DROPPED
+            except (TelegramForbiddenError, TelegramNetworkError, TelegramServerError) as e:
+                # Сеть, сбой Telegram или у бота временно нет прав в канале
+                logger.warning("Ошибка одобрения заявки %s в канал %s: %s", user_id, channel_id, e)
+                return RETRY
+            except TelegramAPIError as e:
+                logger.warning("Заявка %s в канал %s не одобрена: %s", user_id, channel_id, e)
+                return DROPPED
+
+    def _record(self, row: Dict[str, Any], result: str) -> None:
+        if result == RETRY and row["attempts"] + 1 >= self.max_attempts:
+            logger.warning("Заявка %s в канал %s не одобрена за %s попыток",
+                           row["user_id"], row["channel_id"], self.max_attempts)
+            result = DROPPED
+
+        if result == APPROVED:
+            self._approved.append((row["id"], row["user_id"], row["channel_id"]))
+            self.db.analytics.join_request(row["channel_id"], approved=True)
+            self.approved += 1
+            self.last_lag = time.time() - row["created_at"]
+            self.lag_total += self.last_lag
+        elif result == RETRY:
+            attempts = row["attempts"] + 1
+            delay = min(self.retry_delay * 2 ** (attempts - 1), self.max_retry_delay)
+            self._retries.append((attempts, time.time() + delay, row["id"]))
+            self.retried += 1
+        else:
+            self._dropped.append(row["id"])
+            self.dropped += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Глубина очереди и задержка одобрения (в секундах от поступления заявки)"""
+        now = time.time()
+        oldest = min(filter(None, (self.oldest, self._incoming[0][2] if self._incoming else None)), default=None)
+        return {
+            "depth": self.depth,
+            "buffered": len(self._incoming),
+            "claimed": self._queue.qsize() + self._in_flight,
+            "oldest_age": now - oldest if oldest else 0.0,
+            "approved": self.approved,
+            "dropped": self.dropped,
+            "retried": self.retried,
+            "last_lag": self.last_lag,
+            "avg_lag": self.lag_total / self.approved if self.approved else 0.0,
+        }
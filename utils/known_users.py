@@ -0,0 +1,74 @@
+import zlib
+from array import array
+from bisect import bisect_left
+from typing import Dict, Optional
+
+
+def profile_fingerprint(username: Optional[str], first_name: Optional[str], last_name: Optional[str]) -> int:
+    """Отпечаток профиля пользователя (одинаковый во всех процессах, в отличие от hash())"""
+    return zlib.crc32("\x1f".join((username or "", first_name or "", last_name or "")).encode())
+
+
+class KnownUsers:
+    """
+    Компактная таблица user_id -> отпечаток профиля.
+    Пользователи, загруженные при запуске, хранятся в двух отсортированных
+    массивах (12 байт на пользователя, поиск двоичный), новые и изменившиеся -
+    в небольшом словаре, который время от времени сливается с массивами.
+    """
+
+    def __init__(self, merge_threshold: int = 50000):
+        self.merge_threshold = merge_threshold
+        self._ids = array("q")
+        self._prints = array("I")
+        self._recent: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        # В словаре только пользователи, которых нет в массивах
+        return len(self._ids) + len(self._recent)
+
+    def _find(self, user_id: int) -> Optional[int]:
+        index = bisect_left(self._ids, user_id)
+        if index < len(self._ids) and self._ids[index] == user_id:
+            return index
+        return None
+
+    def load(self, ids: array, prints: array) -> None:
+        """Замена содержимого массивами user_id (по возрастанию) и отпечатков"""
+        self._ids = ids
+        self._prints = prints
+        self._recent = {}
+
+    def get(self, user_id: int) -> Optional[int]:
+        """Отпечаток профиля или None для неизвестного пользователя"""
+        fingerprint = self._recent.get(user_id)
+        if fingerprint is not None:
+            return fingerprint
+        index = self._find(user_id)
+        return self._prints[index] if index is not None else None
+
+    def set(self, user_id: int, fingerprint: int) -> None:
+        index = self._find(user_id)
+        if index is not None:
+            self._prints[index] = fingerprint
+            return
+        self._recent[user_id] = fingerprint
+        if len(self._recent) >= self.merge_threshold:
+            self._merge()
+
+    def _merge(self) -> None:
+        """Слияние новых пользователей с отсортированными массивами"""
+        recent = sorted(self._recent.items())
+        ids, prints = array("q"), array("I")
+        i = 0
+        for user_id, fingerprint in recent:
+            while i < len(self._ids) and self._ids[i] < user_id:
+                ids.append(self._ids[i])
+                prints.append(self._prints[i])
+                i += 1
+            ids.append(user_id)
+            prints.append(fingerprint)
+        ids.extend(self._ids[i:])
+        prints.extend(self._prints[i:])
+        self._ids, self._prints = ids, prints
+        self._recent = {}
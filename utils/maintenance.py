@@ -0,0 +1,447 @@
+import asyncio
+import glob
+import gzip
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from database import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+# Состояния для замеров пробного запроса: без обслуживания и во время операции
+IDLE, BUSY = "idle", "busy"
+
+# Режим PRAGMA auto_vacuum, при котором свободные страницы можно возвращать по частям
+AUTO_VACUUM_INCREMENTAL = 2
+
+# Пробный запрос: поиск по индексу кода, как у пользователя, который ввел код
+PROBE_SQL = "SELECT 1 FROM movies WHERE code = ?"
+
+
+class _Cancelled(Exception):
+    """Операция прервана остановкой бота"""
+
+
+class DatabaseMaintenance:
+    """
+    Фоновое обслуживание базы данных: сжатые резервные копии через backup API
+    SQLite с ротацией, контрольные точки WAL, обновление статистики для
+    планировщика запросов (ANALYZE) и возврат свободных страниц файлу
+    (incremental_vacuum). Копия и контрольная точка выполняются в отдельном
+    потоке со своим соединением, копия - по step_pages страниц за шаг.
+    Раз в tick секунд считается нагрузка на базу (запросов в секунду через пул)
+    и замеряется задержка пробного поиска по коду. Новые операции начинаются,
+    только когда нагрузка ниже quiet_rate; во время копии пауза между шагами
+    удваивается, пока задержка пробного запроса больше обычной в latency_factor
+    раз или нагрузка высокая, и уменьшается вдвое, когда все спокойно.
+    Копия не останавливается совсем (не реже шага за max_pause), чтобы не
+    держать снимок базы бесконечно. observer(состояние, задержка) вызывается
+    для каждого пробного запроса (для метрик).
+    Базу, созданную без auto_vacuum = INCREMENTAL, можно один раз перевести
+    в этот режим (request_conversion): полный VACUUM в ближайший тихий период.
+    """
+
+    def __init__(self, db: DatabaseManager, backup_dir: str = "", backup_interval: float = 86400,
+                 keep: int = 7, quiet_rate: float = 50, tick: float = 1.0, first_delay: float = 600,
+                 step_pages: int = 256, check_steps: int = 1000000, min_pause: float = 0.002, max_pause: float = 0.5,
+                 latency_factor: float = 2.0, checkpoint_interval: float = 60, wal_autocheckpoint: int = 10000,
+                 analyze_interval: float = 6 * 3600, analysis_limit: int = 1000,
+                 vacuum_pages: int = 1024, vacuum_step: int = 256):
+        self.db = db
+        self.backup_dir = backup_dir
+        self.backup_interval = backup_interval
+        self.keep = keep
+        self.quiet_rate = quiet_rate
+        self.tick = tick
+        self.step_pages = step_pages
+        self.check_steps = check_steps
+        self.min_pause = min_pause
+        self.max_pause = max_pause
+        self.latency_factor = latency_factor
+        self.checkpoint_interval = checkpoint_interval
+        self.wal_autocheckpoint = wal_autocheckpoint
+        self.analyze_interval = analyze_interval
+        self.analysis_limit = analysis_limit
+        self.vacuum_pages = vacuum_pages
+        self.vacuum_step = vacuum_step
+        self.observer: Optional[Callable[[str, float], None]] = None
+        # Свой поток, чтобы копия не занимала читателей и писателя пула
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-maintenance",
+                                            initializer=_lower_priority)
+        self._task: Optional[asyncio.Task] = None
+        self._job: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._backup_requested = False
+        self._conversion_requested = False
+        # Когда операции станут нужны (time.time())
+        now = time.time()
+        self._next_backup = now + first_delay
+        self._next_checkpoint = now + checkpoint_interval
+        self._next_analyze = now + first_delay
+        # Нагрузка и задержка пробного запроса (сглаженные)
+        self._queries = 0
+        # Запросы самого обслуживания через пул, в нагрузку они не считаются
+        self._own_queries = 0
+        self._measured_at = 0.0
+        self.rate = 0.0
+        self.busy = False
+        self.probe_idle = 0.0
+        self.probe_busy = 0.0
+        self.pause = min_pause
+        self.running: Optional[str] = None
+        self.deferred = 0
+        self.backups = 0
+        self.backup_failures = 0
+        self.last_backup: Optional[str] = None
+        self.last_backup_at = 0.0
+        self.last_backup_seconds = 0.0
+        self.last_backup_size = 0
+        self.database_size = 0
+        self.checkpoints = 0
+        self.wal_pages = 0
+        self.analyzes = 0
+        self.auto_vacuum = 0
+        self.free_pages = 0
+        self.vacuumed_pages = 0
+        self.conversions = 0
+
+    # Запуск и остановка
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        # Контрольные точки делает обслуживание в тихие периоды; писатель пула
+        # переносит WAL в базу сам только после wal_autocheckpoint страниц
+        await self._write(lambda conn: conn.execute(f"PRAGMA wal_autocheckpoint = {self.wal_autocheckpoint}"))
+        self.auto_vacuum, self.free_pages = await self._write(_vacuum_state)
+        if self.backup_dir:
+            os.makedirs(self.backup_dir, exist_ok=True)
+            newest = max(self._backups(), key=os.path.getmtime, default=None)
+            if newest is not None:
+                # После перезапуска копия делается по расписанию, а не сразу
+                self.last_backup, self.last_backup_at = os.path.basename(newest), os.path.getmtime(newest)
+                self.last_backup_size = os.path.getsize(newest)
+                self._next_backup = max(self._next_backup, self.last_backup_at + self.backup_interval)
+        self._queries, self._measured_at = self.db.pool.queries - self._own_queries, time.perf_counter()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Остановка: начатая копия прерывается, ее временные файлы удаляются"""
+        self._stopping = True
+        tasks = [task for task in (self._task, self._job) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = self._job = None
+        self._executor.shutdown(wait=True)
+
+    def request_backup(self) -> bool:
+        """Копия при следующей проверке независимо от нагрузки; False, если копия уже идет"""
+        if not self.backup_dir or self.running == "backup":
+            return False
+        self._backup_requested = True
+        return True
+
+    def request_conversion(self) -> bool:
+        """
+        Перевод базы в auto_vacuum = INCREMENTAL полным VACUUM в ближайший тихий
+        период; False, если режим уже включен. VACUUM переписывает весь файл
+        (нужно столько же свободного места на диске) и на это время занимает писателя
+        """
+        if self.auto_vacuum == AUTO_VACUUM_INCREMENTAL:
+            return False
+        self._conversion_requested = True
+        return True
+
+    async def _read(self, func: Callable[[sqlite3.Connection], Any]) -> Any:
+        self._own_queries += 1
+        return await self.db.pool.read(func)
+
+    async def _write(self, func: Callable[[sqlite3.Connection], Any]) -> Any:
+        self._own_queries += 1
+        return await self.db.pool.write(func)
+
+    # Планирование
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                await self._measure()
+                if self._job is None or self._job.done():
+                    self._start_due()
+            except Exception:
+                logger.exception("Ошибка планирования обслуживания базы данных")
+
+    async def _measure(self) -> None:
+        """Нагрузка на базу за последний интервал, задержка пробного запроса и пауза между шагами"""
+        started = time.perf_counter()
+        await self._read(lambda conn: conn.execute(PROBE_SQL, ("",)).fetchone())
+        finished = time.perf_counter()
+        latency = finished - started
+
+        queries = self.db.pool.queries - self._own_queries
+        rate = (queries - self._queries) / max(finished - self._measured_at, 1e-3)
+        self._queries, self._measured_at = queries, finished
+        self.rate = rate if not self.rate else self.rate * 0.5 + rate * 0.5
+        self.busy = self.rate >= self.quiet_rate
+
+        state = BUSY if self.running else IDLE
+        if state == IDLE:
+            self.probe_idle = latency if not self.probe_idle else self.probe_idle * 0.9 + latency * 0.1
+        else:
+            self.probe_busy = latency if not self.probe_busy else self.probe_busy * 0.9 + latency * 0.1
+            # Замедление, пока обслуживание заметно на задержке запросов или нагрузка высокая
+            if self.busy or latency > self.probe_idle * self.latency_factor + 0.001:
+                self.pause = min(self.pause * 2, self.max_pause)
+            else:
+                self.pause = max(self.pause / 2, self.min_pause)
+        if self.observer is not None:
+            self.observer(state, latency)
+
+    def _start_due(self) -> None:
+        """Запуск одной назревшей операции, если база не нагружена"""
+        now = time.time()
+        jobs = []
+        if self.backup_dir and (self._backup_requested or now >= self._next_backup):
+            jobs.append(("backup", self._backup))
+        # Перевод после назревшей копии, чтобы перед полным VACUUM была свежая копия
+        if self._conversion_requested:
+            jobs.append(("convert", self._convert))
+        if now >= self._next_checkpoint:
+            jobs.append(("checkpoint", self._checkpoint))
+        if now >= self._next_analyze:
+            jobs.append(("analyze", self._analyze))
+        if self.auto_vacuum == AUTO_VACUUM_INCREMENTAL and self.free_pages >= self.vacuum_pages:
+            jobs.append(("vacuum", self._vacuum))
+        if not jobs:
+            return
+        name, job = jobs[0]
+        # Копия по запросу администратора не ждет тихого периода (но замедляется под нагрузкой)
+        if self.busy and not (name == "backup" and self._backup_requested):
+            self.deferred += 1
+            return
+        self._job = asyncio.create_task(self._run_job(name, job))
+
+    async def _run_job(self, name: str, job: Callable[[], Any]) -> None:
+        self.running = name
+        self.pause = self.max_pause if self.busy else self.min_pause
+        try:
+            await job()
+        except Exception:
+            # Прерванная остановкой бота операция ошибкой не считается
+            if not self._stopping:
+                logger.exception("Ошибка обслуживания базы данных (%s)", name)
+        finally:
+            self.running = None
+
+    def _throttle(self, raising: bool = True) -> bool:
+        """
+        Пауза между шагами (в потоке обслуживания). При остановке бота -
+        _Cancelled или True для обработчика прогресса SQLite (прерывает запрос)
+        """
+        if self._stopping:
+            if raising:
+                raise _Cancelled()
+            return True
+        time.sleep(self.pause)
+        return False
+
+    # Резервные копии
+
+    def _backups(self) -> list:
+        stem = os.path.splitext(os.path.basename(self.db.db_path))[0]
+        return sorted(glob.glob(os.path.join(glob.escape(self.backup_dir), f"{stem}-*.db.gz")))
+
+    async def _backup(self) -> None:
+        self._backup_requested = False
+        self._next_backup = time.time() + self.backup_interval
+        stem = os.path.splitext(os.path.basename(self.db.db_path))[0]
+        path = os.path.join(self.backup_dir, f"{stem}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.db.gz")
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        try:
+            pages, size = await loop.run_in_executor(self._executor, self._write_backup, path)
+        except Exception:
+            if not self._stopping:
+                self.backup_failures += 1
+            raise
+        self.backups += 1
+        self.last_backup, self.last_backup_at = os.path.basename(path), time.time()
+        self.last_backup_seconds = time.perf_counter() - started
+        self.last_backup_size, self.database_size = os.path.getsize(path), size
+        logger.info("Резервная копия базы %s: %d страниц, %.1f МБ сжато за %.1f с",
+                    path, pages, self.last_backup_size / 2 ** 20, self.last_backup_seconds)
+
+        # Ротация: старые копии сверх keep удаляются
+        for old in self._backups()[:-self.keep] if self.keep > 0 else []:
+            try:
+                os.remove(old)
+            except OSError:
+                logger.warning("Не удалось удалить старую резервную копию %s", old)
+
+    def _write_backup(self, path: str) -> Tuple[int, int]:
+        """
+        Копия базы во временный файл по step_pages страниц с паузами, проверка
+        копии и сжатие. Возвращает число страниц и размер несжатой копии
+        """
+        copy, part = path[:-len(".gz")] + ".tmp", path + ".part"
+        try:
+            target = sqlite3.connect(copy, check_same_thread=False)
+            try:
+                source = sqlite3.connect(self.db.db_path, isolation_level=None, check_same_thread=False)
+                try:
+                    source.execute("PRAGMA busy_timeout = 5000")
+                    # Снимок фиксируется открытой транзакцией чтения: без нее любая запись
+                    # другого соединения между шагами начинает копирование заново
+                    source.execute("BEGIN")
+                    source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+                    source.backup(target, pages=self.step_pages, progress=lambda *_: self._throttle())
+                    source.execute("COMMIT")
+                finally:
+                    source.close()
+                # Копия открывается без файлов WAL рядом с ней
+                target.execute("PRAGMA journal_mode = DELETE")
+                pages = target.execute("PRAGMA page_count").fetchone()[0]
+                # Проверка тоже идет с паузами: обработчик прогресса вызывается
+                # каждые check_steps инструкций SQLite
+                target.set_progress_handler(lambda: self._throttle(raising=False), self.check_steps)
+                check = target.execute("PRAGMA quick_check").fetchone()[0]
+            finally:
+                target.close()
+            if check != "ok":
+                raise RuntimeError(f"Резервная копия не прошла проверку: {check}")
+
+            # Первый уровень сжатия: файл почти того же размера, что на уровне 6, втрое быстрее
+            with open(copy, "rb") as raw, gzip.open(part, "wb", compresslevel=1) as packed:
+                while True:
+                    chunk = raw.read(1 << 20)
+                    if not chunk:
+                        break
+                    packed.write(chunk)
+                    self._throttle()
+            os.replace(part, path)
+            return pages, os.path.getsize(copy)
+        finally:
+            for leftover in (copy, part):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+    # Контрольные точки, статистика и свободные страницы
+
+    async def _checkpoint(self) -> None:
+        """Перенос WAL в файл базы без блокировки читателей и писателя (PASSIVE)"""
+        self._next_checkpoint = time.time() + self.checkpoint_interval
+        loop = asyncio.get_running_loop()
+        busy, log, checkpointed = await loop.run_in_executor(self._executor, self._run_checkpoint)
+        self.checkpoints += 1
+        self.wal_pages = max(log - checkpointed, 0) if log >= 0 else 0
+
+    def _run_checkpoint(self) -> Tuple[int, int, int]:
+        conn = sqlite3.connect(self.db.db_path, isolation_level=None, check_same_thread=False)
+        try:
+            conn.execute("PRAGMA busy_timeout = 5000")
+            return tuple(conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone())
+        finally:
+            conn.close()
+
+    async def _analyze(self) -> None:
+        """
+        Статистика для планировщика запросов; analysis_limit ограничивает
+        число просматриваемых строк индекса, поэтому запись короткая на любой базе
+        """
+        self._next_analyze = time.time() + self.analyze_interval
+
+        def analyze(conn: sqlite3.Connection) -> None:
+            conn.execute(f"PRAGMA analysis_limit = {self.analysis_limit}")
+            conn.execute("ANALYZE")
+
+        await self._write(analyze)
+        self.analyzes += 1
+        self.auto_vacuum, self.free_pages = await self._write(_vacuum_state)
+
+    async def _vacuum(self) -> None:
+        """Возврат свободных страниц файлу по vacuum_step за транзакцию писателя, с паузами"""
+        def vacuum(conn: sqlite3.Connection) -> int:
+            # incremental_vacuum освобождает по странице на каждый шаг запроса, а execute()
+            # делает только первый шаг запроса без столбцов; executescript() выполняет его до конца
+            conn.executescript(f"PRAGMA incremental_vacuum({self.vacuum_step});")
+            return conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+        while self.free_pages >= self.vacuum_step and not self.busy:
+            free = await self._write(vacuum)
+            self.vacuumed_pages += self.free_pages - free
+            self.free_pages = free
+            await asyncio.sleep(self.pause)
+        self.auto_vacuum, self.free_pages = await self._write(_vacuum_state)
+
+    async def _convert(self) -> None:
+        """Включение auto_vacuum = INCREMENTAL: режим меняется только вместе с полным VACUUM"""
+        self._conversion_requested = False
+
+        def convert(conn: sqlite3.Connection) -> Tuple[int, int]:
+            # VACUUM не выполняется внутри транзакции; executescript() выполняет
+            # запросы вне нее (незавершенную транзакцию сначала фиксирует)
+            conn.executescript("PRAGMA auto_vacuum = INCREMENTAL; VACUUM;")
+            return _vacuum_state(conn)
+
+        started = time.perf_counter()
+        self.auto_vacuum, self.free_pages = await self._write(convert)
+        if self.auto_vacuum == AUTO_VACUUM_INCREMENTAL:
+            self.conversions += 1
+        logger.info("База переведена в auto_vacuum = %d за %.1f с", self.auto_vacuum, time.perf_counter() - started)
+
+    def stats(self) -> Dict[str, Any]:
+        """Нагрузка, влияние обслуживания на задержку пробного запроса и итоги операций"""
+        return {
+            "running": self.running or "",
+            "rate": self.rate,
+            "busy": int(self.busy),
+            "pause": self.pause,
+            "probe_idle": self.probe_idle,
+            "probe_busy": self.probe_busy,
+            "deferred": self.deferred,
+            "backups": self.backups,
+            "backup_failures": self.backup_failures,
+            "last_backup": self.last_backup or "",
+            "last_backup_age": time.time() - self.last_backup_at if self.last_backup_at else 0.0,
+            "last_backup_seconds": self.last_backup_seconds,
+            "last_backup_size": self.last_backup_size,
+            "database_size": self.database_size,
+            "checkpoints": self.checkpoints,
+            "wal_pages": self.wal_pages,
+            "analyzes": self.analyzes,
+            "auto_vacuum": self.auto_vacuum,
+            "vacuum_enabled": int(self.auto_vacuum == AUTO_VACUUM_INCREMENTAL),
+            "conversion_requested": int(self._conversion_requested),
+            "conversions": self.conversions,
+            "free_pages": self.free_pages,
+            "vacuumed_pages": self.vacuumed_pages,
+        }
+
+
+def _vacuum_state(conn: sqlite3.Connection) -> Tuple[int, int]:
+    """
+    Режим auto_vacuum и число свободных страниц. Читается соединением писателя:
+    соединения читателей, открытые до VACUUM, показывают прежний режим
+    """
+    return (conn.execute("PRAGMA auto_vacuum").fetchone()[0],
+            conn.execute("PRAGMA freelist_count").fetchone()[0])
+
+
+def _lower_priority() -> None:
+    """
+    Поток обслуживания уступает процессор обработчикам апдейтов
+    (в Linux приоритет задается каждому потоку отдельно)
+    """
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+    except (AttributeError, OSError):
+        pass
@@ -0,0 +1,102 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Sequence
+
+
+class PriorityScheduler:
+    """
+    Ограничение числа одновременно выполняемых задач с приоритетами классов.
+    Всего выполняется не больше concurrency задач, из них не больше limits[класс]
+    одного класса. Освободившееся место получает ожидающая задача самого
+    важного класса (классы перечислены в priorities по убыванию важности),
+    внутри класса - по очереди. Если лимиты менее важных классов меньше
+    concurrency, часть мест всегда остается для более важных.
+    observer(класс, ожидание) вызывается при каждом допуске (для метрик).
+    """
+
+    def __init__(self, concurrency: int, limits: Dict[str, int], priorities: Sequence[str],
+                 clock: Callable[[], float] = time.perf_counter):
+        self.concurrency = concurrency
+        self.priorities = tuple(priorities)
+        self.limits = {name: min(limits.get(name, concurrency), concurrency) for name in self.priorities}
+        self._clock = clock
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {name: deque() for name in self.priorities}
+        # Очереди класса и всех более важных классов
+        self._ahead = {name: [self._waiters[other] for other in self.priorities[:index + 1]]
+                       for index, name in enumerate(self.priorities)}
+        self.running = {name: 0 for name in self.priorities}
+        self.total = 0
+        self.admitted = {name: 0 for name in self.priorities}
+        self.waited = {name: 0 for name in self.priorities}
+        self.wait_total = {name: 0.0 for name in self.priorities}
+        self.wait_max = {name: 0.0 for name in self.priorities}
+        self.observer: Optional[Callable[[str, float], None]] = None
+
+    def _dispatch(self) -> None:
+        """Раздача свободных мест ожидающим по приоритету"""
+        for name in self.priorities:
+            waiters = self._waiters[name]
+            while waiters and self.total < self.concurrency and self.running[name] < self.limits[name]:
+                future = waiters.popleft()
+                if future.done():
+                    # Ожидание отменено
+                    continue
+                self.running[name] += 1
+                self.total += 1
+                future.set_result(None)
+            if self.total >= self.concurrency:
+                return
+
+    def _record(self, name: str, wait: float) -> None:
+        self.admitted[name] += 1
+        if wait > 0.001:
+            self.waited[name] += 1
+        self.wait_total[name] += wait
+        if wait > self.wait_max[name]:
+            self.wait_max[name] = wait
+        if self.observer is not None:
+            self.observer(name, wait)
+
+    async def acquire(self, name: str) -> float:
+        """Ожидание места для задачи класса name, возвращает время ожидания в секундах"""
+        # Свободное место без очереди впереди выдается сразу, без ожидания цикла событий
+        if self.total < self.concurrency and self.running[name] < self.limits[name] and not any(self._ahead[name]):
+            self.running[name] += 1
+            self.total += 1
+            self._record(name, 0.0)
+            return 0.0
+
+        started = self._clock()
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[name].append(future)
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Место могло быть выдано одновременно с отменой - возвращаем его
+            if future.done() and not future.cancelled():
+                self.release(name)
+            raise
+        wait = self._clock() - started
+        self._record(name, wait)
+        return wait
+
+    def release(self, name: str) -> None:
+        """Задача класса name завершилась"""
+        self.running[name] -= 1
+        self.total -= 1
+        self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        """Выполняются и ждут сейчас, допущено и время ожидания по классам"""
+        return {
+            "running": dict(self.running),
+            "waiting": {name: sum(not future.done() for future in waiters)
+                        for name, waiters in self._waiters.items()},
+            "admitted": dict(self.admitted),
+            "waited": dict(self.waited),
+            "avg_wait": {name: self.wait_total[name] / self.admitted[name] if self.admitted[name] else 0.0
+                         for name in self.priorities},
+            "max_wait": dict(self.wait_max),
+        }
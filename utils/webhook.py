@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import signal
+from typing import Any, List
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiogram.webhook.aiohttp_server import setup_application
+
+logger = logging.getLogger(__name__)
+
+# Заголовок, в котором Telegram передает секрет вебхука
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """
+    Прием апдейтов по вебхуку.
+    Запрос сразу получает ответ, а апдейт попадает в очередь ограниченного
+    размера, которую разбирает пул обработчиков. Если очередь заполнена,
+    Telegram получает 503 и повторит доставку позже (обратное давление).
+    При остановке новые апдейты не принимаются, а очередь дорабатывается.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, path: str = "/webhook", secret: str = "",
+                 workers: int = 32, queue_size: int = 1000, drain_timeout: float = 30):
+        self.dp = dp
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.workers = workers
+        self.drain_timeout = drain_timeout
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._tasks: List[asyncio.Task] = []
+        self._closing = False
+        self.accepted = 0
+        self.rejected = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """Обработчик POST-запроса от Telegram"""
+        if self.secret and request.headers.get(SECRET_HEADER) != self.secret:
+            return web.Response(status=401)
+        if self._closing:
+            return web.Response(status=503)
+
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        try:
+            self.queue.put_nowait(data)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return web.Response(status=503)
+
+        self.accepted += 1
+        return web.Response()
+
+    async def _worker(self) -> None:
+        while True:
+            data = await self.queue.get()
+            try:
+                update = Update.model_validate(data, context={"bot": self.bot})
+                await self.dp.feed_update(self.bot, update, dispatcher=self.dp)
+            except Exception:
+                logger.exception("Ошибка обработки апдейта из вебхука")
+            finally:
+                self.queue.task_done()
+
+    async def on_startup(self, app: web.Application) -> None:
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def on_shutdown(self, app: web.Application) -> None:
+        """Дообработка очереди перед остановкой"""
+        self._closing = True
+        try:
+            await asyncio.wait_for(self.queue.join(), self.drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Не дождались обработки %s апдейтов при остановке", self.queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def setup(self, app: web.Application) -> None:
+        """Регистрация маршрута и обработчиков запуска/остановки в приложении aiohttp"""
+        app.router.add_post(self.path, self.handle)
+        app.on_startup.append(self.on_startup)
+        # Очередь дорабатывается до остановки диспетчера, которая закрывает базу данных
+        app.on_shutdown.append(self.on_shutdown)
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, url: str, path: str, host: str, port: int,
+                      secret: str = "", workers: int = 32, queue_size: int = 1000,
+                      **kwargs: Any) -> None:
+    """Запуск бота в режиме вебхука до получения SIGINT/SIGTERM"""
+    server = WebhookServer(dp, bot, path, secret, workers, queue_size)
+    app = web.Application()
+    server.setup(app)
+    setup_application(app, dp, bot=bot, **kwargs)
+
+    async def set_webhook() -> None:
+        await bot.set_webhook(
+            url.rstrip("/") + path,
+            secret_token=secret or None,
+            allowed_updates=dp.resolve_used_update_types(),
+            max_connections=100
+        )
+    dp.startup.register(set_webhook)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logger.info("Вебхук слушает %s:%s%s", host, port, path)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # Windows: остановка по KeyboardInterrupt
+            pass
+
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+        await bot.session.close()
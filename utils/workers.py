@@ -0,0 +1,221 @@
+import asyncio
+import logging
+import multiprocessing
+import queue as queue_module
+import signal
+import threading
+from multiprocessing.process import BaseProcess
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+# Метка остановки в очереди процесса-обработчика
+STOP = None
+
+
+class Partition:
+    """Пользователи, апдейты которых обрабатывает один процесс: user_id % count == index"""
+
+    def __init__(self, index: int, count: int):
+        self.index = index
+        self.count = count
+
+    def owns(self, user_id: int) -> bool:
+        return user_id % self.count == self.index
+
+
+def update_user_id(update: Update) -> int:
+    """Пользователь, от которого пришел апдейт (или чат, если пользователя нет)"""
+    try:
+        event = update.event
+    except Exception:
+        return 0
+    user = getattr(event, "from_user", None)
+    if user is not None:
+        return user.id
+    chat = getattr(event, "chat", None)
+    return chat.id if chat is not None else 0
+
+
+class WorkerPool:
+    """
+    Процессы-обработчики апдейтов для режима с несколькими процессами.
+    Процесс-приемщик (polling или вебхук) распределяет апдейты по user_id,
+    поэтому состояние FSM, антифлуд и кэши пользователя живут в одном процессе.
+    Апдейт передается в JSON через очередь процесса ограниченного размера:
+    если обработчик не успевает, приемщик ждет (обратное давление).
+    Завершившийся с ошибкой процесс перезапускается.
+
+    target(index, count, queue, processed, ready, *args) - точка входа процесса,
+    она должна вызвать serve_queue().
+    """
+
+    def __init__(self, target: Callable[..., None], workers: int, queue_size: int = 1000,
+                 args: tuple = (), check_interval: float = 1.0):
+        self._context = multiprocessing.get_context("spawn")
+        self.target = target
+        self.workers = workers
+        self.args = args
+        self.check_interval = check_interval
+        self.queues = [self._context.Queue(queue_size) for _ in range(workers)]
+        # Сколько апдейтов обработал каждый процесс (пишет только сам процесс)
+        self.processed = [self._context.Value("Q", 0, lock=False) for _ in range(workers)]
+        # Процесс запустил диспетчер и принимает апдейты
+        self.ready = [self._context.Event() for _ in range(workers)]
+        self.processes: List[Optional[BaseProcess]] = [None] * workers
+        self.forwarded = [0] * workers
+        self.restarts = 0
+        self._stopping = False
+        self._monitor_task: Optional[asyncio.Task] = None
+
+    def _spawn(self, index: int) -> None:
+        self.ready[index].clear()
+        process = self._context.Process(
+            target=self.target,
+            args=(index, self.workers, self.queues[index], self.processed[index], self.ready[index], *self.args),
+            name=f"moviebot-worker-{index}",
+        )
+        process.start()
+        self.processes[index] = process
+
+    async def start(self) -> None:
+        """Запуск процессов-обработчиков"""
+        for index in range(self.workers):
+            self._spawn(index)
+        self._monitor_task = asyncio.create_task(self._monitor())
+        logger.info("Запущено процессов-обработчиков: %s", self.workers)
+
+    async def wait_ready(self) -> None:
+        """Ожидание запуска диспетчеров во всех процессах"""
+        loop = asyncio.get_running_loop()
+        for event in self.ready:
+            await loop.run_in_executor(None, event.wait)
+
+    async def send(self, index: int, payload: str) -> None:
+        """Передача апдейта процессу index (ждет, пока в его очереди не появится место)"""
+        queue = self.queues[index]
+        while True:
+            try:
+                queue.put_nowait(payload)
+                break
+            except queue_module.Full:
+                await asyncio.sleep(0.005)
+        self.forwarded[index] += 1
+
+    async def forward(self, handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+                      event: Update, data: Dict[str, Any]) -> Any:
+        """Outer-middleware апдейтов приемщика: вместо обработки апдейт уходит процессу пользователя"""
+        index = update_user_id(event) % self.workers
+        await self.send(index, event.model_dump_json(by_alias=True, exclude_unset=True))
+
+    async def _monitor(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            for index, process in enumerate(self.processes):
+                if process is not None and not process.is_alive() and not self._stopping:
+                    logger.error("Процесс-обработчик %s завершился с кодом %s, перезапуск",
+                                 index, process.exitcode)
+                    self.restarts += 1
+                    self._spawn(index)
+
+    async def stop(self, timeout: float = 60) -> None:
+        """Остановка: каждый процесс дорабатывает свою очередь и записывает отложенные данные"""
+        self._stopping = True
+        if self._monitor_task is not None:
+            self._monitor_task.cancel()
+            await asyncio.gather(self._monitor_task, return_exceptions=True)
+
+        loop = asyncio.get_running_loop()
+        for queue in self.queues:
+            await loop.run_in_executor(None, queue.put, STOP)
+        for index, process in enumerate(self.processes):
+            if process is None:
+                continue
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                logger.warning("Процесс-обработчик %s не остановился за %s с", index, timeout)
+                process.terminate()
+                await loop.run_in_executor(None, process.join)
+        for queue in self.queues:
+            queue.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Переданные и обработанные апдейты по процессам"""
+        processed = [value.value for value in self.processed]
+        return {
+            "workers": self.workers,
+            "forwarded": sum(self.forwarded),
+            "processed": sum(processed),
+            "backlog": sum(self.forwarded) - sum(processed),
+            "restarts": self.restarts,
+            "forwarded_by_worker": {str(index): count for index, count in enumerate(self.forwarded)},
+        }
+
+
+def ignore_stop_signals() -> None:
+    """
+    SIGINT и SIGTERM получает вся группа процессов; процесс-обработчик
+    останавливается только по метке STOP от приемщика, чтобы доработать очередь
+    """
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, signal.SIG_IGN)
+
+
+async def serve_queue(dp: Dispatcher, bot: Bot, queue: Any, processed: Any = None, ready: Any = None,
+                      concurrency: int = 32) -> None:
+    """
+    Работа процесса-обработчика: запуск диспетчера, обработка апдейтов из очереди
+    приемщика в concurrency параллельных задачах и остановка по метке STOP
+    (или если приемщик завершился, не отправив ее)
+    """
+    loop = asyncio.get_running_loop()
+    pending: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    stopped = asyncio.Event()
+    parent = multiprocessing.parent_process()
+
+    def read() -> None:
+        # Блокирующее чтение из межпроцессной очереди в отдельном потоке
+        while True:
+            try:
+                payload = queue.get(timeout=1.0)
+            except queue_module.Empty:
+                if parent is not None and not parent.is_alive():
+                    logger.warning("Процесс-приемщик завершился, остановка")
+                    break
+                continue
+            if payload is STOP:
+                break
+            asyncio.run_coroutine_threadsafe(pending.put(payload), loop).result()
+        loop.call_soon_threadsafe(stopped.set)
+
+    async def work() -> None:
+        while True:
+            payload = await pending.get()
+            try:
+                update = Update.model_validate_json(payload, context={"bot": bot})
+                await dp.feed_update(bot, update, dispatcher=dp)
+            except Exception:
+                logger.exception("Ошибка обработки апдейта")
+            finally:
+                if processed is not None:
+                    processed.value += 1
+                pending.task_done()
+
+    await dp.emit_startup(bot=bot, bots=[bot], dispatcher=dp)
+    tasks = [asyncio.create_task(work()) for _ in range(concurrency)]
+    threading.Thread(target=read, name="worker-queue-reader", daemon=True).start()
+    if ready is not None:
+        ready.set()
+
+    try:
+        await stopped.wait()
+        await pending.join()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await dp.emit_shutdown(bot=bot, bots=[bot], dispatcher=dp)
+        await bot.session.close()